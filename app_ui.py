@@ -3,18 +3,41 @@ import sys
 from pathlib import Path
 import json
 import pandas as pd
-import subprocess # --- NEW: Import subprocess
+import threading
+import time
 
 # --- Add project root to path to allow imports ---
 PROJECT_ROOT = str(Path(__file__).resolve().parent)
 if PROJECT_ROOT not in sys.path:
     sys.path.append(PROJECT_ROOT)
 
-from src.workflows.dispute_resolution_workflow import resolve_dispute
+from src.workflows.dispute_resolution_workflow import warm_up_agents
+from src.workflows.job_queue import JOB_POLL_SECONDS, JOB_WORKERS_IN_PROCESS, WorkerPool, get_job_queue
+from src.instrumentation import start_metrics_server
+from src.human_action_handler import dispute_id_for, get_human_action_service
 
 # --- Streamlit Page Configuration ---
 st.set_page_config(page_title="Auto Dispute Resolution", layout="wide")
 
+# --- Warm up the shared agent pool once per server process (not per session) ---
+@st.cache_resource
+def start_agent_warm_up():
+    thread = threading.Thread(target=warm_up_agents, name="agent-warm-up", daemon=True)
+    thread.start()
+    # Prometheus /metrics endpoint, only if METRICS_PROMETHEUS_PORT is set
+    start_metrics_server()
+    return thread
+
+start_agent_warm_up()
+
+# --- Disputes run on the job queue's workers, not in the browser session's script thread ---
+@st.cache_resource
+def start_job_workers():
+    # By default the workers run in their own processes: `python -m src.workflows.job_queue --workers N`
+    return WorkerPool(get_job_queue()).start() if JOB_WORKERS_IN_PROCESS else None
+
+start_job_workers()
+
 # --- State Management for Page Views ---
 if 'page_view' not in st.session_state:
     st.session_state.page_view = 'main'
@@ -22,6 +45,7 @@ if 'page_view' not in st.session_state:
     st.session_state.original_prompt = None
     # --- NEW: State to track if the workflow is active ---
     st.session_state.analysis_running = False
+    st.session_state.job_id = None
 
 def reset_to_main_view():
     """Resets the view to the main analysis page."""
@@ -30,6 +54,26 @@ def reset_to_main_view():
     st.session_state.original_prompt = None
     # --- NEW: Reset the analysis state ---
     st.session_state.analysis_running = False
+    st.session_state.job_id = None
+
+HUMAN_ACTION_OUTCOMES = {
+    "approve": ("approved", {"dispute_status": "Accepted (Human Approved)", "reason": "Refund approved by operator.", "recommended_action": "Refund has been processed."}),
+    "reject": ("rejected", {"dispute_status": "Rejected (Human Override)", "reason": "Refund rejected by operator.", "recommended_action": "No further action required."}),
+}
+
+def record_human_action(action, data, prompt):
+    """
+    Hands the operator decision to the in-process action service (durably logged,
+    processed by a background worker) and switches to the confirmation page.
+    An approval request that was already decided keeps its first decision.
+    """
+    decision = get_human_action_service().submit(action, data, dispute_id_for(prompt))
+    page_view, outcome = HUMAN_ACTION_OUTCOMES[decision.action]
+    st.session_state.final_outcome = dict(outcome)
+    if decision.duplicate:
+        st.session_state.final_outcome["reason"] += f" (already decided at {decision.decided_at})"
+    st.session_state.page_view = page_view
+    st.session_state.analysis_running = False
 
 # --- Custom CSS for colored status boxes and layout adjustments ---
 st.markdown("""
@@ -90,6 +134,15 @@ def render_confirmation_page():
     })
     st.table(decision_df.set_index("Metric"))
 
+def db_result_frames(db_result):
+    """Turns a DbQueryResult into one DataFrame per Live Data Feed table."""
+    sections = db_result.to_dict()
+    return {
+        "User Info": pd.DataFrame([sections["user_info"]]).drop(columns="extra"),
+        "Account Usage": pd.DataFrame(sections["account_usage"]).drop(columns="extra", errors="ignore"),
+        "Transactions": pd.DataFrame(sections["transactions"]).drop(columns="extra", errors="ignore"),
+    }
+
 # --- NEW: Function to render the main analysis page ---
 def render_main_page(approval_threshold):
     """Displays the main analysis workflow UI."""
@@ -121,12 +174,20 @@ The reference transaction number: P-1234567890 Account Number: 5931479520
         else:
             st.session_state.analysis_running = True
             st.session_state.original_prompt = user_prompt # Store prompt
+            # Queued once; every rerun below only reads the job's stored results
+            st.session_state.job_id = get_job_queue().submit(user_prompt, approval_threshold).job_id
             st.rerun() # Rerun to start the analysis flow
 
     # --- MODIFIED: The workflow now runs if the state is set, not just on button click ---
     if st.session_state.analysis_running:
         # Use the stored prompt for the analysis
         prompt_for_analysis = st.session_state.original_prompt
+        job_queue = get_job_queue()
+        job = job_queue.get(st.session_state.job_id)
+        if job is None:
+            st.error("The analysis job was not found in the job queue. Please analyze the dispute again.")
+            st.session_state.analysis_running = False
+            return
 
         st.subheader("Workflow Progress")
         progress_cols = st.columns(len(AGENT_STEPS))
@@ -157,125 +218,190 @@ The reference transaction number: P-1234567890 Account Number: 5931479520
         output_container = st.container()
         final_decision_placeholder = st.empty()
         final_decision = {}
+        # Per step: its output expander and the placeholder its streamed answer is written to
+        step_expanders = {}
+        stream_placeholders = {}
+        streamed_text = {}
+        i = -1
         
-        with st.spinner("Analyzing dispute..."):
-            try:
-                # --- MODIFIED: Use the stored prompt ---
-                for i, result in enumerate(resolve_dispute(prompt_for_analysis, approval_threshold)):
-                    current_step_name = result["step_name"]
-                    data = result["data"]
-                    is_final = result["is_final"]
-                    current_label = AGENT_STEPS.get(current_step_name, "")
-
-                    if current_step_name in progress_boxes:
-                        progress_boxes[current_step_name].markdown(
-                            f'<div class="status-box status-in-progress"><b>{current_label} ⏳</b></div>',
-                            unsafe_allow_html=True
-                        )
+        if job.status == "queued":
+            if job_queue.active_workers() == 0:
+                st.error("No dispute worker is running, so this dispute will stay queued. "
+                         "Start one with `python -m src.workflows.job_queue --workers 4`.")
+            else:
+                st.info(f"Dispute queued ({job_queue.position(job.job_id)} ahead)...")
+        elif job.status == "running":
+            st.caption(f"Analyzing dispute... (job {job.job_id[:8]}, attempt {job.attempts})")
+        # Steps finished so far, then the partial answer of the step that is running
+        job_results = job_queue.updates(job.job_id)
+        job_results += [{"step_name": name, "partial": True, "text": text} for name, text in job.live.items()]
+
+        try:
+            for result in job_results:
+                current_step_name = result["step_name"]
+                current_label = AGENT_STEPS.get(current_step_name, "")
 
-                    if i > 0:
-                        previous_step_name = AGENT_STEP_NAMES[i-1]
-                        previous_label = AGENT_STEPS.get(previous_step_name, "")
-                        if previous_step_name in progress_boxes:
-                            progress_boxes[previous_step_name].markdown(
-                                f'<div class="status-box status-completed"><b>{previous_label} ✅</b></div>',
+                # --- Partial answer of a running agent: show it as it is generated ---
+                if result.get("partial"):
+                    if current_step_name not in step_expanders:
+                        if current_step_name in progress_boxes:
+                            progress_boxes[current_step_name].markdown(
+                                f'<div class="status-box status-in-progress"><b>{current_label} ⏳</b></div>',
                                 unsafe_allow_html=True
                             )
-                    
-                    if current_step_name == "DB Agent: Customer Data":
-                        try:
-                            json_start = data.find('{')
-                            json_end = data.rfind('}') + 1
-                            if json_start != -1:
-                                db_data = json.loads(data[json_start:json_end])
-                                user_info_placeholder.dataframe(pd.DataFrame([db_data.get("user_info")]), hide_index=True, use_container_width=True)
-                                usage_placeholder.dataframe(pd.DataFrame([db_data.get("account_usage")]), hide_index=True, use_container_width=True)
-                                trans_list = db_data.get("transactions", [])
-                                transactions_placeholder.dataframe(pd.DataFrame(trans_list if isinstance(trans_list, list) else [trans_list]), hide_index=True, use_container_width=True)
-                            else:
-                                user_info_placeholder.markdown("*Could not parse DB Agent output.*")
-                        except (json.JSONDecodeError, AttributeError):
-                            user_info_placeholder.markdown("*Error displaying DB data.*")
-                    
-                    # --- MODIFIED: Moved output log rendering before the break logic ---
-                    with output_container:
-                        with st.expander(f"Output from: **{current_step_name}**", expanded=False):
-                            if current_step_name == "Classification Agent: Issue Type":
-                                st.write(data)
-                            elif current_step_name == "RAG Agent: Terms & Conditions":
-                                st.write(data)
-                            elif current_step_name == "DB Agent: Customer Data":
-                                try:
-                                    json_start = data.find('{')
-                                    json_end = data.rfind('}') + 1
-                                    if json_start != -1:
-                                        db_data = json.loads(data[json_start:json_end])
-                                        user_info = db_data.get("user_info")
-                                        if user_info:
-                                            st.write("**User Info**")
-                                            st.dataframe(pd.DataFrame([user_info]), hide_index=True, use_container_width=True)
-                                        account_usage = db_data.get("account_usage")
-                                        if account_usage:
-                                            st.write("**Account Usage**")
-                                            st.dataframe(pd.DataFrame([account_usage]), hide_index=True, use_container_width=True)
-                                        transactions = db_data.get("transactions")
-                                        if transactions:
-                                            st.write("**Transactions**")
-                                            trans_list = transactions if isinstance(transactions, list) else [transactions]
-                                            st.dataframe(pd.DataFrame(trans_list), hide_index=True, use_container_width=True)
-                                    else:
-                                        st.text(data)
-                                except (json.JSONDecodeError, AttributeError):
-                                    st.text(data)
-                            elif current_step_name == "Human Approval Required":
-                                amount = data.get('dispute_amount', 'N/A')
-                                amount_str = f"${amount:,.2f}" if isinstance(amount, (int, float)) else str(amount)
-                                approval_df = pd.DataFrame({
-                                    "Metric": ["Refund Amount", "AI Recommendation", "Reason", "Suggested Action"],
-                                    "Value": [amount_str, data.get('dispute_status'), data.get('reason'), data.get('recommended_action')]
-                                })
-                                st.table(approval_df.set_index("Metric"))
-                            else:
-                                st.json(data)
-
-                    if current_step_name == "Human Approval Required":
-                        progress_boxes[current_step_name].markdown(
-                            f'<div class="status-box status-action-required"><b>{current_label} ⚠️</b></div>',
+                        with output_container:
+                            step_expanders[current_step_name] = st.expander(
+                                f"Output from: **{current_step_name}**", expanded=True)
+                        with step_expanders[current_step_name]:
+                            stream_placeholders[current_step_name] = st.empty()
+                    streamed_text[current_step_name] = result["text"]
+                    stream_placeholders[current_step_name].markdown(result["text"] + " ▌")
+                    continue
+
+                i += 1
+                data = result["data"]
+                is_final = result["is_final"]
+
+                if current_step_name in progress_boxes:
+                    progress_boxes[current_step_name].markdown(
+                        f'<div class="status-box status-in-progress"><b>{current_label} ⏳</b></div>',
+                        unsafe_allow_html=True
+                    )
+
+                if i > 0:
+                    previous_step_name = AGENT_STEP_NAMES[i-1]
+                    previous_label = AGENT_STEPS.get(previous_step_name, "")
+                    if previous_step_name in progress_boxes:
+                        progress_boxes[previous_step_name].markdown(
+                            f'<div class="status-box status-completed"><b>{previous_label} ✅</b></div>',
                             unsafe_allow_html=True
                         )
-                        with final_decision_placeholder.container():
-                            st.warning("Human approval required for high-value refund.")
+                
+                if current_step_name == "DB Agent: Customer Data":
+                    # `data` is a DbQueryResult, already parsed by the DB step
+                    db_frames = db_result_frames(data)
+                    user_info_placeholder.dataframe(db_frames["User Info"], hide_index=True, use_container_width=True)
+                    usage_placeholder.dataframe(db_frames["Account Usage"], hide_index=True, use_container_width=True)
+                    transactions_placeholder.dataframe(db_frames["Transactions"], hide_index=True, use_container_width=True)
+                
+                # --- MODIFIED: Moved output log rendering before the break logic ---
+                for streamed_step in list(stream_placeholders):
+                    if streamed_step == current_step_name:
+                        # The structured result below replaces the streamed text
+                        stream_placeholders.pop(streamed_step).empty()
+                    else:
+                        # E.g. the LLM answer ahead of "Human Approval Required": keep it, drop the cursor
+                        stream_placeholders.pop(streamed_step).markdown(streamed_text[streamed_step])
+                if current_step_name not in step_expanders:
+                    with output_container:
+                        step_expanders[current_step_name] = st.expander(
+                            f"Output from: **{current_step_name}**", expanded=False)
+                with output_container:
+                    with step_expanders[current_step_name]:
+                        if result.get("from_decision_cache"):
+                            st.caption("⚡ Replayed from an identical earlier dispute (decision cache)")
+                        elif result.get("from_checkpoint"):
+                            st.caption("⚡ Resumed from this dispute's checkpoint")
+                        elif result.get("source") == "policy_index":
+                            st.caption("⚡ Served from the local policy index")
+                        elif result.get("source") == "cache" or result.get("from_cache"):
+                            st.caption("⚡ Served from the RAG answer cache")
+                        metrics = result.get("metrics")
+                        if metrics:
+                            calls = metrics["agent_calls"]
+                            st.caption(
+                                f"Step time: {metrics['wall_seconds']:.2f}s "
+                                f"(queue wait {metrics['queue_wait_seconds']:.2f}s)"
+                                + "".join(f" · {c['agent']}: setup {c['setup_seconds']:.2f}s, run {c['run_seconds']:.2f}s, "
+                                          f"{c['prompt_chars']}→{c['response_chars']} chars, {c['retries']} retries"
+                                          for c in calls)
+                            )
+                        if current_step_name == "Classification Agent: Issue Type":
+                            st.write(data)
+                        elif current_step_name == "RAG Agent: Terms & Conditions":
+                            st.write(data)
+                        elif current_step_name == "DB Agent: Customer Data":
+                            if not data.ok:
+                                st.error(f"DB output could not be fully parsed: {data.parse_error}")
+                            for label, frame in db_result_frames(data).items():
+                                if not frame.empty:
+                                    st.write(f"**{label}**")
+                                    st.dataframe(frame, hide_index=True, use_container_width=True)
+                            if not data.ok and data.raw_text:
+                                st.text(data.raw_text)
+                        elif current_step_name == "Human Approval Required":
                             amount = data.get('dispute_amount', 'N/A')
-                            amount_str = f"${amount:,.2f}" if isinstance(amount, (int, float)) else str(amount)
+                            amount_str = f"${amount:,.2f}" if isinstance(amount, (int, float)) else f"Unknown ({data.get('amount_error', 'N/A')})"
                             approval_df = pd.DataFrame({
                                 "Metric": ["Refund Amount", "AI Recommendation", "Reason", "Suggested Action"],
                                 "Value": [amount_str, data.get('dispute_status'), data.get('reason'), data.get('recommended_action')]
                             })
                             st.table(approval_df.set_index("Metric"))
-                            btn_cols = st.columns(2)
-                            
-                            if btn_cols[0].button("✅ Approve Refund", use_container_width=True):
-                                subprocess.run([sys.executable, "src/human_action_handler.py", "approve", json.dumps(data)])
-                                st.session_state.final_outcome = {"dispute_status": "Accepted (Human Approved)", "reason": "Refund approved by operator.", "recommended_action": "Refund has been processed."}
-                                st.session_state.page_view = 'approved'
-                                st.session_state.analysis_running = False
-                                break
-                            
-                            if btn_cols[1].button("❌ Reject Refund", use_container_width=True):
-                                subprocess.run([sys.executable, "src/human_action_handler.py", "reject", json.dumps(data)])
-                                st.session_state.final_outcome = {"dispute_status": "Rejected (Human Override)", "reason": "Refund rejected by operator.", "recommended_action": "No further action required."}
-                                st.session_state.page_view = 'rejected'
-                                st.session_state.analysis_running = False
-                                break
-                    
-                    if is_final:
-                        final_decision = data
-                        final_label = AGENT_STEPS.get("LLM Agent: Final Decision", "")
-
-            except Exception as e:
-                st.error(f"An error occurred during the workflow: {e}")
-                st.exception(e)
-                st.session_state.analysis_running = False # Reset on error
+                        else:
+                            st.json(data)
+                        prompt_size = result.get("prompt_size")
+                        if prompt_size:
+                            st.caption(
+                                f"Decision prompt: ~{prompt_size['tokens_after']} tokens "
+                                f"(~{prompt_size['tokens_before']} before compaction, "
+                                f"{prompt_size['token_reduction']:.0%} smaller), "
+                                f"T&C clauses kept {prompt_size['terms_clauses_kept']}"
+                            )
+                        if result.get("precedents"):
+                            st.write("**Similar past disputes**")
+                            st.dataframe(pd.DataFrame(result["precedents"]), hide_index=True, use_container_width=True)
+
+                timing = result.get("timing")
+                if timing and timing.get("from_decision_cache"):
+                    with output_container:
+                        st.caption("Workflow replayed from the decision cache, no agents were called")
+                elif timing:
+                    with output_container:
+                        st.caption(
+                            f"Workflow time: {timing['wall_clock_seconds']:.2f}s "
+                            f"(saved {timing['time_saved_seconds']:.2f}s by running DB and RAG agents in parallel)"
+                        )
+
+                if current_step_name == "Human Approval Required":
+                    progress_boxes[current_step_name].markdown(
+                        f'<div class="status-box status-action-required"><b>{current_label} ⚠️</b></div>',
+                        unsafe_allow_html=True
+                    )
+                    with final_decision_placeholder.container():
+                        st.warning("Human approval required for high-value refund.")
+                        amount = data.get('dispute_amount', 'N/A')
+                        amount_str = f"${amount:,.2f}" if isinstance(amount, (int, float)) else f"Unknown ({data.get('amount_error', 'N/A')})"
+                        approval_df = pd.DataFrame({
+                            "Metric": ["Refund Amount", "AI Recommendation", "Reason", "Suggested Action"],
+                            "Value": [amount_str, data.get('dispute_status'), data.get('reason'), data.get('recommended_action')]
+                        })
+                        st.table(approval_df.set_index("Metric"))
+                        btn_cols = st.columns(2)
+                        
+                        if btn_cols[0].button("✅ Approve Refund", use_container_width=True):
+                            record_human_action("approve", data, prompt_for_analysis)
+                            break
+                        
+                        if btn_cols[1].button("❌ Reject Refund", use_container_width=True):
+                            record_human_action("reject", data, prompt_for_analysis)
+                            break
+                
+                if is_final:
+                    final_decision = data
+                    final_label = AGENT_STEPS.get("LLM Agent: Final Decision", "")
+
+        except Exception as e:
+            st.error(f"An error occurred during the workflow: {e}")
+            st.exception(e)
+            st.session_state.analysis_running = False # Reset on error
+
+        if job.status == "failed":
+            st.error(f"An error occurred during the workflow: {job.error}")
+            st.session_state.analysis_running = False
+        elif not job.done and st.session_state.analysis_running:
+            # Poll the job until the workers have finished it
+            time.sleep(JOB_POLL_SECONDS)
+            st.rerun()
 
 # --- Main App Router ---
 st.sidebar.title("Configuration")
@@ -1,9 +1,20 @@
 import requests
 import os
 import json
+import asyncio
+import threading
+import time
+import copy
+import logging
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from oci.addons.adk import Toolkit, tool
 from pathlib import Path
 from dotenv import load_dotenv
+from pydantic import PrivateAttr
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from mcp.server.fastmcp import FastMCP
 
@@ -14,33 +25,223 @@ API_USER = os.getenv("FUSION_API_USER")
 API_PASS = os.getenv("FUSION_API_PASS")
 API_URL = os.getenv("FUSION_API_URL", "https://fa-edtc-dev80-saasfaprod1.fa.ocs.oraclecloud.com")
 
+# --- HTTP session settings (one keep-alive session per Fusion user, shared by all tool instances) ---
+FUSION_CONNECT_TIMEOUT = float(os.getenv("FUSION_CONNECT_TIMEOUT", "5"))
+FUSION_READ_TIMEOUT = float(os.getenv("FUSION_READ_TIMEOUT", "30"))
+FUSION_MAX_RETRIES = int(os.getenv("FUSION_MAX_RETRIES", "3"))
+FUSION_BACKOFF_FACTOR = float(os.getenv("FUSION_BACKOFF_FACTOR", "0.5"))
+FUSION_POOL_SIZE = int(os.getenv("FUSION_POOL_SIZE", "10"))
+# Bulk creation: "concurrent" (parallel POSTs) or "batch" (Fusion REST batch requests)
+FUSION_BULK_MODE = os.getenv("FUSION_BULK_MODE", "concurrent")
+FUSION_BULK_CONCURRENCY = int(os.getenv("FUSION_BULK_CONCURRENCY", "8"))
+FUSION_BATCH_SIZE = int(os.getenv("FUSION_BATCH_SIZE", "50"))
+
+# --- Credit memo lookup cache (memos are effectively immutable once created) ---
+CREDIT_MEMO_CACHE_SIZE = int(os.getenv("CREDIT_MEMO_CACHE_SIZE", "1024"))
+# Entries older than this are revalidated with a conditional GET (If-None-Match); 0 never revalidates
+CREDIT_MEMO_CACHE_REVALIDATE_SECONDS = float(os.getenv("CREDIT_MEMO_CACHE_REVALIDATE_SECONDS", "3600"))
+# Optional JSON file the cache is persisted to (memory only when unset)
+CREDIT_MEMO_CACHE_PATH = os.getenv("CREDIT_MEMO_CACHE_PATH")
+
+REST_ROOT = "/fscmRestApi/resources/latest"
+CREDIT_MEMOS_PATH = "/receivablesCreditMemos"
+BATCH_CONTENT_TYPE = "application/vnd.oracle.adf.batch+json"
+# Statuses of a rejected, unprocessed request: resending a create is safe
+RETRYABLE_CREATE_STATUSES = (429, 503)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_fusion_session(api_user, api_pass, pool_size=FUSION_POOL_SIZE):
+	"""
+	Returns the shared keep-alive `requests.Session` for a Fusion user.
+	Connection errors are retried with backoff for every method; throttling and
+	gateway errors (429/502/503/504) are only retried for GET, because
+	re-sending a POST could create a second credit memo.
+	"""
+	key = (str(api_user), str(api_pass), pool_size)
+	with _sessions_lock:
+		session = _sessions.get(key)
+		if session is None:
+			retry = Retry(
+				total=FUSION_MAX_RETRIES,
+				connect=FUSION_MAX_RETRIES,
+				backoff_factor=FUSION_BACKOFF_FACTOR,
+				status_forcelist=(429, 502, 503, 504),
+				allowed_methods=frozenset({"GET"}),
+				raise_on_status=False,
+			)
+			adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+			session = requests.Session()
+			session.auth = (str(api_user), str(api_pass))
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+			_sessions[key] = session
+	return session
+
+
+def _error_result(e):
+	return {"error": str(e), "status_code": getattr(e.response, "status_code", None)}
+
+
+def _is_retryable(status_code, error=None):
+	"""True when a failed create was never processed (throttled, unavailable, not connected)."""
+	return status_code in RETRYABLE_CREATE_STATUSES or isinstance(error, requests.ConnectTimeout)
+
+
+class CreditMemoCache:
+	"""
+	Bounded LRU cache of credit memos keyed by CustomerTransactionId.
+
+	Filled from `get_credit_memo` responses and from `create_credit_memo`
+	responses, together with the ETag Fusion returned. Entries older than
+	`revalidate_seconds` are revalidated with a conditional GET, so an
+	unchanged memo costs a 304 instead of a full fetch. When `path` is set the
+	cache is written through to a JSON file and reloaded on start.
+	"""
+
+	def __init__(self, max_entries=CREDIT_MEMO_CACHE_SIZE, revalidate_seconds=CREDIT_MEMO_CACHE_REVALIDATE_SECONDS,
+				 path=CREDIT_MEMO_CACHE_PATH):
+		self.max_entries = max(1, max_entries)
+		self.revalidate_seconds = revalidate_seconds
+		self.path = Path(path) if path else None
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "not_modified": 0, "evictions": 0}
+		self._load()
+
+	def _load(self):
+		if self.path is None:
+			return
+		try:
+			with open(self.path, "r", encoding="utf-8") as f:
+				entries = json.load(f)
+		except FileNotFoundError:
+			return
+		except (json.JSONDecodeError, OSError) as e:
+			logging.warning(f"Ignoring unreadable credit memo cache file {self.path}: {e}")
+			return
+		# Saved oldest -> most recently used
+		for key, entry in list(entries.items())[-self.max_entries:]:
+			self._entries[key] = entry
+
+	def _persist(self):
+		"""Atomically rewrites the file; a failed write is logged and the entries stay in memory."""
+		if self.path is None:
+			return
+		tmp_path = None
+		try:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			# A unique temp file per write, so processes sharing the path never replace each other's file
+			with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.path.parent, prefix=self.path.name,
+											 suffix=".tmp", delete=False) as f:
+				tmp_path = f.name
+				json.dump(self._entries, f)
+			os.replace(tmp_path, self.path)
+		except OSError as e:
+			logging.warning(f"Could not write credit memo cache file {self.path}: {e}")
+			if tmp_path and os.path.exists(tmp_path):
+				os.unlink(tmp_path)
+
+	def lookup(self, customer_transaction_id):
+		"""Returns the cached entry ({"memo", "etag", "fetched_at"}) and marks it recently used, or None."""
+		key = str(customer_transaction_id)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.stats["misses"] += 1
+				return None
+			self._entries.move_to_end(key)
+			self.stats["hits"] += 1
+			return entry
+
+	def is_fresh(self, entry):
+		return not self.revalidate_seconds or time.time() - entry["fetched_at"] <= self.revalidate_seconds
+
+	def put(self, customer_transaction_id, memo, etag=None):
+		key = str(customer_transaction_id)
+		with self._lock:
+			self._entries[key] = {"memo": memo, "etag": etag, "fetched_at": time.time()}
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self.stats["evictions"] += 1
+			self._persist()
+
+	def touch(self, customer_transaction_id):
+		"""Records a successful revalidation (304 Not Modified)."""
+		with self._lock:
+			entry = self._entries.get(str(customer_transaction_id))
+			if entry is not None:
+				entry["fetched_at"] = time.time()
+				self.stats["not_modified"] += 1
+				self._persist()
+
+	def invalidate(self, customer_transaction_id=None):
+		with self._lock:
+			if customer_transaction_id is None:
+				self._entries.clear()
+			else:
+				self._entries.pop(str(customer_transaction_id), None)
+			self._persist()
+
+	def __len__(self):
+		return len(self._entries)
+
+
+# Shared by every Credit_Memo_Tool instance
+CREDIT_MEMO_CACHE = CreditMemoCache()
+
+
 class Credit_Memo_Tool(Toolkit):
 	"""
 	Agent tool for creating Oracle Receivables Credit Memos via REST API.
 	"""
-	def __init__(self, api_user=API_USER, api_pass=API_PASS, api_url=API_URL):
+	_api_user: str = PrivateAttr(default=None)
+	_api_pass: str = PrivateAttr(default=None)
+	_api_url: str = PrivateAttr(default=None)
+	_timeout: tuple = PrivateAttr(default=(FUSION_CONNECT_TIMEOUT, FUSION_READ_TIMEOUT))
+	_cache: object = PrivateAttr(default=None)
+
+	def __init__(self, api_user=API_USER, api_pass=API_PASS, api_url=API_URL,
+				 connect_timeout=FUSION_CONNECT_TIMEOUT, read_timeout=FUSION_READ_TIMEOUT,
+				 cache=CREDIT_MEMO_CACHE):
 		super().__init__()
+		self._api_user = api_user
+		self._api_pass = api_pass
+		self._api_url = str(api_url).rstrip("/")
+		self._timeout = (connect_timeout, read_timeout)
+		self._cache = cache  # None disables caching
+
+	def _session(self):
+		if not self._api_user or not self._api_pass:
+			raise ValueError("FUSION_API_USER and FUSION_API_PASS must be set in the environment or provided to Credit_Memo_Tool.")
+		return get_fusion_session(self._api_user, self._api_pass)
 
 	@tool
 	def create_credit_memo(self, payload):
-		if not API_USER or not API_PASS:
-			raise ValueError("FUSION_API_USER and FUSION_API_PASS must be set in the environment or provided to Credit_Memo_Tool.")
-		url = str(API_URL).rstrip("/") + "/fscmRestApi/resources/latest/receivablesCreditMemos"
+		session = self._session()
+		url = self._api_url + REST_ROOT + CREDIT_MEMOS_PATH
 		headers = {
 			"Content-Type": "application/json"
 		}
 		print("Creating Credit Memo at URL:", url)  # Debug statement
 		try:
-			response = requests.post(
+			response = session.post(
 				url,
-				auth=(str(API_USER), str(API_PASS)),
 				headers=headers,
-				data=json.dumps(payload)
+				data=json.dumps(payload),
+				timeout=self._timeout
 			)
 			response.raise_for_status()
-			return response.json()
+			memo = response.json()
 		except requests.RequestException as e:
-			return {"error": str(e), "status_code": getattr(e.response, "status_code", None)}
+			return _error_result(e)
+		# A new memo is looked up again during reconciliation, so keep it
+		if self._cache is not None and isinstance(memo, dict) and memo.get("CustomerTransactionId"):
+			self._cache.put(memo["CustomerTransactionId"], memo, response.headers.get("ETag"))
+		return memo
 
 	@tool
 	def get_credit_memo(self, customer_transaction_id):
@@ -51,23 +252,140 @@ class Credit_Memo_Tool(Toolkit):
 		Returns:
 			dict: API response.
 		"""
-		if not API_USER or not API_PASS:
-			raise ValueError("FUSION_API_USER and FUSION_API_PASS must be set in the environment or provided to Credit_Memo_Tool.")
-		url = str(API_URL).rstrip("/") + f"/fscmRestApi/resources/latest/receivablesCreditMemos/{customer_transaction_id}"
+		entry = self._cache.lookup(customer_transaction_id) if self._cache is not None else None
+		if entry is not None and self._cache.is_fresh(entry):
+			return copy.deepcopy(entry["memo"])
+		session = self._session()
+		url = self._api_url + REST_ROOT + CREDIT_MEMOS_PATH + f"/{customer_transaction_id}"
 		headers = {
 			"Accept": "application/json"
 		}
+		if entry is not None and entry.get("etag"):
+			# Revalidate: Fusion answers 304 if the memo is unchanged
+			headers["If-None-Match"] = entry["etag"]
+			self._cache.stats["revalidated"] += 1
 		print("Fetching Credit Memo from URL:", url)  # Debug statement
 		try:
-			response = requests.get(
+			response = session.get(
 				url,
-				auth=(str(API_USER), str(API_PASS)),
-				headers=headers
+				headers=headers,
+				timeout=self._timeout
 			)
+			if response.status_code == 304 and entry is not None:
+				self._cache.touch(customer_transaction_id)
+				return copy.deepcopy(entry["memo"])
 			response.raise_for_status()
-			return response.json()
+			memo = response.json()
 		except requests.RequestException as e:
-			return {"error": str(e), "status_code": getattr(e.response, "status_code", None)}
+			if entry is not None:
+				logging.warning(f"Serving cached credit memo {customer_transaction_id}, revalidation failed: {e}")
+				return copy.deepcopy(entry["memo"])
+			return _error_result(e)
+		if self._cache is not None:
+			self._cache.put(customer_transaction_id, memo, response.headers.get("ETag"))
+		return memo
+
+	@tool
+	def create_credit_memos_bulk(self, payloads, mode=FUSION_BULK_MODE):
+		"""
+		Create many credit memos (e.g. refunds for a batch of resolved disputes).
+		Args:
+			payloads (list): Credit memo payloads, same shape as for create_credit_memo.
+			mode (str): "concurrent" for parallel POSTs over the pooled session, or
+				"batch" to send them through the Fusion REST batch endpoint.
+		Returns:
+			list: One {"index", "ok", "result" | "error", "status_code", "retryable"} entry per
+				payload, in order. "retryable" marks a failure that is safe to submit again
+				(the memo was not created).
+		"""
+		payloads = list(payloads)
+		if mode == "batch":
+			return self._create_via_batch_endpoint(payloads)
+
+		def create(indexed):
+			index, payload = indexed
+			result = self.create_credit_memo(payload)
+			if isinstance(result, dict) and "error" in result:
+				return {"index": index, "ok": False, **result, "retryable": _is_retryable(result.get("status_code"))}
+			return {"index": index, "ok": True, "result": result}
+
+		if not payloads:
+			return []
+		with ThreadPoolExecutor(max_workers=min(FUSION_BULK_CONCURRENCY, len(payloads)),
+								thread_name_prefix="credit-memo-bulk") as executor:
+			return list(executor.map(create, enumerate(payloads)))
+
+	def _create_via_batch_endpoint(self, payloads):
+		"""
+		Sends the payloads in batch requests of FUSION_BATCH_SIZE parts. Parts that
+		fail retryably (the whole request or the part was throttled / unavailable)
+		are sent again in a smaller batch, up to FUSION_MAX_RETRIES times with
+		backoff, so one transient error does not fail every memo of a chunk.
+		"""
+		session = self._session()
+		url = self._api_url + REST_ROOT
+		results = {}
+		for start in range(0, len(payloads), FUSION_BATCH_SIZE):
+			pending = list(range(start, min(start + FUSION_BATCH_SIZE, len(payloads))))
+			for attempt in range(FUSION_MAX_RETRIES + 1):
+				if attempt:
+					time.sleep(FUSION_BACKOFF_FACTOR * (2 ** (attempt - 1)))
+				for index, result in self._send_batch(session, url, payloads, pending).items():
+					results[index] = result
+				pending = [index for index in pending if results[index].get("retryable")]
+				if not pending:
+					break
+				logging.info(f"Credit memo batch: retrying {len(pending)} part(s)")
+		return [results[index] for index in range(len(payloads))]
+
+	def _send_batch(self, session, url, payloads, indexes):
+		"""One batch request; returns {index: result} for every part."""
+		body = {"parts": [
+			{"id": f"part{index}", "path": CREDIT_MEMOS_PATH, "operation": "create", "payload": payloads[index]}
+			for index in indexes
+		]}
+		logging.info(f"Creating Credit Memo batch at URL: {url} ({len(indexes)} parts)")
+		try:
+			response = session.post(url, headers={"Content-Type": BATCH_CONTENT_TYPE},
+									data=json.dumps(body), timeout=self._timeout)
+			response.raise_for_status()
+			parts = {part.get("id"): part for part in response.json().get("parts", [])}
+		except requests.RequestException as e:
+			error = _error_result(e)
+			retryable = _is_retryable(error["status_code"], e)
+			return {index: {"index": index, "ok": False, **error, "retryable": retryable} for index in indexes}
+		results = {}
+		for index in indexes:
+			part = parts.get(f"part{index}")
+			if part is None:
+				results[index] = {"index": index, "ok": False, "error": "Missing part in batch response",
+								  "status_code": None, "retryable": False}
+			elif part.get("exception"):
+				exception = part["exception"]
+				results[index] = {"index": index, "ok": False, "error": exception.get("detail", str(exception)),
+								  "status_code": exception.get("status"),
+								  "retryable": _is_retryable(exception.get("status"))}
+			else:
+				results[index] = {"index": index, "ok": True, "result": part.get("payload")}
+		return results
+
+async def acreate_credit_memo(payload, tool=None):
+	"""
+	Asyncio version of `Credit_Memo_Tool.create_credit_memo`.
+	The REST call is blocking, so it runs on a worker thread.
+	"""
+	tool = tool or Credit_Memo_Tool()
+	return await asyncio.to_thread(tool.create_credit_memo, payload)
+
+async def aget_credit_memo(customer_transaction_id, tool=None):
+	"""Asyncio version of `Credit_Memo_Tool.get_credit_memo` (runs on a worker thread)."""
+	tool = tool or Credit_Memo_Tool()
+	return await asyncio.to_thread(tool.get_credit_memo, customer_transaction_id)
+
+async def acreate_credit_memos_bulk(payloads, mode=FUSION_BULK_MODE, tool=None):
+	"""Asyncio version of `Credit_Memo_Tool.create_credit_memos_bulk` (runs on a worker thread)."""
+	tool = tool or Credit_Memo_Tool()
+	return await asyncio.to_thread(tool.create_credit_memos_bulk, list(payloads), mode)
 
 # Example payload for credit memo creation
 example_payload = {
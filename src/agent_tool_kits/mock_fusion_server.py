@@ -0,0 +1,222 @@
+"""
+mock_fusion_server.py
+
+Local mock of the Oracle Fusion Receivables credit memo REST API, for load
+tests of Credit_Memo_Tool without a Fusion pod.
+
+Endpoints (under /fscmRestApi/resources/latest):
+- POST /receivablesCreditMemos          create a memo, returns 201 + the memo
+- GET  /receivablesCreditMemos/{id}     fetch a memo, 404 if unknown, 304 if
+  If-None-Match matches the memo's ETag
+- POST /                                 REST batch request
+  (Content-Type: application/vnd.oracle.adf.batch+json, {"parts": [...]})
+
+Every request can be delayed (`latency_seconds`) and a fraction of requests
+can fail with 503 (`failure_rate`) to exercise timeouts and retries. Basic
+auth is required but any credentials are accepted.
+
+Usage:
+    python -m src.agent_tool_kits.mock_fusion_server --port 8089
+    python -m src.agent_tool_kits.mock_fusion_server --load-test --memos 200 --latency 0.02
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import requests
+
+from src.agent_tool_kits.credit_memo_tool import (
+    CREDIT_MEMOS_PATH, Credit_Memo_Tool, REST_ROOT, example_payload)
+
+MEMOS_URL_PREFIX = REST_ROOT + CREDIT_MEMOS_PATH
+
+
+def memo_etag(memo: dict) -> str:
+    return '"' + hashlib.sha1(json.dumps(memo, sort_keys=True).encode("utf-8")).hexdigest()[:16] + '"'
+
+
+class _FusionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real endpoint
+    # Send headers and body in one segment; split writes stall keep-alive clients on delayed ACKs
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body, etag: str = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _precheck(self) -> bool:
+        server = self.server
+        server.count("requests")
+        if server.latency_seconds:
+            time.sleep(server.latency_seconds)
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            self._send_json(401, {"title": "Unauthorized"})
+            return False
+        if server.failure_rate and random.random() < server.failure_rate:
+            server.count("failures")
+            self._send_json(503, {"title": "Service Unavailable"})
+            return False
+        return True
+
+    def do_POST(self):
+        body = self._read_json()
+        if not self._precheck():
+            return
+        path = self.path.rstrip("/")
+        if path == MEMOS_URL_PREFIX:
+            memo = self.server.create_memo(body)
+            self._send_json(201, memo, etag=memo_etag(memo))
+        elif path == REST_ROOT:
+            parts = []
+            for part in body.get("parts", []):
+                if part.get("operation") == "create" and part.get("path", "").rstrip("/") == CREDIT_MEMOS_PATH:
+                    parts.append({**part, "payload": self.server.create_memo(part.get("payload") or {})})
+                else:
+                    parts.append({**part, "exception": {"status": 400, "detail": "Unsupported batch part"}})
+            self._send_json(200, {"parts": parts})
+        else:
+            self._send_json(404, {"title": "Not Found"})
+
+    def do_GET(self):
+        if not self._precheck():
+            return
+        prefix = MEMOS_URL_PREFIX + "/"
+        memo = self.server.memos.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+        if memo is None:
+            self._send_json(404, {"title": "Not Found"})
+        elif self.headers.get("If-None-Match") == memo_etag(memo):
+            self.server.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", memo_etag(memo))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self._send_json(200, memo, etag=memo_etag(memo))
+
+
+class MockFusionServer(ThreadingHTTPServer):
+    """In-process mock Fusion API on 127.0.0.1; use as a context manager."""
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency_seconds: float = 0.0, failure_rate: float = 0.0):
+        super().__init__(("127.0.0.1", port), _FusionHandler)
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.memos: Dict[str, dict] = {}
+        self.stats = {"requests": 0, "failures": 0, "connections": 0, "created": 0, "not_modified": 0}
+        self._ids = itertools.count(300000058290502)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def process_request(self, request, client_address):
+        self.count("connections")
+        super().process_request(request, client_address)
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def create_memo(self, payload: dict) -> dict:
+        with self._lock:
+            memo_id = str(next(self._ids))
+            memo = {**payload, "CustomerTransactionId": memo_id, "TransactionNumber": f"CM-{memo_id[-6:]}"}
+            self.memos[memo_id] = memo
+            self.stats["created"] += 1
+        return memo
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, name="mock-fusion", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+# ────────────────────────────────────────────────────────
+# Load test
+# ────────────────────────────────────────────────────────
+def _create_without_session(url: str, payloads: List[dict]) -> None:
+    """The previous behaviour: one `requests.post` (new connection) per memo."""
+    for payload in payloads:
+        requests.post(url + MEMOS_URL_PREFIX, auth=("user", "password"),
+                      headers={"Content-Type": "application/json"}, data=json.dumps(payload))
+
+
+def run_load_test(memo_count: int = 200, latency_seconds: float = 0.02,
+                  failure_rate: float = 0.0) -> List[dict]:
+    payloads = [{**example_payload, "CreditMemoComments": f"Refund for dispute {i}"} for i in range(memo_count)]
+    rows = []
+
+    def measure(label, fn):
+        with MockFusionServer(latency_seconds=latency_seconds, failure_rate=failure_rate) as server:
+            start = time.perf_counter()
+            results = fn(server.url)
+            elapsed = time.perf_counter() - start
+            failed = sum(1 for r in results or [] if not r["ok"])
+            rows.append({"mode": label, "seconds": elapsed, "created": server.stats["created"],
+                         "failed": failed, "requests": server.stats["requests"],
+                         "connections": server.stats["connections"],
+                         "memos_per_second": server.stats["created"] / elapsed if elapsed else 0.0})
+
+    def tool_for(url):
+        return Credit_Memo_Tool(api_user="user", api_pass="password", api_url=url)
+
+    measure("requests.post per memo", lambda url: _create_without_session(url, payloads))
+    def pooled_sequential(url):
+        tool = tool_for(url)
+        return [{"ok": "error" not in tool.create_credit_memo(p)} for p in payloads]
+    measure("pooled session, sequential", pooled_sequential)
+    measure("bulk, concurrent", lambda url: tool_for(url).create_credit_memos_bulk(payloads, mode="concurrent"))
+    measure("bulk, batch endpoint", lambda url: tool_for(url).create_credit_memos_bulk(payloads, mode="batch"))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Oracle Fusion credit memo API and load test.")
+    parser.add_argument("--load-test", action="store_true", help="compare per-call connections with pooled and bulk creation")
+    parser.add_argument("--memos", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--port", type=int, default=8089, help="port to serve on without --load-test")
+    args = parser.parse_args()
+
+    if args.load_test:
+        rows = run_load_test(args.memos, args.latency, args.failure_rate)
+        print(f"{'Mode':<30} {'Seconds':>9} {'Memos/s':>9} {'Failed':>7} {'Requests':>9} {'Connections':>12}")
+        for row in rows:
+            print(f"{row['mode']:<30} {row['seconds']:>9.2f} {row['memos_per_second']:>9.1f} {row['failed']:>7} "
+                  f"{row['requests']:>9} {row['connections']:>12}")
+    else:
+        with MockFusionServer(port=args.port, latency_seconds=args.latency, failure_rate=args.failure_rate) as server:
+            print(f"Mock Fusion API on {server.url} (set FUSION_API_URL to it; Ctrl+C to stop)")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
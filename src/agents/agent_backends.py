@@ -0,0 +1,274 @@
+"""
+agent_backends.py
+
+Pluggable backends that build the agents handed out by the agent pool.
+
+- "oci" (default): the builders registered by the agent modules, i.e. ADK
+  agents on the OCI Generative AI Agents endpoints.
+- "fake": `FakeAgent` stand-ins that need no network access. They answer
+  deterministically from the bundled chargeback CSVs:
+  - classification: the CSV Request Type of the dispute, otherwise the
+    local classifier;
+  - db: the SQL template queries on the SQLite stand-in (always, whatever
+    DB_TEMPLATE_BACKEND is), as JSON;
+  - rag: a fixed terms-and-conditions text;
+  - llm: the CSV Dispute Status / Outcome of the dispute in the context.
+  Latency per call is drawn from a log-normal distribution around a median
+  per agent, and calls fail at a configurable rate. Draws are seeded by
+  (seed, agent, prompt, n-th call with that prompt), so a run is repeatable.
+
+Select with AGENT_BACKEND=oci|fake, or in code:
+    AGENT_POOL.set_backend(FakeAgentBackend(FakeProfile(time_scale=0.1)))
+"""
+
+import os
+import csv
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+AGENT_BACKEND = os.getenv("AGENT_BACKEND", "oci")
+DISPUTES_CSV = BASE_DIR / "Chargeback Analysis_ Dispute (1).csv"
+
+# Median seconds per call, log-normal spread, failure rate per agent ("name=value,..." or one value for all)
+FAKE_AGENT_LATENCY = os.getenv("FAKE_AGENT_LATENCY", "classification=0.8,db=3.0,rag=2.5,llm=4.0")
+FAKE_AGENT_LATENCY_SIGMA = float(os.getenv("FAKE_AGENT_LATENCY_SIGMA", "0.4"))
+FAKE_AGENT_ERROR_RATE = os.getenv("FAKE_AGENT_ERROR_RATE", "0")
+FAKE_AGENT_SETUP_SECONDS = float(os.getenv("FAKE_AGENT_SETUP_SECONDS", "1.0"))
+# Multiplies every simulated delay (e.g. 0.01 for quick runs)
+FAKE_AGENT_TIME_SCALE = float(os.getenv("FAKE_AGENT_TIME_SCALE", "1.0"))
+FAKE_AGENT_SEED = int(os.getenv("FAKE_AGENT_SEED", "0"))
+
+FAKE_TERMS_AND_CONDITIONS = """1. Refunds. Customers may request a refund within 30 days of the billing date. Refunds are issued to the original payment method.
+
+2. Dispute period. Charges must be disputed within 60 days of the invoice date. Disputes raised after the dispute period are not eligible for a refund when the service was used.
+
+3. Duplicate payments. Amounts paid twice for the same account and period are refunded in full once the duplicate payment is confirmed.
+
+4. Cancellation. A subscription must be cancelled before its renewal date. Charges after a confirmed cancellation are refunded.
+
+5. Auto-renewal. Subscriptions renew automatically. A renewal notice is sent 30 days before the renewal date; renewals disputed within 30 days of the renewal charge are refunded if the service was not used.
+
+6. Unauthorized charges. Charges the account holder did not authorize are refunded when the account shows no usage and no logins after the charge.
+
+7. Suspension. Suspended accounts are not billed for the period of the suspension.
+
+8. Refunds in progress. A transaction with a refund in progress cannot be disputed again until the refund has completed."""
+
+
+def _per_agent(spec: str, default: float) -> Dict[str, float]:
+    """Parses "name=value,..." (or a single value for every agent) into {name: value, "*": default}."""
+    values = {"*": default}
+    for part in (p.strip() for p in spec.split(",") if p.strip()):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            values[name.strip()] = float(value)
+        else:
+            values["*"] = float(part)
+    return values
+
+
+@dataclass
+class FakeProfile:
+    """Latency / error distribution of the fake agents."""
+    latency_medians: Dict[str, float] = field(default_factory=lambda: _per_agent(FAKE_AGENT_LATENCY, 1.0))
+    latency_sigma: float = FAKE_AGENT_LATENCY_SIGMA
+    error_rates: Dict[str, float] = field(default_factory=lambda: _per_agent(FAKE_AGENT_ERROR_RATE, 0.0))
+    setup_seconds: float = FAKE_AGENT_SETUP_SECONDS
+    time_scale: float = FAKE_AGENT_TIME_SCALE
+    seed: int = FAKE_AGENT_SEED
+    # Share of the latency before the first streamed chunk
+    first_chunk_fraction: float = 0.3
+    stream_chunk_chars: int = 16
+
+    def median(self, agent: str) -> float:
+        return self.latency_medians.get(agent, self.latency_medians["*"])
+
+    def error_rate(self, agent: str) -> float:
+        return self.error_rates.get(agent, self.error_rates["*"])
+
+
+class FakeAgentError(RuntimeError):
+    """Simulated service failure of a fake agent call."""
+
+
+# ────────────────────────────────────────────────────────
+# Backends
+# ────────────────────────────────────────────────────────
+class AgentBackend:
+    """Builds the agent for a registered name; the pool sets it up and runs it."""
+    name = "base"
+
+    def build(self, agent_name: str, default_builder: Callable[[], Any]) -> Any:
+        raise NotImplementedError
+
+
+class OciAgentBackend(AgentBackend):
+    name = "oci"
+
+    def build(self, agent_name: str, default_builder: Callable[[], Any]) -> Any:
+        return default_builder()
+
+
+class FakeAgentBackend(AgentBackend):
+    name = "fake"
+
+    def __init__(self, profile: Optional[FakeProfile] = None):
+        self.profile = profile or FakeProfile()
+        self._calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def build(self, agent_name: str, default_builder: Callable[[], Any]) -> Any:
+        return FakeAgent(agent_name, self)
+
+    def draw(self, agent_name: str, prompt: str) -> Tuple[float, bool]:
+        """(latency seconds, fails) for the next call of `agent_name` with `prompt`."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            self._calls[(agent_name, digest)] += 1
+            n = self._calls[(agent_name, digest)]
+        rng = random.Random(f"{self.profile.seed}:{agent_name}:{digest}:{n}")
+        latency = self.profile.median(agent_name) * math.exp(rng.gauss(0.0, self.profile.latency_sigma))
+        return latency * self.profile.time_scale, rng.random() < self.profile.error_rate(agent_name)
+
+
+def get_backend(name: str = AGENT_BACKEND) -> AgentBackend:
+    backends = {"oci": OciAgentBackend, "fake": FakeAgentBackend}
+    if name not in backends:
+        raise ValueError(f"Unknown AGENT_BACKEND '{name}', expected one of {sorted(backends)}")
+    return backends[name]()
+
+
+# ────────────────────────────────────────────────────────
+# Fake agent
+# ────────────────────────────────────────────────────────
+_CSV_ROWS: Optional[Dict[Tuple[str, str], Dict[str, str]]] = None
+_CSV_LOCK = threading.Lock()
+_CONTEXT_MARKER = "Context:\n"
+_DB_DISPUTE_MARKER = "[ --- USER DISPUTE TO ANALYZE --- ]"
+
+
+def _csv_rows() -> Dict[Tuple[str, str], Dict[str, str]]:
+    """Chargeback CSV rows keyed by (account number, transaction number)."""
+    global _CSV_ROWS
+    with _CSV_LOCK:
+        if _CSV_ROWS is None:
+            rows = {}
+            with open(DISPUTES_CSV, newline="", encoding="utf-8", errors="replace") as f:
+                for row in csv.DictReader(f):
+                    row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+                    if row.get("NLP Prompt"):
+                        rows[(row.get("Account Number", ""), row.get("Transaction Number", ""))] = row
+            _CSV_ROWS = rows
+        return _CSV_ROWS
+
+
+def _csv_row_for(text: str) -> Optional[Dict[str, str]]:
+    from src.agents.sql_templates import extract_identifiers
+    account_number, transaction_number = extract_identifiers(text)
+    transaction_number = transaction_number.upper() if transaction_number else None
+    rows = _csv_rows()
+    if (account_number, transaction_number) in rows:
+        return rows[(account_number, transaction_number)]
+    matches = [row for (acct, txn), row in rows.items()
+               if (account_number and acct == account_number) or (transaction_number and txn.upper() == transaction_number)]
+    return matches[0] if len(matches) == 1 else None
+
+
+class _FakeClient:
+    """What the pool's health check needs from `agent.client`."""
+
+    def get_agent_endpoint_details(self, agent_endpoint_id: str) -> Dict[str, Any]:
+        return {"id": agent_endpoint_id, "lifecycle_state": "ACTIVE"}
+
+
+class FakeAgent:
+    """Local stand-in for an ADK `Agent`: `setup()`, `run(prompt)` and `stream(prompt)`."""
+
+    def __init__(self, name: str, backend: FakeAgentBackend):
+        self.name = name
+        self.backend = backend
+        self.agent_endpoint_id = f"fake-{name}"
+        self.client = _FakeClient()
+
+    def setup(self) -> None:
+        time.sleep(self.backend.profile.setup_seconds * self.backend.profile.time_scale)
+
+    # ---- answers ------------------------------------------------------------
+    def answer(self, prompt: str) -> str:
+        return getattr(self, f"_answer_{self.name}", self._answer_default)(prompt)
+
+    def _answer_classification(self, prompt: str) -> str:
+        row = _csv_row_for(prompt)
+        if row is not None:
+            return row["Request Type"]
+        from src.agents.local_classifier import get_local_classifier
+        return get_local_classifier().predict(prompt)[0]
+
+    def _answer_db(self, prompt: str) -> str:
+        from src.agents.sql_templates import extract_identifiers, fetch_dispute_data
+        dispute = prompt.split(_DB_DISPUTE_MARKER, 1)[-1]
+        data = fetch_dispute_data(*extract_identifiers(dispute), backend="sqlite")
+        if data is None:
+            data = {"user_info": [], "account_usage": [], "transactions": [], "dispute_history": []}
+        return "Here is the customer data:\n" + json.dumps(data, default=str)
+
+    def _answer_rag(self, prompt: str) -> str:
+        return FAKE_TERMS_AND_CONDITIONS
+
+    def _answer_llm(self, prompt: str) -> str:
+        dispute = prompt
+        if _CONTEXT_MARKER in prompt:
+            try:
+                dispute = json.loads(prompt.split(_CONTEXT_MARKER, 1)[1]).get("user_dispute", prompt)
+            except ValueError:
+                pass
+        row = _csv_row_for(dispute)
+        if row is not None and row.get("Dispute Status") in ("Accepted", "Rejected"):
+            decision = {"dispute_status": row["Dispute Status"],
+                        "reason": f"Consistent with the {row['Request Type'].lower()} policy and the account data.",
+                        "recommended_action": row.get("Outcome") or "No further action required."}
+        else:
+            decision = {"dispute_status": "Rejected",
+                        "reason": "The account data does not support the dispute.",
+                        "recommended_action": "No further action required."}
+        return "```json\n" + json.dumps(decision, indent=2) + "\n```"
+
+    def _answer_default(self, prompt: str) -> str:
+        return "OK"
+
+    # ---- ADK-like API -------------------------------------------------------
+    def run(self, prompt: str):
+        latency, fails = self.backend.draw(self.name, prompt)
+        time.sleep(latency)
+        if fails:
+            raise FakeAgentError(f"Simulated service error from fake '{self.name}' agent")
+        return SimpleNamespace(data={"message": {"content": {"text": self.answer(prompt)}}})
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yields the answer in chunks, spread over the drawn latency."""
+        latency, fails = self.backend.draw(self.name, prompt)
+        time.sleep(latency * self.backend.profile.first_chunk_fraction)
+        if fails:
+            raise FakeAgentError(f"Simulated service error from fake '{self.name}' agent")
+        text = self.answer(prompt)
+        size = self.backend.profile.stream_chunk_chars
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        pause = latency * (1 - self.backend.profile.first_chunk_fraction) / len(chunks)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(pause)
+            yield chunk
@@ -0,0 +1,465 @@
+"""
+agent_pool.py
+
+Process-wide registry of long-lived OCI agents.
+
+Building an `AgentClient` + `Agent` and calling `agent.setup()` does remote
+registration work (agent/tool sync), so doing it for every query dominates the
+latency of short agent calls. The pool builds and sets up each agent once and
+hands the same instances out to every dispute and every Streamlit session.
+
+Workflow:
+1. Each agent module registers a builder and a config function at import time.
+2. `lease(name)` returns an idle, set-up agent (building one if needed).
+3. Agents are health-checked periodically and rebuilt when they fail or when
+   their config fingerprint changes. Config functions and builders read their
+   settings through `agent_setting`, which re-reads config/.env when the file
+   changes, so editing an endpoint or region there takes effect on the next
+   lease without a restart.
+4. `warm_up()` builds every registered agent ahead of the first dispute.
+5. `run_agent` / `arun_agent` are the sync and asyncio entry points used by
+   the agent modules. They retry failed runs on a freshly built agent and
+   report setup/run time, queue wait and prompt/response sizes to
+   src/instrumentation.py.
+6. When a text sink is set for the current context (`set_text_sink`), the
+   answer is also reported while it is generated: agents listed in
+   AGENT_STREAMING_AGENTS are called with `should_stream=True` and their
+   server-sent events are forwarded as they arrive; other agents (those with
+   client-side tool loops) report their full answer once it is complete.
+   `stream_agent` exposes the same as an iterator of text chunks.
+7. The pool builds agents through a backend (agent_backends.py): the real
+   OCI agents, or local fakes for offline tests and load tests.
+"""
+
+import os
+import json
+import queue
+import asyncio
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from dotenv import dotenv_values
+
+from src.agents.agent_backends import AgentBackend, get_backend
+from src.instrumentation import AgentCallMetrics, record_agent_call
+
+logger = logging.getLogger(__name__)
+
+# Seconds between remote health checks of an idle agent (0 disables them)
+AGENT_POOL_HEALTH_CHECK_SECONDS = float(os.getenv("AGENT_POOL_HEALTH_CHECK_SECONDS", "300"))
+# Maximum number of idle agents kept per registered name
+AGENT_POOL_MAX_IDLE = int(os.getenv("AGENT_POOL_MAX_IDLE", "4"))
+# Extra attempts for a failed agent run (each on a rebuilt agent) and the base backoff between them
+AGENT_MAX_RETRIES = int(os.getenv("AGENT_MAX_RETRIES", "1"))
+AGENT_RETRY_BACKOFF_SECONDS = float(os.getenv("AGENT_RETRY_BACKOFF_SECONDS", "0.5"))
+# Token streaming over SSE; only for agents without client-side tools (the ADK run loop cannot stream)
+AGENT_STREAMING_ENABLED = os.getenv("AGENT_STREAMING_ENABLED", "true").lower() == "true"
+AGENT_STREAMING_AGENTS = {n.strip() for n in os.getenv("AGENT_STREAMING_AGENTS", "classification,llm").split(",") if n.strip()}
+
+AGENT_ENV_FILE = Path(__file__).resolve().parent.parent.parent / "config/.env"
+
+
+class _EnvFile:
+    """
+    config/.env, re-read whenever its modification time changes.
+    Until a key is edited in the file, the process environment wins, as with
+    `load_dotenv` at import; an edited key takes its new value from the file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._values: Dict[str, Optional[str]] = {}
+        self._refresh()
+        self._initial = dict(self._values)
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._values = dotenv_values(self.path) if mtime is not None else {}
+            self._mtime = mtime
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            self._refresh()
+            value, initial = self._values.get(key), self._initial.get(key)
+        if value != initial:
+            return value if value is not None else default
+        return os.getenv(key, default)
+
+
+_AGENT_ENV = _EnvFile(AGENT_ENV_FILE)
+
+
+def agent_setting(key: str, default: Optional[str] = None) -> Optional[str]:
+    """Current value of an agent setting (endpoint, region, profile...), see `_EnvFile`."""
+    return _AGENT_ENV.get(key, default)
+
+
+@dataclass
+class _PooledAgent:
+    agent: Any
+    fingerprint: tuple
+    created_at: float
+    last_checked: float
+    setup_seconds: float
+
+
+@dataclass
+class _Registration:
+    builder: Callable[[], Any]
+    config_fn: Callable[[], Dict[str, Any]]
+    idle: List[_PooledAgent] = field(default_factory=list)
+    in_use: int = 0
+    builds: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _fingerprint(config: Dict[str, Any]) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in config.items()))
+
+
+class AgentPool:
+    """
+    Thread-safe pool of set-up agents keyed by agent name
+    ("classification", "db", "rag", "llm").
+    """
+
+    def __init__(self, health_check_seconds: float = AGENT_POOL_HEALTH_CHECK_SECONDS,
+                 max_idle: int = AGENT_POOL_MAX_IDLE, backend: Optional[AgentBackend] = None):
+        self.health_check_seconds = health_check_seconds
+        self.max_idle = max_idle
+        self.backend = backend or get_backend()
+        self._registry: Dict[str, _Registration] = {}
+        self._registry_lock = threading.Lock()
+
+    # ---- registration -------------------------------------------------------
+    def register(self, name: str, builder: Callable[[], Any],
+                 config_fn: Callable[[], Dict[str, Any]]) -> None:
+        """Registers (or replaces) the builder used for `name`."""
+        with self._registry_lock:
+            previous = self._registry.get(name)
+            if previous is not None and previous.builder is builder:
+                return
+            self._registry[name] = _Registration(builder=builder, config_fn=config_fn)
+
+    def names(self) -> List[str]:
+        return list(self._registry)
+
+    def set_backend(self, backend: AgentBackend) -> None:
+        """Switches the backend; idle agents of the previous one are not handed out again."""
+        self.backend = backend
+        self.invalidate()
+
+    def _config_fingerprint(self, reg: _Registration) -> tuple:
+        return _fingerprint({**reg.config_fn(), "backend": self.backend.name})
+
+    def _registration(self, name: str) -> _Registration:
+        try:
+            return self._registry[name]
+        except KeyError:
+            raise KeyError(f"No agent registered under '{name}'. Registered: {self.names()}")
+
+    # ---- build / health -----------------------------------------------------
+    def _build(self, name: str, reg: _Registration, fingerprint: tuple) -> _PooledAgent:
+        start = time.perf_counter()
+        agent = self.backend.build(name, reg.builder)
+        agent.setup()
+        setup_seconds = time.perf_counter() - start
+        now = time.time()
+        with reg.lock:
+            reg.builds += 1
+        logger.info(f"Agent pool: built '{name}' in {setup_seconds:.2f}s")
+        return _PooledAgent(agent=agent, fingerprint=fingerprint, created_at=now,
+                            last_checked=now, setup_seconds=setup_seconds)
+
+    def _is_healthy(self, pooled: _PooledAgent) -> bool:
+        """Cheap remote probe: fetch the endpoint details of the agent."""
+        agent = pooled.agent
+        try:
+            agent.client.get_agent_endpoint_details(agent.agent_endpoint_id)
+            return True
+        except Exception as e:
+            logger.warning(f"Agent pool: health check failed: {e}")
+            return False
+
+    def _take_idle(self, name: str, reg: _Registration, fingerprint: tuple) -> Optional[_PooledAgent]:
+        while True:
+            with reg.lock:
+                if not reg.idle:
+                    return None
+                pooled = reg.idle.pop()
+            if pooled.fingerprint != fingerprint:
+                logger.info(f"Agent pool: config changed for '{name}', discarding agent")
+                continue
+            if (self.health_check_seconds
+                    and time.time() - pooled.last_checked > self.health_check_seconds):
+                if not self._is_healthy(pooled):
+                    continue
+                pooled.last_checked = time.time()
+            return pooled
+
+    # ---- public API ---------------------------------------------------------
+    @contextmanager
+    def lease(self, name: str):
+        """
+        Context manager yielding a ready-to-run agent for `name`.
+        The agent goes back to the pool on success and is dropped if the
+        body raises, so the next lease rebuilds it.
+        """
+        reg = self._registration(name)
+        fingerprint = self._config_fingerprint(reg)
+        pooled = self._take_idle(name, reg, fingerprint) or self._build(name, reg, fingerprint)
+        with reg.lock:
+            reg.in_use += 1
+        try:
+            yield pooled.agent
+        except Exception:
+            logger.warning(f"Agent pool: dropping '{name}' agent after a failed run")
+            raise
+        else:
+            with reg.lock:
+                if len(reg.idle) < self.max_idle:
+                    reg.idle.append(pooled)
+        finally:
+            with reg.lock:
+                reg.in_use -= 1
+
+    def warm_up(self, names: Optional[List[str]] = None) -> Dict[str, float]:
+        """
+        Builds and sets up one agent per name (all registered names by default)
+        so that the first dispute after a deploy does not pay for setup.
+        Returns the setup time per agent; failures are logged, not raised.
+        """
+        timings = {}
+        for name in names or self.names():
+            reg = self._registration(name)
+            fingerprint = self._config_fingerprint(reg)
+            with reg.lock:
+                ready = any(p.fingerprint == fingerprint for p in reg.idle)
+            if ready:
+                timings[name] = 0.0
+                continue
+            try:
+                pooled = self._build(name, reg, fingerprint)
+            except Exception as e:
+                logger.error(f"Agent pool: warm-up of '{name}' failed: {e}")
+                continue
+            with reg.lock:
+                reg.idle.append(pooled)
+            timings[name] = pooled.setup_seconds
+        return timings
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drops idle agents for `name` (or all names); they are rebuilt on next lease."""
+        for key in [name] if name else self.names():
+            reg = self._registration(key)
+            with reg.lock:
+                reg.idle.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"idle": len(reg.idle), "in_use": reg.in_use, "builds": reg.builds}
+            for name, reg in self._registry.items()
+        }
+
+
+# Shared, process-wide pool used by all agent modules
+AGENT_POOL = AgentPool()
+
+
+def _ensure_thread_event_loop() -> None:
+    """
+    `Agent.run` drives its coroutine on the thread's event loop, which worker
+    threads (Streamlit's script thread, executor threads) do not have by default.
+    """
+    try:
+        asyncio.get_event_loop_policy().get_event_loop()
+    except RuntimeError:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+# ────────────────────────────────────────────────────────
+# Streaming
+# ────────────────────────────────────────────────────────
+# Receives the answer text generated so far (always the full prefix, so a retry simply starts over)
+_text_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar("agent_text_sink", default=None)
+
+
+def set_text_sink(sink: Optional[Callable[[str], None]]) -> None:
+    """
+    Makes `sink` receive the partial answers of agent calls made from the
+    current context (task/thread). It may be called from a worker thread.
+    """
+    _text_sink.set(sink)
+
+
+def _event_text(data: str) -> Optional[str]:
+    """Message text of one server-sent chat event, if it carries any."""
+    try:
+        payload = json.loads(data)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    message = payload.get("message") or {}
+    content = message.get("content") or {}
+    return content.get("text") or payload.get("text")
+
+
+def _run_streaming(agent, prompt: str, on_text: Callable[[str], None], metrics: AgentCallMetrics,
+                   start: float) -> str:
+    """
+    One chat turn with `should_stream=True` on a fresh session. Events may
+    carry either the next piece of the answer or the whole answer so far; both
+    are folded into the full text, which is passed to `on_text` after every event.
+    """
+    if hasattr(agent, "stream"):
+        # Backends with their own streaming (e.g. the fake agents) yield pieces of the answer
+        text = ""
+        for chunk in agent.stream(prompt):
+            text += chunk
+            if not metrics.first_chunk_seconds:
+                metrics.first_chunk_seconds = time.perf_counter() - start
+            on_text(text)
+        return text
+
+    from oci.generative_ai_agent_runtime.models import ChatDetails
+
+    client = agent.client
+    session_id = client.create_session(agent_endpoint_id=agent.agent_endpoint_id)
+    try:
+        details = ChatDetails(user_message=prompt, session_id=session_id, should_stream=True)
+        response = client._rt_client.chat(agent.agent_endpoint_id, details)
+        if not hasattr(response.data, "events"):
+            # The service answered with a plain ChatResult
+            text = response.data.message.content.text
+            on_text(text)
+            return text
+        text = ""
+        for event in response.data.events():
+            chunk = _event_text(event.data)
+            if not chunk:
+                continue
+            text = chunk if chunk.startswith(text) else text + chunk
+            if not metrics.first_chunk_seconds:
+                metrics.first_chunk_seconds = time.perf_counter() - start
+            on_text(text)
+        return text
+    finally:
+        try:
+            client.delete_session(agent_endpoint_id=agent.agent_endpoint_id, session_id=session_id)
+        except Exception as e:
+            logger.warning(f"Could not delete streaming session {session_id}: {e}")
+
+
+def run_agent(name: str, prompt: str, submitted_at: Optional[float] = None,
+              on_text: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Runs the pooled agent `name` on `prompt` and returns the response text.
+    `submitted_at` (perf_counter) is when the call was handed to a worker
+    thread; the difference to now is reported as queue wait.
+    `on_text` (default: the context's text sink) receives the answer so far
+    while it is generated.
+    """
+    start = time.perf_counter()
+    metrics = AgentCallMetrics(agent=name, prompt_chars=len(prompt),
+                               queue_wait_seconds=max(0.0, start - submitted_at) if submitted_at else 0.0)
+    on_text = on_text or _text_sink.get()
+    stream = on_text is not None and AGENT_STREAMING_ENABLED and name in AGENT_STREAMING_AGENTS
+    _ensure_thread_event_loop()
+    try:
+        for attempt in range(AGENT_MAX_RETRIES + 1):
+            metrics.retries = attempt
+            try:
+                lease_start = time.perf_counter()
+                with AGENT_POOL.lease(name) as agent:
+                    run_start = time.perf_counter()
+                    metrics.setup_seconds += run_start - lease_start
+                    try:
+                        text = None
+                        if stream:
+                            try:
+                                text = _run_streaming(agent, prompt, on_text, metrics, start)
+                                metrics.streamed = True
+                            except Exception as e:
+                                # E.g. an endpoint without SSE support: answer in one piece instead
+                                logger.warning(f"Streaming from agent '{name}' failed, running without it: {e}")
+                                stream = False
+                        if text is None:
+                            text = agent.run(prompt).data["message"]["content"]["text"]
+                    finally:
+                        metrics.run_seconds += time.perf_counter() - run_start
+                if on_text is not None and not stream:
+                    metrics.first_chunk_seconds = time.perf_counter() - start
+                    on_text(text)
+                metrics.response_chars = len(text)
+                metrics.error = None
+                return text
+            except Exception as e:
+                metrics.error = f"{type(e).__name__}: {e}"
+                if attempt == AGENT_MAX_RETRIES:
+                    raise
+                logger.warning(f"Agent '{name}' failed (attempt {attempt + 1}), retrying: {e}")
+                time.sleep(AGENT_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+    finally:
+        metrics.wall_seconds = time.perf_counter() - start
+        record_agent_call(metrics)
+
+
+async def arun_agent(name: str, prompt: str) -> str:
+    """
+    Asyncio version of `run_agent`.
+    The ADK's `run_async` still performs blocking HTTP calls on the calling
+    thread, so the call is moved to a worker thread to keep the event loop free
+    and let many disputes overlap their network waits.
+    """
+    return await asyncio.to_thread(run_agent, name, prompt, time.perf_counter())
+
+
+def stream_agent(name: str, prompt: str) -> Iterator[str]:
+    """
+    Runs the pooled agent `name` on `prompt` in a worker thread and yields
+    the answer in chunks as they arrive (the chunks add up to the full text).
+    """
+    chunks: "queue.Queue" = queue.Queue()
+    done = object()
+    error: List[BaseException] = []
+    sent = [""]
+
+    def on_text(text: str) -> None:
+        if text.startswith(sent[0]):
+            chunks.put(text[len(sent[0]):])
+        else:
+            logger.warning(f"Agent '{name}' restarted its answer; streaming the new one in full")
+            chunks.put(text)
+        sent[0] = text
+
+    def worker() -> None:
+        try:
+            run_agent(name, prompt, time.perf_counter(), on_text=on_text)
+        except BaseException as e:
+            error.append(e)
+        finally:
+            chunks.put(done)
+
+    # Keeps the caller's step metrics attribution in the worker thread
+    threading.Thread(target=copy_context().run, args=(worker,), name=f"stream-{name}", daemon=True).start()
+    while True:
+        chunk = chunks.get()
+        if chunk is done:
+            break
+        if chunk:
+            yield chunk
+    if error:
+        raise error[0]
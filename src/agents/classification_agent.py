@@ -13,6 +13,9 @@ from pathlib import Path
 from dotenv import load_dotenv
 from oci.addons.adk import Agent, AgentClient
 
+from src.agents.agent_pool import AGENT_POOL, agent_setting, arun_agent, run_agent
+from src.agents.local_classifier import LOCAL_CLASSIFIER_ENABLED, classify_locally
+
 # --- Bootstrap paths and environment ---
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 load_dotenv(BASE_DIR / "config/.env")
@@ -39,11 +42,12 @@ CLASSIFICATION_CATEGORIES = [
 
 def build_agent():
     """Builds the classification agent with specific instructions."""
+    config = agent_config()
     client = AgentClient(
         auth_type="api_key",
-        config=OCI_CONFIG_FILE,
-        profile=OCI_PROFILE,
-        region=AGENT_REGION
+        config=config["config"],
+        profile=config["profile"],
+        region=config["region"]
     )
     
     # Instructions are highly specific to the classification task
@@ -56,30 +60,44 @@ def build_agent():
     
     agent = Agent(
         client=client,
-        agent_endpoint_id=CLASSIFICATION_AGENT_EP_ID,
+        agent_endpoint_id=config["endpoint"],
         instructions=instructions,
         tools=[]  # No tools needed for this agent
     )
     return agent
 
+def agent_config():
+    """Settings that require the pooled agent to be rebuilt when they change (re-read from config/.env)."""
+    return {
+        "config": agent_setting("OCI_CONFIG_FILE"),
+        "profile": agent_setting("OCI_PROFILE", "DEFAULT"),
+        "region": agent_setting("AGENT_REGION"),
+        "endpoint": agent_setting("LLM_AGNET_EP_ID"),
+    }
+
+AGENT_POOL.register("classification", build_agent, agent_config)
+
 def run_classification_query(query: str) -> str:
     """
-    Initializes and runs the classification agent for a given query.
+    Classifies a query, answering locally when the fast-path classifier is
+    confident and running the pooled classification agent otherwise.
     """
-    # --- FIX for Streamlit's threading ---
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    # ------------------------------------
+    if LOCAL_CLASSIFIER_ENABLED:
+        local_classification = classify_locally(query)
+        if local_classification:
+            return local_classification
 
-    agent = build_agent()
-    agent.setup()
-    response = agent.run(query)
     # The response should be just the category name
-    classification = response.data["message"]["content"]["text"].strip()
-    return classification
+    return run_agent("classification", query).strip()
+
+async def arun_classification_query(query: str) -> str:
+    """Asyncio version of `run_classification_query`."""
+    if LOCAL_CLASSIFIER_ENABLED:
+        local_classification = classify_locally(query)
+        if local_classification:
+            return local_classification
+
+    return (await arun_agent("classification", query)).strip()
 
 if __name__ == "__main__":
     test_query = "I was charged twice this month for the same subscription! This is unacceptable."
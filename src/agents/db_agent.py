@@ -12,6 +12,7 @@ Workflow Overview:
 3. Run the agent with user input and print response
 """
 import os
+import json
 from typing import Dict
 from pathlib import Path
 from dotenv import load_dotenv
@@ -24,6 +25,10 @@ from oci.addons.adk.tool.prebuilt.agentic_sql_tool import AgenticSqlTool, SqlDia
 from oci.addons.adk import Agent, AgentClient, tool
 from oci.addons.adk.tool.prebuilt import AgenticRagTool
 
+from src.agents.agent_pool import AGENT_POOL, agent_setting, arun_agent, run_agent
+from src.agents.sql_templates import TEMPLATE_BACKEND_CONFIGURED, extract_identifiers, run_template_query
+from src.agents.db_result import DbQueryResult
+
 # --- MODIFIED: Import the new structured prompts ---
 from src.prompts.prompts import DB_AGENT_GENERIC_PROMPT, DB_AGENT_PROMPTS_BY_CLASSIFICATION
 # ────────────────────────────────────────────────────────
@@ -42,6 +47,9 @@ OCI_PROFILE = os.getenv("OCI_PROFILE")
 AGENT_REGION = os.getenv("AGENT_REGION")
 AGENT_SERVICE_EP = os.getenv("AGENT_SERVICE_EP")
 DB_AGENT_EP_ID = os.getenv("DB_AGENT_EP_ID")
+# "template": deterministic SQL templates, agentic SQL only when no identifiers are found
+# "agentic": always let the AgenticSqlTool write the SQL (default when no template backend is configured)
+DB_QUERY_MODE = os.getenv("DB_QUERY_MODE", "template" if TEMPLATE_BACKEND_CONFIGURED else "agentic")
 
 
 INLINE_DATABASE_SCHEMA = '''
@@ -138,11 +146,12 @@ INLINE_TABLE_COLUMN_DESCRIPTION = '''
 # ────────────────────────────────────────────────────────
 def agent_flow():
 
+    config = agent_config()
     client = AgentClient(
         auth_type="api_key",
-        config=OCI_CONFIG_FILE,
-        profile=OCI_PROFILE,
-        region=AGENT_REGION
+        config=config["config"],
+        profile=config["profile"],
+        region=config["region"]
     )
 
     # --- MODIFIED: Instructions are now more generic, as specifics are passed in the prompt ---
@@ -168,7 +177,7 @@ def agent_flow():
 
     agent = Agent(
         client=client,
-        agent_endpoint_id=DB_AGENT_EP_ID,
+        agent_endpoint_id=config["endpoint"],
         instructions=instructions,
         tools=[
             sql_tool_with_inline_schema
@@ -181,25 +190,24 @@ def agent_flow():
 def db_agent_flow():
     return agent_flow()
 
-# --- MODIFIED: Function now accepts user_prompt and classification ---
-def run_db_query(user_prompt: str, classification: str) -> str:
-    """
-    Initializes and runs the DB agent with a detailed, structured prompt.
-    Handles asyncio event loop for Streamlit compatibility.
-    """
-    # --- FIX for Streamlit's threading ---
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    # ------------------------------------
+def agent_config():
+    """Settings that require the pooled agent to be rebuilt when they change (re-read from config/.env)."""
+    return {
+        "config": agent_setting("OCI_CONFIG_FILE"),
+        "profile": agent_setting("OCI_PROFILE"),
+        "region": agent_setting("AGENT_REGION"),
+        "endpoint": agent_setting("DB_AGENT_EP_ID"),
+    }
+
+AGENT_POOL.register("db", db_agent_flow, agent_config)
 
+def build_db_agent_prompt(user_prompt: str, classification: str) -> str:
+    """Builds the structured prompt for the agentic SQL path."""
     # 1. Get the specific prompt for the classification
     specific_prompt = DB_AGENT_PROMPTS_BY_CLASSIFICATION.get(classification, "No specific instructions for this classification. Please retrieve all relevant data.")
 
     # 2. Construct the full prompt for the agent
-    full_prompt = f"""
+    return f"""
     {DB_AGENT_GENERIC_PROMPT}
 
     [ --- CURRENT TASK --- ]
@@ -210,14 +218,41 @@ def run_db_query(user_prompt: str, classification: str) -> str:
     "{user_prompt}"
     """
 
-    agent = db_agent_flow()
-    agent.setup()
-    
-    # 3. Run the agent with the fully constructed prompt
-    response = agent.run(full_prompt)
-    
-    final_message = response.data["message"]["content"]["text"]
-    return final_message
+# --- MODIFIED: Function now accepts user_prompt and classification ---
+def run_db_query(user_prompt: str, classification: str) -> DbQueryResult:
+    """
+    Fetches the customer data for a dispute as a typed `DbQueryResult`.
+    Uses the deterministic SQL templates when the prompt contains an account or
+    transaction number; otherwise runs the pooled DB agent with a detailed,
+    structured prompt. Handles asyncio event loop for Streamlit compatibility.
+    """
+    if DB_QUERY_MODE == "template":
+        template_result = run_template_query(user_prompt, classification)
+        if template_result is not None:
+            return template_result
+        logging.info("DB template query: no identifiers found, falling back to the agentic SQL tool")
+
+    # 3. Run the pooled agent with the fully constructed prompt and parse its output once
+    result = DbQueryResult.parse(run_agent("db", build_db_agent_prompt(user_prompt, classification)),
+                                 transaction_number=extract_identifiers(user_prompt)[1])
+    if not result.ok:
+        logging.error(f"DB agent output could not be parsed: {result.parse_error}")
+    return result
+
+async def arun_db_query(user_prompt: str, classification: str) -> DbQueryResult:
+    """Asyncio version of `run_db_query`."""
+    if DB_QUERY_MODE == "template":
+        # DB-API drivers are blocking, so the template queries run on a worker thread
+        template_result = await asyncio.to_thread(run_template_query, user_prompt, classification)
+        if template_result is not None:
+            return template_result
+        logging.info("DB template query: no identifiers found, falling back to the agentic SQL tool")
+
+    result = DbQueryResult.parse(await arun_agent("db", build_db_agent_prompt(user_prompt, classification)),
+                                 transaction_number=extract_identifiers(user_prompt)[1])
+    if not result.ok:
+        logging.error(f"DB agent output could not be parsed: {result.parse_error}")
+    return result
 
 # MODIFIED main block for standalone testing
 if __name__ == "__main__":
@@ -227,4 +262,4 @@ if __name__ == "__main__":
     print(f"--- Testing DB Agent with classification: '{test_classification}' ---")
     response_text = run_db_query(test_prompt, test_classification)
     print("\n--- DB Agent Response ---")
-    print(response_text)
\ No newline at end of file
+    print(json.dumps(response_text.to_dict(include_raw=True), indent=2))
\ No newline at end of file
@@ -0,0 +1,278 @@
+"""
+db_result.py
+
+Typed result of the DB step.
+
+`run_db_query` returns a `DbQueryResult` instead of free text. Template
+queries build it directly from rows; agent output is parsed exactly once by
+`DbQueryResult.parse`, which copes with the shapes the DB agent produces
+(JSON embedded in prose, sections encoded as JSON strings or lists of JSON
+strings, single objects instead of lists). Anything that cannot be decoded is
+recorded in `parse_error` rather than silently dropped.
+"""
+
+import json
+import re
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+
+class DbResultParseError(ValueError):
+    """Raised when a section of the DB agent output cannot be decoded."""
+
+
+def _to_float(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^\d.\-]", "", str(value))
+    try:
+        return float(cleaned)
+    except ValueError:
+        raise DbResultParseError(f"Invalid amount: {value!r}")
+
+
+def _to_int(value: Any) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        raise DbResultParseError(f"Invalid number: {value!r}")
+
+
+def _to_flag(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+
+def _record_kwargs(cls, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Splits `data` into known dataclass fields and an `extra` dict (keys are
+    matched case-insensitively). An `extra` dict already in `data`, as written
+    by `to_dict`, is merged in rather than nested, so round trips are stable.
+    """
+    names = {f.name for f in fields(cls)} - {"extra"}
+    known, extra = {}, {}
+    for key, value in data.items():
+        name = str(key).lower()
+        if name in names:
+            known[name] = value
+        elif name == "extra" and isinstance(value, dict):
+            extra = {**value, **extra}
+        else:
+            extra[key] = value
+    return {**known, "extra": extra}
+
+
+@dataclass(slots=True)
+class CustomerInfo:
+    account_number: Optional[str] = None
+    customer_segment: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CustomerInfo":
+        kwargs = _record_kwargs(cls, data)
+        if kwargs.get("account_number") is not None:
+            kwargs["account_number"] = str(kwargs["account_number"])
+        return cls(**kwargs)
+
+
+@dataclass(slots=True)
+class UsageRecord:
+    usage_id: Optional[int] = None
+    usage_date: Optional[str] = None
+    envelope_count: Optional[int] = None
+    usage_notes: Optional[str] = None
+    product: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "UsageRecord":
+        kwargs = _record_kwargs(cls, data)
+        kwargs["envelope_count"] = _to_int(kwargs.get("envelope_count"))
+        return cls(**kwargs)
+
+
+@dataclass(slots=True)
+class TransactionRecord:
+    transaction_number: Optional[str] = None
+    account_number: Optional[str] = None
+    invoice_date: Optional[str] = None
+    amount: Optional[float] = None
+    currency_code: Optional[str] = None
+    product: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TransactionRecord":
+        kwargs = _record_kwargs(cls, data)
+        kwargs["amount"] = _to_float(kwargs.get("amount"))
+        if kwargs.get("account_number") is not None:
+            kwargs["account_number"] = str(kwargs["account_number"])
+        return cls(**kwargs)
+
+
+@dataclass(slots=True)
+class DisputeRecord:
+    dispute_id: Optional[int] = None
+    transaction_number: Optional[str] = None
+    request_type: Optional[str] = None
+    dispute_status: Optional[str] = None
+    outcome_details: Optional[str] = None
+    is_refund_in_progress: bool = False
+    is_duplicate_payment: bool = False
+    created_at: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DisputeRecord":
+        kwargs = _record_kwargs(cls, data)
+        kwargs["is_refund_in_progress"] = _to_flag(kwargs.get("is_refund_in_progress", False))
+        kwargs["is_duplicate_payment"] = _to_flag(kwargs.get("is_duplicate_payment", False))
+        return cls(**kwargs)
+
+
+def _decode_section(value: Any, name: str) -> List[Dict[str, Any]]:
+    """Normalizes a section to a list of dicts, decoding JSON strings at any level."""
+    if value is None or value == "" or value == []:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise DbResultParseError(f"'{name}' is not structured data: {value[:80]!r}")
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list):
+        raise DbResultParseError(f"'{name}' has unexpected type {type(value).__name__}")
+    rows = []
+    for item in value:
+        if isinstance(item, str):
+            try:
+                item = json.loads(item)
+            except json.JSONDecodeError:
+                raise DbResultParseError(f"'{name}' contains a non-JSON entry: {item[:80]!r}")
+        if not isinstance(item, dict):
+            raise DbResultParseError(f"'{name}' contains a {type(item).__name__} entry")
+        rows.append(item)
+    return rows
+
+
+@dataclass(slots=True)
+class DbQueryResult:
+    user_info: CustomerInfo = field(default_factory=CustomerInfo)
+    account_usage: List[UsageRecord] = field(default_factory=list)
+    transactions: List[TransactionRecord] = field(default_factory=list)
+    dispute_history: List[DisputeRecord] = field(default_factory=list)
+    source: str = "template"            # "template" or "agent"
+    raw_text: Optional[str] = None      # original agent output, if any
+    parse_error: Optional[str] = None
+    transaction_number: Optional[str] = None   # transaction named in the dispute
+
+    @property
+    def ok(self) -> bool:
+        return self.parse_error is None
+
+    @property
+    def disputed_transaction(self) -> Optional[TransactionRecord]:
+        """
+        The transaction whose number the dispute names, or None. Another
+        transaction of the account is never substituted for it.
+        """
+        if not self.transaction_number:
+            return None
+        wanted = self.transaction_number.upper()
+        return next((t for t in self.transactions if (t.transaction_number or "").upper() == wanted), None)
+
+    @property
+    def dispute_amount(self) -> Optional[float]:
+        transaction = self.disputed_transaction
+        return transaction.amount if transaction else None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], source: str = "template", raw_text: Optional[str] = None,
+                  transaction_number: Optional[str] = None) -> "DbQueryResult":
+        """
+        Builds a result from a decoded document; decoding problems go to
+        `parse_error`, and so does a `transaction_number` missing from the
+        transactions.
+        """
+        result = cls(source=source, raw_text=raw_text, transaction_number=transaction_number)
+        errors = []
+        sections = (
+            ("user_info", lambda rows: setattr(result, "user_info", CustomerInfo.from_dict(rows[0]) if rows else CustomerInfo())),
+            ("account_usage", lambda rows: setattr(result, "account_usage", [UsageRecord.from_dict(r) for r in rows])),
+            ("transactions", lambda rows: setattr(result, "transactions", [TransactionRecord.from_dict(r) for r in rows])),
+            ("dispute_history", lambda rows: setattr(result, "dispute_history", [DisputeRecord.from_dict(r) for r in rows])),
+        )
+        for name, assign in sections:
+            try:
+                assign(_decode_section(data.get(name), name))
+            except DbResultParseError as e:
+                errors.append(str(e))
+        if transaction_number and not errors and result.disputed_transaction is None:
+            errors.append(f"Disputed transaction {transaction_number} not found for the account")
+        if errors:
+            result.parse_error = "; ".join(errors)
+        return result
+
+    @classmethod
+    def parse(cls, text: str, transaction_number: Optional[str] = None) -> "DbQueryResult":
+        """Parses free-text DB agent output (JSON possibly wrapped in prose or code fences)."""
+        json_start = text.find('{')
+        json_end = text.rfind('}') + 1
+        if json_start == -1 or json_end == 0:
+            return cls(source="agent", raw_text=text, parse_error="No JSON object found in DB agent output",
+                       transaction_number=transaction_number)
+        try:
+            data = json.loads(text[json_start:json_end])
+        except json.JSONDecodeError as e:
+            return cls(source="agent", raw_text=text, parse_error=f"Invalid JSON in DB agent output: {e}",
+                       transaction_number=transaction_number)
+        if not isinstance(data, dict):
+            return cls(source="agent", raw_text=text, parse_error="DB agent output is not a JSON object",
+                       transaction_number=transaction_number)
+        return cls.from_dict(data, source="agent", raw_text=text, transaction_number=transaction_number)
+
+    def to_dict(self, include_raw: bool = False) -> Dict[str, Any]:
+        data = {
+            "user_info": asdict(self.user_info),
+            "account_usage": [asdict(r) for r in self.account_usage],
+            "transactions": [asdict(r) for r in self.transactions],
+            "dispute_history": [asdict(r) for r in self.dispute_history],
+            "source": self.source,
+            "transaction_number": self.transaction_number,
+        }
+        if self.parse_error:
+            data["parse_error"] = self.parse_error
+        if include_raw and self.raw_text is not None:
+            data["raw_text"] = self.raw_text
+        return data
+
+    def to_context(self) -> Dict[str, Any]:
+        """Compact view for the LLM prompt; falls back to the raw agent text if parsing failed."""
+        if not self.ok and self.raw_text:
+            return {"raw_db_agent_output": self.raw_text, "parse_error": self.parse_error}
+        return {
+            "user_info": _compact(asdict(self.user_info)),
+            "account_usage": [_compact(asdict(r)) for r in self.account_usage],
+            "transactions": [_compact(asdict(r)) for r in self.transactions],
+            "dispute_history": [_compact(asdict(r)) for r in self.dispute_history],
+        }
+
+
+def _compact(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Drops empty values and inlines `extra` keys."""
+    extra = record.pop("extra", None) or {}
+    return {k: v for k, v in {**record, **extra}.items() if v not in (None, "", {})}
+
+
+def json_default(obj: Any) -> Any:
+    """`json.dumps(..., default=json_default)` hook for step data containing a DbQueryResult."""
+    if isinstance(obj, DbQueryResult):
+        return obj.to_dict(include_raw=True)
+    return str(obj)
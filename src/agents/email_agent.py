@@ -6,12 +6,25 @@ Date: 2025-09-06
 ==Email Sender Assistant==
 ==========================
 This module demonstrates sending an email using OCI Email Delivery via SMTP or REST.
+
+SMTP sends go through a small connection pool that keeps authenticated TLS
+sessions open between messages (EHLO/STARTTLS/login happen once per
+connection), reconnects when the server drops a session, and is throttled by
+a token-bucket rate limiter to stay inside the provider's sending quota.
+`send_batch` sends many messages over the pooled sessions.
+Benchmark against a local stand-in server: python -m src.agents.smtp_standin --benchmark
 """
 
 import os
+import asyncio
 import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from email.message import EmailMessage
 from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
 from dotenv import load_dotenv
 import requests
 
@@ -28,36 +41,231 @@ SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 APPROVED_SENDER = os.getenv("APPROVED_SENDER")
 OIC_EMAIL_ENDPOINT = os.getenv("OIC_EMAIL_ENDPOINT")  # e.g., https://oic.example.com/sendEmail
 
-def send_email_via_oci(recipient, subject, body):
+# --- SMTP session pool settings ---
+SMTP_DEBUG = os.getenv("SMTP_DEBUG", "false").lower() == "true"   # dump SMTP sessions to stdout
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+# Idle sessions older than this are probed with NOOP before reuse (servers drop idle clients)
+SMTP_MAX_IDLE_SECONDS = float(os.getenv("SMTP_MAX_IDLE_SECONDS", "60"))
+# Provider quota: messages per second (0 disables throttling) and allowed burst
+SMTP_RATE_LIMIT_PER_SECOND = float(os.getenv("SMTP_RATE_LIMIT_PER_SECOND", "10"))
+SMTP_RATE_LIMIT_BURST = int(os.getenv("SMTP_RATE_LIMIT_BURST", "10"))
+
+# Errors after which a pooled session is discarded and the send retried on a fresh one
+_RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class RateLimiter:
+    """Thread-safe token bucket: `acquire()` blocks until a send is allowed."""
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SmtpConnectionPool:
     """
-    Sends an email using OCI Email Delivery via SMTP with verbose debugging.
+    Keeps up to `size` authenticated SMTP sessions open and reuses them.
+    Sessions that fail are closed and replaced; `send` retries once on a fresh
+    session when the server has dropped the connection.
     """
-    # --- Credential Check ---
-    if not all([SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, APPROVED_SENDER]):
-        return "Error: One or more SMTP environment variables are missing. Please check your .env file."
 
+    def __init__(self, host, port, username=None, password=None, use_tls=SMTP_USE_TLS,
+                 size=SMTP_POOL_SIZE, timeout=SMTP_TIMEOUT_SECONDS, debug=SMTP_DEBUG,
+                 max_idle_seconds=SMTP_MAX_IDLE_SECONDS, rate_limiter: Optional[RateLimiter] = None):
+        self.host, self.port = host, int(port)
+        self.username, self.password = username, password
+        self.use_tls = use_tls
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.debug = debug
+        self.max_idle_seconds = max_idle_seconds
+        self.rate_limiter = rate_limiter or RateLimiter(SMTP_RATE_LIMIT_PER_SECOND, SMTP_RATE_LIMIT_BURST)
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.connects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.debug:
+            print("--- Attempting to connect to OCI SMTP server ---")
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.set_debuglevel(1 if self.debug else 0)
+            server.ehlo()
+            if self.use_tls:
+                server.starttls()
+                server.ehlo()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        with self._lock:
+            self.connects += 1
+        return server
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _take(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            if time.monotonic() - last_used <= self.max_idle_seconds:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except Exception:
+                pass
+            server.close()
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Leases an authenticated session; it is returned to the pool unless the body raises."""
+        with self._slots:
+            server = self._take()
+            try:
+                yield server
+            except Exception:
+                server.close()
+                raise
+            with self._lock:
+                self._idle.append((server, time.monotonic()))
+
+    def _send_on(self, server: smtplib.SMTP, msg: EmailMessage) -> None:
+        self.rate_limiter.acquire()
+        server.send_message(msg)
+
+    def send(self, msg: EmailMessage) -> None:
+        try:
+            with self.connection() as server:
+                self._send_on(server, msg)
+        except _RECONNECT_ERRORS:
+            with self.connection() as server:
+                self._send_on(server, msg)
+
+    def send_many(self, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        """
+        Sends `messages` over up to `size` sessions in parallel, each session
+        sending every `size`-th message. Returns None or the exception per message.
+        """
+        errors: List[Optional[Exception]] = [None] * len(messages)
+        if not messages:
+            return errors
+        workers = min(self.size, len(messages))
+        shares = [range(i, len(messages), workers) for i in range(workers)]
+
+        def send_share(indexes):
+            pending = list(indexes)
+            while pending:
+                try:
+                    with self.connection() as server:
+                        while pending:
+                            index = pending[0]
+                            try:
+                                self._send_on(server, messages[index])
+                            except smtplib.SMTPRecipientsRefused as e:
+                                errors[index] = e   # message-level failure, the session is fine
+                            pending.pop(0)
+                except _RECONNECT_ERRORS:
+                    # Session dropped: retry the current message once on a fresh session
+                    index = pending.pop(0)
+                    try:
+                        self.send(messages[index])
+                    except Exception as retry_error:
+                        errors[index] = retry_error
+                except Exception as e:
+                    errors[pending.pop(0)] = e
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smtp-batch") as executor:
+            list(executor.map(send_share, shares))
+        return errors
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._quit(server)
+
+
+_smtp_pool: Optional[SmtpConnectionPool] = None
+_smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SmtpConnectionPool:
+    """Process-wide pool for the SMTP settings in config/.env."""
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SmtpConnectionPool(SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD)
+    return _smtp_pool
+
+
+def _build_message(recipient, subject, body, sender=None) -> EmailMessage:
     msg = EmailMessage()
     msg['Subject'] = subject
-    msg['From'] = APPROVED_SENDER
+    msg['From'] = sender or APPROVED_SENDER
     msg['To'] = recipient
     msg.set_content(body)
+    return msg
+
+
+def send_email_via_oci(recipient, subject, body):
+    """
+    Sends an email using OCI Email Delivery via SMTP over a pooled session
+    (set SMTP_DEBUG=true for verbose session output).
+    """
+    # --- Credential Check ---
+    if not all([SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, APPROVED_SENDER]):
+        return "Error: One or more SMTP environment variables are missing. Please check your .env file."
 
     try:
-        print("--- Attempting to connect to OCI SMTP server ---")
-        with smtplib.SMTP(SMTP_HOST, int(SMTP_PORT)) as server:
-            # --- ADDED: Enable verbose debug output ---
-            server.set_debuglevel(1)
-            
-            server.ehlo()
-            server.starttls()
-            server.ehlo()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(msg) # Using send_message is slightly more modern for EmailMessage objects
-            
+        get_smtp_pool().send(_build_message(recipient, subject, body))
         return f"Email sent successfully to {recipient}"
     except Exception as e:
         return f"Failed to send email: {e}"
 
+
+def send_batch(messages: Iterable[Tuple[str, str, str]], pool: Optional[SmtpConnectionPool] = None) -> List[str]:
+    """
+    Sends (recipient, subject, body) messages, e.g. resolution notices, over
+    pooled SMTP sessions. Returns one status string per message, in order.
+    """
+    if pool is None and not all([SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, APPROVED_SENDER]):
+        return ["Error: One or more SMTP environment variables are missing. Please check your .env file."] * len(list(messages))
+
+    messages = list(messages)
+    errors = (pool or get_smtp_pool()).send_many([_build_message(*m) for m in messages])
+    return [f"Email sent successfully to {recipient}" if error is None else f"Failed to send email: {error}"
+            for (recipient, _, _), error in zip(messages, errors)]
+
 def send_email_via_oic_rest(email_id, subject, body):
     """
     Sends an email using a REST endpoint exposed by OIC.
@@ -79,6 +287,21 @@ def send_email_via_oic_rest(email_id, subject, body):
     except requests.RequestException as e:
         return f"Error sending email via OIC REST endpoint: {str(e)}"
 
+async def asend_email_via_oci(recipient, subject, body):
+    """
+    Asyncio version of `send_email_via_oci`.
+    smtplib is blocking, so the send runs on a worker thread.
+    """
+    return await asyncio.to_thread(send_email_via_oci, recipient, subject, body)
+
+async def asend_email_via_oic_rest(email_id, subject, body):
+    """Asyncio version of `send_email_via_oic_rest` (runs on a worker thread)."""
+    return await asyncio.to_thread(send_email_via_oic_rest, email_id, subject, body)
+
+async def asend_batch(messages, pool: Optional[SmtpConnectionPool] = None):
+    """Asyncio version of `send_batch` (runs on a worker thread)."""
+    return await asyncio.to_thread(send_batch, list(messages), pool)
+
 if __name__ == "__main__":
     # Example usage
     recipient = "malkitbhasin@kpmg.com"
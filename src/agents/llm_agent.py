@@ -4,6 +4,8 @@ from dotenv import load_dotenv
 from pathlib import Path
 from oci.addons.adk import Agent, AgentClient
 
+from src.agents.agent_pool import AGENT_POOL, agent_setting, arun_agent, run_agent
+
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 load_dotenv(BASE_DIR / "config/.env")
 
@@ -13,11 +15,12 @@ AGENT_REGION    = os.getenv("AGENT_REGION")             # e.g. us-chicago-1
 LLM_AGNET_EP_ID     = os.getenv("LLM_AGNET_EP_ID")  # supply a dedicated endpoint if desired
 
 def build_agent():
+    config = agent_config()
     client = AgentClient(
         auth_type="api_key",
-        config=OCI_CONFIG_FILE,
-        profile=OCI_PROFILE,
-        region=AGENT_REGION
+        config=config["config"],
+        profile=config["profile"],
+        region=config["region"]
     )
     # Instructions guide the LLM behavior
     instructions = (
@@ -26,30 +29,33 @@ def build_agent():
     )
     agent = Agent(
         client=client,
-        agent_endpoint_id=LLM_AGNET_EP_ID,
+        agent_endpoint_id=config["endpoint"],
         instructions=instructions,
         tools=[]  # no tools -> pure LLM
     )
     return agent
 
+def agent_config():
+    """Settings that require the pooled agent to be rebuilt when they change (re-read from config/.env)."""
+    return {
+        "config": agent_setting("OCI_CONFIG_FILE"),
+        "profile": agent_setting("OCI_PROFILE", "DEFAULT"),
+        "region": agent_setting("AGENT_REGION"),
+        "endpoint": agent_setting("LLM_AGNET_EP_ID"),
+    }
+
+AGENT_POOL.register("llm", build_agent, agent_config)
+
 def run_llm_decision(query: str) -> str:
     """
-    Initializes and runs the LLM agent for a given query.
+    Runs the pooled LLM agent for a given query.
     Handles asyncio event loop for Streamlit compatibility.
     """
-    # --- FIX for Streamlit's threading ---
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    # ------------------------------------
-
-    agent = build_agent()
-    agent.setup()
-    response = agent.run(query)
-    final_message = response.data["message"]["content"]["text"]
-    return final_message
+    return run_agent("llm", query)
+
+async def arun_llm_decision(query: str) -> str:
+    """Asyncio version of `run_llm_decision`."""
+    return await arun_agent("llm", query)
 
 if __name__ == "__main__":
     test_query = "Is the sky blue?"
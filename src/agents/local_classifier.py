@@ -0,0 +1,254 @@
+"""
+local_classifier.py
+
+Local fast-path classifier for dispute prompts.
+
+A TF-IDF nearest-centroid model trained on the labelled `Request Type` /
+`NLP Prompt` columns of the chargeback CSV (plus any rows from the `Disputes`
+table and a few keyword seeds per category). Predictions take well under a
+millisecond; `run_classification_query` only falls back to the LLM when the
+confidence is below `CLASSIFIER_CONFIDENCE_THRESHOLD`. A prompt whose best
+cosine similarity to any category is below CLASSIFIER_MIN_SIMILARITY has
+confidence 0 however clear its margin is, so vague prompts ("I want my money
+back") always go to the LLM.
+
+With ten labelled rows the model is not validated (see the report below), so
+it ships off: set LOCAL_CLASSIFIER_ENABLED=true only after a held-out report
+on your own labelled prompts supports the threshold.
+
+The keyword seeds were written from the same 10 labelled CSV rows (one per
+category), so scoring those rows with the seeds in place measures nothing. The
+report therefore either scores held-out prompts (another labelled CSV with the
+same columns) with the production model, or runs leave-one-out over the CSV
+without the seeds:
+    python -m src.agents.local_classifier --report --holdout labelled.csv
+    python -m src.agents.local_classifier --report
+With one row per category, leave-one-out leaves the category of the held-out
+row known only by its name, so it measures a much weaker model than the one
+in production: a lower bound, not a basis for tuning the threshold.
+"""
+
+import os
+import re
+import csv
+import math
+import time
+import argparse
+import logging
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+TRAINING_CSV = BASE_DIR / "Chargeback Analysis_ Dispute (1).csv"
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "false").lower() == "true"
+CLASSIFIER_CONFIDENCE_THRESHOLD = float(os.getenv("CLASSIFIER_CONFIDENCE_THRESHOLD", "0.35"))
+# Minimum cosine similarity between a prompt and its best category; below it the prompt goes to the LLM
+CLASSIFIER_MIN_SIMILARITY = float(os.getenv("CLASSIFIER_MIN_SIMILARITY", "0.3"))
+
+# Hand-written phrases that anchor each category even when the CSV has few rows for it.
+# They were written from the CSV prompts, so never evaluate on those prompts with them in place.
+CATEGORY_KEYWORDS = {
+    "Unauthorized Charge": "unauthorized charge fraudulent never signed up did not authorize duplicate account reseller",
+    "Issues with Subscription Cancellation": "cancel subscription cancellation confirmed still charged representative contact",
+    "Double Billing": "charged twice double charge billed twice same account two payments second payment",
+    "Failure to Refund within Policy Window": "refund window policy days canceled within not refunded unresponsive past window",
+    "Service Not Received": "never received service not provided not delivered could not use",
+    "Misleading Charges and Lack of Support": "misleading charges customer service non-existent support cannot contact website",
+    "Ineffective Cancellation Process": "cancellation process confusing online cancel broken unmonitored email",
+    "Billing Despite Suspension": "suspended suspension account suspended still charged after suspension",
+    "Lack of Communication": "no response emails no reply communication ignored free plan",
+    "Auto-Renewal without Consent": "auto-renewal automatic renewal automatic payment renewed without consent did not agree",
+}
+
+_STOPWORDS = frozenset("""
+a an and are as at be been but by for from had has have i i'm i've in is it its me my of on or our so
+that the their them they this to was we were with you your am will would could should this there
+number reference transaction account docusign
+""".split())
+_TOKEN_RE = re.compile(r"[a-z]+(?:-[a-z]+)?")
+
+
+def _stem(token: str) -> str:
+    for suffix in ("ations", "ation", "ing", "ed", "es", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased, stemmed unigrams plus adjacent bigrams (identifiers are dropped)."""
+    words = [_stem(w) for w in _TOKEN_RE.findall(text.lower()) if w not in _STOPWORDS and len(w) > 2]
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+def load_training_examples(csv_path: Path = TRAINING_CSV,
+                           extra_examples: Optional[Iterable[Tuple[str, str]]] = None) -> List[Tuple[str, str]]:
+    """
+    Returns (category, prompt) pairs from the chargeback CSV plus any extra
+    pairs, e.g. `(request_type, customer_prompt)` rows from the Disputes table.
+    """
+    examples = []
+    with open(csv_path, newline="", encoding="utf-8", errors="replace") as f:
+        for row in csv.DictReader(f):
+            label = (row.get("Request Type") or "").strip()
+            prompt = (row.get("NLP Prompt") or "").strip()
+            if label and prompt:
+                examples.append((label, prompt))
+    for label, prompt in extra_examples or []:
+        if label and prompt:
+            examples.append((label.strip(), prompt.strip()))
+    # The Disputes table is loaded from the same CSV in the offline stand-in
+    return list(dict.fromkeys(examples))
+
+
+class LocalClassifier:
+    """TF-IDF nearest-centroid classifier over a fixed set of categories."""
+
+    def __init__(self, categories: List[str], examples: List[Tuple[str, str]],
+                 keywords: Dict[str, str] = CATEGORY_KEYWORDS, min_similarity: float = CLASSIFIER_MIN_SIMILARITY):
+        self.categories = list(categories)
+        self.min_similarity = min_similarity
+        documents = [(label, tokenize(text)) for label, text in examples if label in self.categories]
+        documents += [(label, tokenize(f"{label} {keywords.get(label, '')}")) for label in self.categories]
+
+        doc_freq = Counter()
+        for _, tokens in documents:
+            doc_freq.update(set(tokens))
+        n_docs = len(documents)
+        self.idf = {t: math.log((1 + n_docs) / (1 + df)) + 1.0 for t, df in doc_freq.items()}
+
+        sums: Dict[str, Counter] = defaultdict(Counter)
+        for label, tokens in documents:
+            sums[label].update(self._vector(tokens))
+        self.centroids = {label: self._normalize(vec) for label, vec in sums.items()}
+        # Exact prompts seen in training are answered with full confidence
+        self._exact = {" ".join(text.split()).lower(): label for label, text in examples if label in self.categories}
+
+    def _vector(self, tokens: List[str]) -> Dict[str, float]:
+        counts = Counter(tokens)
+        return self._normalize({t: (1 + math.log(c)) * self.idf.get(t, 0.0) for t, c in counts.items()})
+
+    @staticmethod
+    def _normalize(vec) -> Dict[str, float]:
+        norm = math.sqrt(sum(v * v for v in vec.values()))
+        return {t: v / norm for t, v in vec.items()} if norm else {}
+
+    def scores(self, text: str) -> List[Tuple[str, float]]:
+        vec = self._vector(tokenize(text))
+        ranked = [(label, sum(w * centroid.get(t, 0.0) for t, w in vec.items()))
+                  for label, centroid in self.centroids.items()]
+        return sorted(ranked, key=lambda item: item[1], reverse=True)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        Returns (category, confidence). Confidence is the relative margin
+        between the best and second-best category similarity, in [0, 1], and
+        0 when the best similarity is below `min_similarity`.
+        """
+        exact = self._exact.get(" ".join(text.split()).lower())
+        if exact:
+            return exact, 1.0
+        ranked = self.scores(text)
+        (best, top), (_, second) = ranked[0], ranked[1]
+        if top <= 0 or top < self.min_similarity:
+            return best, 0.0
+        return best, (top - second) / top
+
+
+_CLASSIFIER: Optional[LocalClassifier] = None
+
+
+def get_local_classifier() -> LocalClassifier:
+    """Lazily trains the shared classifier on first use."""
+    global _CLASSIFIER
+    if _CLASSIFIER is None:
+        from src.agents.classification_agent import CLASSIFICATION_CATEGORIES
+        from src.agents.sql_templates import load_dispute_examples
+        try:
+            dispute_examples = load_dispute_examples()
+        except Exception as e:
+            logging.warning(f"Local classifier: Disputes table unavailable, training on CSV only: {e}")
+            dispute_examples = []
+        _CLASSIFIER = LocalClassifier(CLASSIFICATION_CATEGORIES, load_training_examples(extra_examples=dispute_examples))
+    return _CLASSIFIER
+
+
+def classify_locally(query: str, threshold: float = CLASSIFIER_CONFIDENCE_THRESHOLD) -> Optional[str]:
+    """Returns the local classification if it is confident enough, otherwise None."""
+    label, confidence = get_local_classifier().predict(query)
+    return label if confidence >= threshold else None
+
+
+# ────────────────────────────────────────────────────────
+# Accuracy / latency report
+# ────────────────────────────────────────────────────────
+def evaluation_report(thresholds: List[float], csv_path: Path = TRAINING_CSV,
+                      holdout_path: Optional[Path] = None) -> List[Dict[str, float]]:
+    """
+    Accuracy, coverage and latency per confidence threshold.
+    - With `holdout_path`: the production model (CSV rows plus keyword seeds)
+      classifies the labelled prompts of that file; prompts that also occur in
+      the training CSV are skipped.
+    - Otherwise leave-one-out over the CSV: each row is classified by a model
+      trained on the other rows and the category names, without the keyword
+      seeds (they were written from these rows) and without exact-match
+      shortcuts.
+    """
+    from src.agents.classification_agent import CLASSIFICATION_CATEGORIES
+    examples = load_training_examples(csv_path)
+    if holdout_path is not None:
+        model = LocalClassifier(CLASSIFICATION_CATEGORIES, examples)
+        seen = {" ".join(text.split()).lower() for _, text in examples}
+        cases = [(model, label, prompt) for label, prompt in load_training_examples(holdout_path)
+                 if " ".join(prompt.split()).lower() not in seen]
+    else:
+        cases = [(LocalClassifier(CLASSIFICATION_CATEGORIES, examples[:i] + examples[i + 1:], keywords={}), label, prompt)
+                 for i, (label, prompt) in enumerate(examples)]
+    predictions = []
+    latencies = []
+    for model, label, prompt in cases:
+        start = time.perf_counter()
+        predicted, confidence = model.predict(prompt)
+        latencies.append((time.perf_counter() - start) * 1000)
+        predictions.append((label, predicted, confidence))
+
+    latencies.sort()
+    rows = []
+    for threshold in thresholds:
+        confident = [(l, p) for l, p, c in predictions if c >= threshold]
+        correct = sum(1 for l, p in confident if l == p)
+        rows.append({
+            "threshold": threshold,
+            "prompts": len(predictions),
+            "coverage": len(confident) / len(predictions) if predictions else 0.0,
+            "accuracy": correct / len(confident) if confident else 0.0,
+            "llm_fallbacks": len(predictions) - len(confident),
+            "p50_ms": latencies[len(latencies) // 2] if latencies else 0.0,
+            "max_ms": latencies[-1] if latencies else 0.0,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local dispute classifier")
+    parser.add_argument("--report", action="store_true", help="print accuracy/latency per threshold")
+    parser.add_argument("--thresholds", default="0,0.1,0.2,0.3,0.35,0.4,0.5,0.6")
+    parser.add_argument("--holdout", type=Path, help="labelled CSV of prompts to evaluate (same columns)")
+    parser.add_argument("query", nargs="?", help="classify a single prompt")
+    args = parser.parse_args()
+
+    if args.query:
+        print(get_local_classifier().predict(args.query))
+    if args.report or not args.query:
+        rows = evaluation_report([float(t) for t in args.thresholds.split(",")], holdout_path=args.holdout)
+        print(f"{'held-out prompts' if args.holdout else 'leave-one-out without keyword seeds'}: "
+              f"{rows[0]['prompts'] if rows else 0} prompts")
+        print(f"{'threshold':>9} {'coverage':>9} {'accuracy':>9} {'llm_calls':>9} {'p50_ms':>8} {'max_ms':>8}")
+        for row in rows:
+            print(f"{row['threshold']:>9.2f} {row['coverage']:>9.0%} {row['accuracy']:>9.0%} "
+                  f"{row['llm_fallbacks']:>9} {row['p50_ms']:>8.3f} {row['max_ms']:>8.3f}")
@@ -0,0 +1,347 @@
+"""
+notification_outbox.py
+
+Durable outbox for customer notifications (email via OCI SMTP or OIC REST).
+
+Callers enqueue a message and return immediately; the dispute workflow never
+waits on email delivery. Messages are stored in a local SQLite database and a
+small worker pool drains it in the background:
+1. `enqueue()` inserts the message under an idempotency key (e.g.
+   "<dispute_id>:resolution-notice"); a repeated key is ignored.
+2. Workers claim due messages and send them with `send_email_via_oci` or
+   `send_email_via_oic_rest`.
+3. Failed sends are retried with exponential backoff (plus jitter).
+4. After OUTBOX_MAX_ATTEMPTS failures a message is moved to the dead-letter
+   list, where it can be inspected and re-queued with `retry_dead()`.
+
+The resolution notice is queued when a dispute is resolved: by the workflow
+for a final decision, and by the human action handler once an operator's
+approve / reject is processed (RESOLUTION_NOTICE_ENABLED, see
+`notify_resolution`). The recipient is the customer's email column, when the
+customer data has one.
+
+A worker claims a message with a lease (owner + expiry, OUTBOX_LEASE_SECONDS).
+Messages whose lease expired, because the process that claimed them died, are
+claimed again by any outbox on the same database, so delivery is
+at-least-once. Messages still in flight in another process (e.g. the app
+while `--drain` runs) are left alone.
+
+Usage:
+    python -m src.agents.notification_outbox            # show counts and dead letters
+    python -m src.agents.notification_outbox --drain    # send everything that is due, then exit
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import socket
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.agents.db_result import DbQueryResult
+from src.agents.email_agent import send_email_via_oci, send_email_via_oic_rest
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", str(BASE_DIR / ".cache" / "outbox.db"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "2"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "600"))
+# Upper bound on how long an idle worker sleeps before looking for due retries
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+# A claimed message not finished within this many seconds is claimed again (longer than any send)
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+# Queue a notice to the customer when a dispute is resolved
+RESOLUTION_NOTICE_ENABLED = os.getenv("RESOLUTION_NOTICE_ENABLED", "false").lower() == "true"
+RESOLUTION_NOTICE_CHANNEL = os.getenv("RESOLUTION_NOTICE_CHANNEL", "smtp")
+# Customer columns holding the notice recipient, matched case-insensitively
+CUSTOMER_EMAIL_COLUMNS = ("email", "email_address", "customer_email")
+
+OUTBOX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        channel TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        claimed_by TEXT,
+        lease_expires_at REAL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+# Columns added after the first release, for outbox databases created before them
+OUTBOX_MIGRATIONS = {"claimed_by": "TEXT", "lease_expires_at": "REAL"}
+
+STATUS_PENDING, STATUS_SENDING, STATUS_SENT, STATUS_DEAD = "pending", "sending", "sent", "dead"
+
+
+def _send_smtp(recipient: str, subject: str, body: str) -> Tuple[bool, str]:
+    result = send_email_via_oci(recipient, subject, body)
+    return result.startswith("Email sent successfully"), result
+
+
+def _send_oic_rest(recipient: str, subject: str, body: str) -> Tuple[bool, str]:
+    result = send_email_via_oic_rest(recipient, subject, body)
+    return result.startswith("Email sent successfully"), result
+
+
+# Channel -> sender returning (delivered, detail)
+DEFAULT_SENDERS: Dict[str, Callable[[str, str, str], Tuple[bool, str]]] = {
+    "smtp": _send_smtp,
+    "oic_rest": _send_oic_rest,
+}
+
+
+class NotificationOutbox:
+    def __init__(self, path=OUTBOX_PATH, workers: int = OUTBOX_WORKERS,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, backoff_seconds: float = OUTBOX_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = OUTBOX_MAX_BACKOFF_SECONDS, lease_seconds: float = OUTBOX_LEASE_SECONDS,
+                 senders: Optional[Dict[str, Callable[[str, str, str], Tuple[bool, str]]]] = None):
+        self.path = str(path)
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.senders = senders or DEFAULT_SENDERS
+        # Lease owner of this outbox instance; other processes' claims are never touched
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # One connection shared by all workers; sends happen outside the lock
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(OUTBOX_SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(outbox)")}
+        for column, column_type in OUTBOX_MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE outbox ADD COLUMN {column} {column_type}")
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # ---- producer side ------------------------------------------------------
+    def enqueue(self, recipient: str, subject: str, body: str, idempotency_key: str,
+                channel: str = "smtp") -> Tuple[int, bool]:
+        """
+        Stores a message for delivery and returns (message_id, created).
+        `created` is False when a message with the same idempotency key exists.
+        """
+        if channel not in self.senders:
+            raise ValueError(f"Unknown outbox channel '{channel}', expected one of {list(self.senders)}")
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, channel, recipient, subject, body, "
+                "next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (idempotency_key, channel, recipient, subject, body, now, now, now))
+            created = cursor.rowcount == 1
+            message_id = self._db.execute(
+                "SELECT id FROM outbox WHERE idempotency_key = ?", (idempotency_key,)).fetchone()["id"]
+        if created:
+            with self._wake:
+                self._wake.notify()
+        return message_id, created
+
+    # ---- worker side --------------------------------------------------------
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """
+        Atomically leases the next due message: a pending one, or one whose
+        lease expired (its owner died mid-send, so it is sent again).
+        """
+        now = time.time()
+        with self._lock:
+            return self._db.execute(
+                "UPDATE outbox SET status = ?, claimed_by = ?, lease_expires_at = ?, updated_at = ? WHERE id = ("
+                "  SELECT id FROM outbox WHERE (status = ? AND next_attempt_at <= ?)"
+                "  OR (status = ? AND (lease_expires_at IS NULL OR lease_expires_at <= ?))"
+                "  ORDER BY next_attempt_at LIMIT 1) RETURNING *",
+                (STATUS_SENDING, self.owner, now + self.lease_seconds, now,
+                 STATUS_PENDING, now, STATUS_SENDING, now)).fetchone()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _deliver(self, message: sqlite3.Row) -> None:
+        try:
+            delivered, detail = self.senders[message["channel"]](
+                message["recipient"], message["subject"], message["body"])
+        except Exception as e:
+            delivered, detail = False, f"{type(e).__name__}: {e}"
+        attempts = message["attempts"] + 1
+        now = time.time()
+        if delivered:
+            status, next_attempt_at, error = STATUS_SENT, now, None
+        elif attempts >= self.max_attempts:
+            status, next_attempt_at, error = STATUS_DEAD, now, detail
+            logging.error(f"Outbox: '{message['idempotency_key']}' moved to dead letters after {attempts} attempts: {detail}")
+        else:
+            status, next_attempt_at, error = STATUS_PENDING, now + self._backoff(attempts), detail
+            logging.warning(f"Outbox: '{message['idempotency_key']}' attempt {attempts} failed, will retry: {detail}")
+        with self._lock:
+            # Only while this outbox still holds the lease; otherwise another owner has taken the message over
+            updated = self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?, "
+                "claimed_by = NULL, lease_expires_at = NULL WHERE id = ? AND status = ? AND claimed_by = ?",
+                (status, attempts, next_attempt_at, error, now, message["id"], STATUS_SENDING, self.owner)).rowcount
+        if not updated:
+            logging.warning(f"Outbox: lease on '{message['idempotency_key']}' was lost before the result was recorded")
+
+    def _next_due_in(self) -> float:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(CASE WHEN status = ? THEN next_attempt_at ELSE lease_expires_at END) AS due "
+                "FROM outbox WHERE status IN (?, ?)", (STATUS_PENDING, STATUS_PENDING, STATUS_SENDING)).fetchone()
+        if row["due"] is None:
+            return OUTBOX_POLL_SECONDS
+        return min(OUTBOX_POLL_SECONDS, max(0.0, row["due"] - time.time()))
+
+    def _run_worker(self) -> None:
+        while not self._stopping.is_set():
+            message = self._claim()
+            if message is not None:
+                self._deliver(message)
+                continue
+            with self._wake:
+                self._wake.wait(self._next_due_in())
+
+    def start(self) -> "NotificationOutbox":
+        """Starts the worker pool (idempotent)."""
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for i in range(len(self._threads), self.workers):
+            thread = threading.Thread(target=self._run_worker, name=f"outbox-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._stopping.clear()
+
+    def drain(self) -> int:
+        """Sends every message that is due now on the calling thread; returns how many were attempted."""
+        attempted = 0
+        while (message := self._claim()) is not None:
+            self._deliver(message)
+            attempted += 1
+        return attempted
+
+    # ---- inspection ---------------------------------------------------------
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def get(self, idempotency_key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+        return dict(row) if row else None
+
+    def dead_letters(self) -> List[dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM outbox WHERE status = ? ORDER BY updated_at",
+                                    (STATUS_DEAD,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def retry_dead(self, message_id: Optional[int] = None) -> int:
+        """Moves one (or every) dead letter back to the queue with a fresh attempt budget."""
+        query = "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = ?"
+        params = [STATUS_PENDING, time.time(), time.time(), STATUS_DEAD]
+        if message_id is not None:
+            query += " AND id = ?"
+            params.append(message_id)
+        with self._lock:
+            requeued = self._db.execute(query, params).rowcount
+        with self._wake:
+            self._wake.notify_all()
+        return requeued
+
+
+_outbox: Optional[NotificationOutbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> NotificationOutbox:
+    """Process-wide outbox with its workers started."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = NotificationOutbox()
+    return _outbox.start()
+
+
+def queue_resolution_notice(dispute_id: str, recipient: str, decision: dict, channel: str = "smtp") -> Tuple[int, bool]:
+    """
+    Queues the customer notice for a resolved dispute (at most one per dispute)
+    and returns immediately.
+    """
+    subject = f"Update on your dispute {dispute_id}: {decision.get('dispute_status', 'Reviewed')}"
+    body = (f"Your dispute has been reviewed.\n\n"
+            f"Outcome: {decision.get('dispute_status')}\n"
+            f"Reason: {decision.get('reason')}\n"
+            f"Next step: {decision.get('recommended_action')}\n")
+    return get_outbox().enqueue(recipient, subject, body, f"{dispute_id}:resolution-notice", channel)
+
+
+def customer_email(db_result: DbQueryResult) -> Optional[str]:
+    """The customer's email from the customer row's extra columns (CUSTOMER_EMAIL_COLUMNS), or None."""
+    columns = {str(k).lower(): v for k, v in db_result.user_info.extra.items()}
+    for name in CUSTOMER_EMAIL_COLUMNS:
+        if columns.get(name):
+            return str(columns[name])
+    return None
+
+
+def notify_resolution(dispute_id: str, recipient: Optional[str], decision: dict) -> Optional[int]:
+    """
+    Queues the resolution notice when RESOLUTION_NOTICE_ENABLED is set and
+    returns its message ID. Never raises: a dispute is resolved whether or not
+    its notice could be queued.
+    """
+    if not RESOLUTION_NOTICE_ENABLED:
+        return None
+    if not recipient:
+        logging.info(f"No customer email for dispute {dispute_id}, resolution notice not queued")
+        return None
+    try:
+        message_id, created = queue_resolution_notice(dispute_id, recipient, decision, RESOLUTION_NOTICE_CHANNEL)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        logging.error(f"Could not queue the resolution notice for dispute {dispute_id}: {e}")
+        return None
+    if not created:
+        logging.info(f"Resolution notice for dispute {dispute_id} was already queued (#{message_id})")
+    return message_id
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    outbox = NotificationOutbox()
+    if "--drain" in sys.argv:
+        print(f"Attempted {outbox.drain()} message(s)")
+    print(f"Outbox {outbox.path}: {outbox.counts()}")
+    for letter in outbox.dead_letters():
+        print(f"  DEAD #{letter['id']} {letter['idempotency_key']} -> {letter['recipient']}: {letter['last_error']}")
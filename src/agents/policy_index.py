@@ -0,0 +1,244 @@
+"""
+policy_index.py
+
+Precomputed terms-and-conditions snippets per dispute classification.
+
+Without this index, the workflow sends one generic question ("What are the
+terms and conditions for refunds and cancellations?") to the RAG agent for
+every dispute. Instead, an offline job asks the RAG agent one targeted
+question per category in CLASSIFICATION_CATEGORIES and stores the answers in a
+versioned local index. At runtime the RAG step is a dictionary lookup by
+classification, with no agent round trip.
+
+Layout (POLICY_INDEX_DIR, default .cache/policy_index/):
+    v0001.json, v0002.json, ...   one file per build, never modified
+    CURRENT                       name of the active build (edit it to roll back)
+
+Each build records the knowledge base ID and RAG_KB_VERSION it was built from.
+When either no longer matches the configuration, the index counts as stale:
+- lookups fall back to the cached generic RAG query;
+- with POLICY_INDEX_AUTO_REFRESH=true, one rebuild starts in the background.
+
+Usage:
+    python -m src.agents.policy_index --build      # build a new version
+    python -m src.agents.policy_index              # show the active version
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.agents.classification_agent import CLASSIFICATION_CATEGORIES
+from src.agents.rag_agent import (
+    RAG_AGENT_KB_TERMS_AND_CONDITIONS, RAG_KB_VERSION, arun_rag_query, arun_rag_query_cached)
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+POLICY_INDEX_ENABLED = os.getenv("POLICY_INDEX_ENABLED", "true").lower() == "true"
+POLICY_INDEX_DIR = Path(os.getenv("POLICY_INDEX_DIR", BASE_DIR / ".cache" / "policy_index"))
+POLICY_INDEX_AUTO_REFRESH = os.getenv("POLICY_INDEX_AUTO_REFRESH", "false").lower() == "true"
+# Parallel RAG queries while building
+POLICY_INDEX_BUILD_CONCURRENCY = int(os.getenv("POLICY_INDEX_BUILD_CONCURRENCY", "4"))
+
+# What each category's decision actually hinges on
+POLICY_QUESTIONS = {
+    "Unauthorized Charge": "charges the customer says they never authorized, fraudulent charges and duplicate accounts",
+    "Issues with Subscription Cancellation": "charges after a subscription cancellation was requested or confirmed",
+    "Double Billing": "duplicate payments and being charged twice for the same account or period",
+    "Failure to Refund within Policy Window": "the refund window, how many days after billing a refund can be requested",
+    "Service Not Received": "charges for a service that was not provided or could not be used",
+    "Misleading Charges and Lack of Support": "overage and usage charges and what customers are told about them",
+    "Ineffective Cancellation Process": "how a subscription must be cancelled and the dispute period for late cancellations",
+    "Billing Despite Suspension": "billing for suspended or cancelled accounts",
+    "Lack of Communication": "refunds when the customer's cancellation or refund requests were not answered",
+    "Auto-Renewal without Consent": "automatic renewal, renewal notices and refunds for renewals the customer did not want",
+}
+
+
+def policy_query(category: str) -> str:
+    topic = POLICY_QUESTIONS.get(category, category.lower())
+    return (f"What do the terms and conditions say about refunds, cancellations and disputes regarding {topic}? "
+            f"Quote the relevant clauses, including time limits.")
+
+
+class PolicyIndex:
+    """One immutable build of per-category policy snippets."""
+
+    def __init__(self, version: int, kb_id: Optional[str], kb_version: str, built_at: float,
+                 policies: Dict[str, dict]):
+        self.version = version
+        self.kb_id = kb_id
+        self.kb_version = kb_version
+        self.built_at = built_at
+        self.policies = policies
+
+    def is_current(self, kb_id: Optional[str] = None, kb_version: Optional[str] = None) -> bool:
+        """True when built from the configured knowledge base and RAG_KB_VERSION."""
+        return (self.kb_id == (kb_id or RAG_AGENT_KB_TERMS_AND_CONDITIONS)
+                and self.kb_version == (kb_version or RAG_KB_VERSION))
+
+    def get(self, category: str) -> Optional[str]:
+        entry = self.policies.get(category)
+        return entry["answer"] if entry else None
+
+    def to_dict(self) -> dict:
+        return {"version": self.version, "kb_id": self.kb_id, "kb_version": self.kb_version,
+                "built_at": self.built_at, "policies": self.policies}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PolicyIndex":
+        return cls(data["version"], data.get("kb_id"), data["kb_version"], data["built_at"], data["policies"])
+
+
+class PolicyIndexStore:
+    """Versioned builds in a directory, with a CURRENT pointer."""
+
+    def __init__(self, directory: Path = POLICY_INDEX_DIR):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._active: Optional[PolicyIndex] = None
+        self._loaded = False
+        self._refreshing = False
+        self._last_refresh = 0.0
+
+    def _current_path(self) -> Path:
+        return self.directory / "CURRENT"
+
+    def load(self) -> Optional[PolicyIndex]:
+        """The active build, read from disk once."""
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    name = self._current_path().read_text(encoding="utf-8").strip()
+                    with open(self.directory / name, encoding="utf-8") as f:
+                        self._active = PolicyIndex.from_dict(json.load(f))
+                except FileNotFoundError:
+                    self._active = None
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Ignoring unreadable policy index in {self.directory}: {e}")
+                    self._active = None
+            return self._active
+
+    def versions(self):
+        return sorted(int(p.stem[1:]) for p in self.directory.glob("v*.json"))
+
+    def save(self, policies: Dict[str, dict], kb_id: Optional[str], kb_version: str) -> PolicyIndex:
+        """Writes a new build and makes it the active one."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            version = (self.versions() or [0])[-1] + 1
+            index = PolicyIndex(version, kb_id, kb_version, time.time(), policies)
+            name = f"v{version:04d}.json"
+            tmp_path = self.directory / (name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index.to_dict(), f, indent=1)
+            os.replace(tmp_path, self.directory / name)
+            tmp_current = self.directory / "CURRENT.tmp"
+            tmp_current.write_text(name, encoding="utf-8")
+            os.replace(tmp_current, self._current_path())
+            self._active, self._loaded = index, True
+        return index
+
+    def refresh_in_background(self, min_interval_seconds: float = 600.0) -> None:
+        """Starts at most one background rebuild at a time (and one per `min_interval_seconds`)."""
+        with self._lock:
+            if self._refreshing or time.time() - self._last_refresh < min_interval_seconds:
+                return
+            self._refreshing, self._last_refresh = True, time.time()
+
+        def rebuild():
+            try:
+                asyncio.run(build_policy_index(self))
+            except Exception as e:
+                logging.error(f"Policy index rebuild failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=rebuild, name="policy-index-refresh", daemon=True).start()
+
+
+POLICY_INDEX_STORE = PolicyIndexStore()
+
+
+async def build_policy_index(store: PolicyIndexStore = POLICY_INDEX_STORE,
+                             categories=CLASSIFICATION_CATEGORIES,
+                             concurrency: int = POLICY_INDEX_BUILD_CONCURRENCY) -> PolicyIndex:
+    """Runs one targeted RAG query per category and saves the answers as a new version."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(category):
+        async with semaphore:
+            query = policy_query(category)
+            start = time.perf_counter()
+            answer = await arun_rag_query(query)
+            logging.info(f"Policy index: '{category}' answered in {time.perf_counter() - start:.2f}s")
+            return category, {"query": query, "answer": answer}
+
+    policies = dict(await asyncio.gather(*(fetch(c) for c in categories)))
+    index = store.save(policies, RAG_AGENT_KB_TERMS_AND_CONDITIONS, RAG_KB_VERSION)
+    logging.info(f"Policy index v{index.version} built for {len(policies)} categories")
+    return index
+
+
+def lookup_policy(classification: str, store: PolicyIndexStore = POLICY_INDEX_STORE) -> Optional[str]:
+    """
+    The precomputed policy snippet for a classification, or None when the
+    index is disabled, missing, stale or has no entry for it.
+    """
+    if not POLICY_INDEX_ENABLED:
+        return None
+    index = store.load()
+    if index is None:
+        return None
+    if not index.is_current():
+        logging.warning(f"Policy index v{index.version} was built for KB version {index.kb_version}, "
+                        f"current is {RAG_KB_VERSION}; using the RAG agent")
+        if POLICY_INDEX_AUTO_REFRESH:
+            store.refresh_in_background()
+        return None
+    return index.get(classification)
+
+
+async def arun_policy_lookup(classification: str, fallback_query: str) -> Tuple[str, str]:
+    """
+    RAG step for the workflow. Returns (terms and conditions, source): the
+    precomputed snippet ("policy_index") when available, otherwise the answer
+    to `fallback_query` from the RAG answer cache ("cache") or the RAG agent
+    ("agent").
+    """
+    snippet = lookup_policy(classification)
+    if snippet is not None:
+        return snippet, "policy_index"
+    answer, from_cache = await arun_rag_query_cached(fallback_query)
+    return answer, "cache" if from_cache else "agent"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Per-classification policy snippet index")
+    parser.add_argument("--build", action="store_true", help="query the RAG agent once per category and save a new version")
+    args = parser.parse_args()
+
+    if args.build:
+        asyncio.run(build_policy_index())
+    index = POLICY_INDEX_STORE.load()
+    if index is None:
+        print(f"No policy index in {POLICY_INDEX_DIR}; run with --build")
+    else:
+        state = "current" if index.is_current() else "STALE"
+        print(f"Policy index v{index.version} ({state}), KB version {index.kb_version}, "
+              f"built {time.strftime('%Y-%m-%d %H:%M', time.localtime(index.built_at))}, "
+              f"versions on disk: {POLICY_INDEX_STORE.versions()}")
+        for category in CLASSIFICATION_CATEGORIES:
+            answer = index.get(category)
+            print(f"- {category:<40} {len(answer) if answer else 0:>6} chars")
@@ -0,0 +1,210 @@
+"""
+precedent_index.py
+
+Local similarity index over historical dispute prompts (the `Disputes` table).
+
+Each prompt is turned into a hashed feature vector and stored as one row of a
+NumPy matrix. The features are the classifier's stemmed word unigrams and
+bigrams plus character 4-grams, so typos and rewordings still overlap. Rows
+are L2-normalized, so a query is a single matrix-vector product (cosine
+similarity) followed by a partial sort. That takes milliseconds even for tens
+of thousands of disputes.
+
+Uses:
+- `search()` returns the top-k prior disputes with their recorded status and
+  outcome. The workflow passes them to the LLM decision step as precedents.
+  An exact repeat of an earlier dispute is only ever a (top-ranked)
+  precedent: its old outcome is not replayed, because the customer data may
+  have changed since (replays validated against the DB snapshot are the
+  decision cache's job).
+- `add()` / `refresh()` update the index incrementally, either as disputes are
+  resolved or from new rows in the Disputes table.
+
+Usage:
+    python -m src.agents.precedent_index "I was charged twice for my yearly plan"
+"""
+
+import os
+import time
+import zlib
+import argparse
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.agents.local_classifier import tokenize
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+PRECEDENTS_ENABLED = os.getenv("PRECEDENTS_ENABLED", "true").lower() == "true"
+PRECEDENT_TOP_K = int(os.getenv("PRECEDENT_TOP_K", "3"))
+PRECEDENT_MIN_SCORE = float(os.getenv("PRECEDENT_MIN_SCORE", "0.25"))
+# Hashed feature dimensions; 2048 float32 columns are 8 KB per indexed dispute
+PRECEDENT_VECTOR_DIM = int(os.getenv("PRECEDENT_VECTOR_DIM", "2048"))
+
+# Statuses that make a prior dispute usable as a decided precedent
+DECIDED_STATUSES = ("Accepted", "Rejected")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+@dataclass
+class Precedent:
+    dispute_id: Optional[int]
+    score: float
+    account_number: Optional[str]
+    transaction_number: Optional[str]
+    request_type: Optional[str]
+    dispute_status: Optional[str]
+    outcome_details: Optional[str]
+    customer_prompt: str
+
+    def to_context(self, max_prompt_chars: int = 300) -> Dict[str, Any]:
+        """Compact view for the LLM prompt."""
+        return {
+            "similarity": round(self.score, 3),
+            "request_type": self.request_type,
+            "dispute_status": self.dispute_status,
+            "outcome": self.outcome_details,
+            "customer_prompt": self.customer_prompt[:max_prompt_chars],
+        }
+
+
+class PrecedentIndex:
+    """Hashed n-gram vectors of dispute prompts in a growable NumPy matrix."""
+
+    def __init__(self, dim: int = PRECEDENT_VECTOR_DIM, capacity: int = 1024):
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._decided = np.zeros(capacity, dtype=bool)
+        self._records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self.last_dispute_id = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def vectorize(self, text: str) -> np.ndarray:
+        features = tokenize(text)
+        joined = " ".join(normalize_prompt(text).split())
+        features += [joined[i:i + 4] for i in range(len(joined) - 3)]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not features:
+            return vector
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint64, count=len(features))
+        # The low bits pick the column, one more bit picks the sign (keeps hash collisions unbiased)
+        columns = (hashes % self.dim).astype(np.intp)
+        signs = np.where((hashes >> np.uint64(31)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, columns, signs)
+        # Sublinear term frequency, then unit length for cosine similarity
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, prompt: str, dispute_id: Optional[int] = None, account_number: Optional[str] = None,
+            transaction_number: Optional[str] = None, request_type: Optional[str] = None,
+            dispute_status: Optional[str] = None, outcome_details: Optional[str] = None) -> int:
+        """Indexes one dispute and returns its row number."""
+        vector = self.vectorize(prompt)
+        record = {
+            "dispute_id": dispute_id,
+            "account_number": str(account_number) if account_number else None,
+            "transaction_number": str(transaction_number).upper() if transaction_number else None,
+            "request_type": request_type or None,
+            "dispute_status": dispute_status or None,
+            "outcome_details": outcome_details or None,
+            "customer_prompt": prompt,
+        }
+        with self._lock:
+            row = len(self._records)
+            if row == self._matrix.shape[0]:
+                # Grow geometrically so incremental adds stay amortized O(1)
+                grown = np.zeros((row * 2, self.dim), dtype=np.float32)
+                grown[:row] = self._matrix
+                self._matrix = grown
+                self._decided = np.concatenate([self._decided, np.zeros(row, dtype=bool)])
+            self._matrix[row] = vector
+            self._decided[row] = record["dispute_status"] in DECIDED_STATUSES
+            self._records.append(record)
+            if dispute_id is not None:
+                self.last_dispute_id = max(self.last_dispute_id, int(dispute_id))
+        return row
+
+    def refresh(self) -> int:
+        """Indexes Disputes rows added since the last refresh. Returns the number of new rows."""
+        from src.agents.sql_templates import load_dispute_precedents
+        rows = load_dispute_precedents(after_id=self.last_dispute_id)
+        for row in rows:
+            self.add(row["customer_prompt"], dispute_id=row["dispute_id"], account_number=row["account_number"],
+                     transaction_number=row["transaction_number"], request_type=row["request_type"],
+                     dispute_status=row["dispute_status"], outcome_details=row["outcome_details"])
+        return len(rows)
+
+    def search(self, prompt: str, k: int = PRECEDENT_TOP_K, min_score: float = PRECEDENT_MIN_SCORE,
+               decided_only: bool = True) -> List[Precedent]:
+        """Top-k most similar prior disputes, best first."""
+        query = self.vectorize(prompt)
+        with self._lock:
+            n = len(self._records)
+            if n == 0 or k <= 0:
+                return []
+            scores = self._matrix[:n] @ query
+            records = self._records[:n]
+            if decided_only:
+                scores[~self._decided[:n]] = -1.0
+        candidates = min(k, n)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[np.argsort(-scores[top])]
+        return [Precedent(score=float(scores[i]), **records[i]) for i in top if scores[i] >= min_score]
+
+
+_INDEX: Optional[PrecedentIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_precedent_index() -> PrecedentIndex:
+    """Shared index, built from the Disputes table on first use."""
+    global _INDEX
+    with _index_lock:
+        if _INDEX is None:
+            index = PrecedentIndex()
+            start = time.perf_counter()
+            try:
+                index.refresh()
+            except Exception as e:
+                logging.warning(f"Precedent index: Disputes table unavailable, starting empty: {e}")
+            logging.info(f"Precedent index: {len(index)} disputes indexed in {time.perf_counter() - start:.3f}s")
+            _INDEX = index
+    return _INDEX
+
+
+def find_precedents(prompt: str, k: int = PRECEDENT_TOP_K) -> List[Precedent]:
+    """Top-k decided precedents for a dispute prompt (empty when disabled)."""
+    if not PRECEDENTS_ENABLED:
+        return []
+    return get_precedent_index().search(prompt, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the dispute precedent index")
+    parser.add_argument("query", help="dispute prompt")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    index = get_precedent_index()
+    start = time.perf_counter()
+    results = index.search(args.query, args.k, min_score=0.0, decided_only=False)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"{len(index)} disputes indexed, search took {elapsed_ms:.2f} ms")
+    for p in results:
+        print(f"{p.score:6.3f}  #{p.dispute_id}  {p.request_type}  [{p.dispute_status}] {p.outcome_details}")
+        print(f"        {p.customer_prompt[:100]}")
+    print(asdict(results[0]) if results else "No precedents")
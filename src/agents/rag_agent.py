@@ -12,7 +12,12 @@ Workflow Overview:
 3. Run the agent with user input and print response
 """
 import os
-from typing import Dict
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 import logging
@@ -21,6 +26,8 @@ import asyncio
 from oci.addons.adk import Agent, AgentClient, tool
 from oci.addons.adk.tool.prebuilt import AgenticRagTool
 
+from src.agents.agent_pool import AGENT_POOL, agent_setting, arun_agent, run_agent
+
 # ────────────────────────────────────────────────────────
 # 1) bootstrap paths + env + llm
 # ────────────────────────────────────────────────────────
@@ -39,17 +46,24 @@ AGENT_SERVICE_EP = os.getenv("AGENT_SERVICE_EP")
 RAG_AGENT_EP_ID = os.getenv("RAG_AGENT_EP_ID")
 RAG_AGENT_KB_TERMS_AND_CONDITIONS = os.getenv("RAG_AGENT_KB_TERMS_AND_CONDITIONS")
 
+# RAG answer cache: bump RAG_KB_VERSION whenever the knowledge base documents change
+RAG_CACHE_DIR = Path(os.getenv("RAG_CACHE_DIR", PROJECT_ROOT / ".cache"))
+RAG_CACHE_TTL_SECONDS = float(os.getenv("RAG_CACHE_TTL_SECONDS", "86400"))
+RAG_KB_VERSION = os.getenv("RAG_KB_VERSION", "1")
+RAG_CACHE_ENABLED = os.getenv("RAG_CACHE_ENABLED", "true").lower() == "true"
+
 
 # ────────────────────────────────────────────────────────
 # 2) Logic
 # ────────────────────────────────────────────────────────
 def agent_flow():
 
+    config = agent_config()
     client = AgentClient(
         auth_type="api_key",
-        config=OCI_CONFIG_FILE,
-        profile=OCI_PROFILE,
-        region=AGENT_REGION
+        config=config["config"],
+        profile=config["profile"],
+        region=config["region"]
     )
 
     # instructions = prompt_Agent_Auditor # Assign the right topic
@@ -59,34 +73,154 @@ def agent_flow():
     
     agent = Agent(
         client=client,
-        agent_endpoint_id=RAG_AGENT_EP_ID,
+        agent_endpoint_id=config["endpoint"],
         instructions=instructions,
         tools=[
-            AgenticRagTool(knowledge_base_ids=[RAG_AGENT_KB_TERMS_AND_CONDITIONS], description=custom_instructions),
+            AgenticRagTool(knowledge_base_ids=[config["knowledge_base"]], description=custom_instructions),
         ]
     )
 
     return agent
 
+def agent_config():
+    """Settings that require the pooled agent to be rebuilt when they change (re-read from config/.env)."""
+    return {
+        "config": agent_setting("OCI_CONFIG_FILE"),
+        "profile": agent_setting("OCI_PROFILE"),
+        "region": agent_setting("AGENT_REGION"),
+        "endpoint": agent_setting("RAG_AGENT_EP_ID"),
+        "knowledge_base": agent_setting("RAG_AGENT_KB_TERMS_AND_CONDITIONS"),
+    }
+
+AGENT_POOL.register("rag", agent_flow, agent_config)
+
+# ────────────────────────────────────────────────────────
+# 3) Answer cache
+# ────────────────────────────────────────────────────────
+class RagAnswerCache:
+    """
+    Disk-backed cache of RAG answers keyed by (query text, knowledge base ID).
+
+    Entries live in memory for fast lookups and are written through to a JSON
+    file so they survive restarts. An entry is stale once it is older than
+    `ttl_seconds` or was stored under a different `kb_version`. Several
+    processes (workers, the batch runner) may share the file: each write goes
+    through its own temp file and first merges in the entries the others
+    stored, so an answer is only lost when two writes race (it is then simply
+    fetched again).
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float = RAG_CACHE_TTL_SECONDS,
+                 kb_version: str = RAG_KB_VERSION):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.kb_version = kb_version
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = self._load()
+
+    @staticmethod
+    def make_key(query: str, kb_id: Optional[str]) -> str:
+        normalized = " ".join(query.split()).lower()
+        return hashlib.sha256(f"{kb_id}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, OSError) as e:
+            logging.warning(f"Ignoring unreadable RAG cache file {self.path}: {e}")
+            return {}
+
+    def _persist(self) -> None:
+        """Atomically rewrites the file; a failed write is logged and the entries stay in memory."""
+        tmp_path = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.path.parent, prefix=self.path.name,
+                                             suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not write RAG cache file {self.path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def get(self, query: str, kb_id: Optional[str]) -> Optional[str]:
+        entry = self._entries.get(self.make_key(query, kb_id))
+        if entry is None:
+            return None
+        if entry["kb_version"] != self.kb_version or time.time() - entry["created_at"] > self.ttl_seconds:
+            return None
+        return entry["answer"]
+
+    def put(self, query: str, kb_id: Optional[str], answer: str) -> None:
+        with self._lock:
+            # Keep what other processes stored since this one loaded the file
+            self._entries = {**self._load(), **self._entries}
+            self._entries[self.make_key(query, kb_id)] = {
+                "query": query,
+                "kb_id": kb_id,
+                "kb_version": self.kb_version,
+                "created_at": time.time(),
+                "answer": answer,
+            }
+            self._persist()
+
+    def bump_kb_version(self, kb_version: str) -> None:
+        """Marks every entry stored under an older knowledge base version as stale."""
+        with self._lock:
+            self.kb_version = kb_version
+            self._entries = {k: v for k, v in self._entries.items() if v["kb_version"] == kb_version}
+            self._persist()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._persist()
+
+
+RAG_ANSWER_CACHE = RagAnswerCache(RAG_CACHE_DIR / "rag_answers.json")
+
 # NEW function that can be imported by the workflow
 def run_rag_query(query: str) -> str:
     """
-    Initializes and runs the RAG agent for a given query.
+    Runs the pooled RAG agent for a given query.
     Handles asyncio event loop for Streamlit compatibility.
     """
-    # --- FIX for Streamlit's threading ---
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    # ------------------------------------
-
-    agent = agent_flow()
-    agent.setup()
-    response = agent.run(query)
-    final_message = response.data["message"]["content"]["text"]
-    return final_message
+    return run_agent("rag", query)
+
+async def arun_rag_query(query: str) -> str:
+    """Asyncio version of `run_rag_query`."""
+    return await arun_agent("rag", query)
+
+def run_rag_query_cached(query: str, kb_id: Optional[str] = RAG_AGENT_KB_TERMS_AND_CONDITIONS) -> Tuple[str, bool]:
+    """
+    Answers `query` from the RAG answer cache when possible.
+    Returns (answer, served_from_cache).
+    """
+    if RAG_CACHE_ENABLED:
+        cached = RAG_ANSWER_CACHE.get(query, kb_id)
+        if cached is not None:
+            return cached, True
+    answer = run_rag_query(query)
+    if RAG_CACHE_ENABLED:
+        RAG_ANSWER_CACHE.put(query, kb_id, answer)
+    return answer, False
+
+async def arun_rag_query_cached(query: str, kb_id: Optional[str] = RAG_AGENT_KB_TERMS_AND_CONDITIONS) -> Tuple[str, bool]:
+    """Asyncio version of `run_rag_query_cached`."""
+    if RAG_CACHE_ENABLED:
+        cached = RAG_ANSWER_CACHE.get(query, kb_id)
+        if cached is not None:
+            return cached, True
+    answer = await arun_rag_query(query)
+    if RAG_CACHE_ENABLED:
+        # The cache writes to disk, keep that off the event loop
+        await asyncio.to_thread(RAG_ANSWER_CACHE.put, query, kb_id, answer)
+    return answer, False
 
 # MODIFIED main block for standalone testing
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+"""
+smtp_standin.py
+
+Local SMTP stand-in server and benchmark for the pooled email sender.
+
+The stand-in speaks enough SMTP for `smtplib` (EHLO/HELO, AUTH PLAIN/LOGIN,
+MAIL, RCPT, DATA, RSET, NOOP, QUIT), accepts any credentials and keeps the
+messages in memory. Every reply can be delayed by `latency_seconds` to model
+the round trip to a remote provider, which is what connection reuse saves.
+It is built on the standard library (no aiosmtpd dependency) and does not
+offer STARTTLS, so clients connect to it with `use_tls=False`.
+
+Usage:
+    python -m src.agents.smtp_standin --benchmark --messages 200 --latency 0.005
+"""
+
+import argparse
+import smtplib
+import socketserver
+import threading
+import time
+from typing import List, Optional
+
+from src.agents.email_agent import RateLimiter, SmtpConnectionPool, _build_message, send_batch
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str) -> None:
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self) -> None:
+        self.server.count("connections")
+        self._reply("220 smtp-standin ESMTP ready")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self._reply("250-smtp-standin\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 SIZE 10485760")
+            elif verb == "HELO":
+                self._reply("250 smtp-standin")
+            elif verb == "AUTH":
+                parts = command.split()
+                if len(parts) > 1 and parts[1].upper() == "LOGIN":
+                    for prompt in ("334 VXNlcm5hbWU6", "334 UGFzc3dvcmQ6"):
+                        self._reply(prompt)
+                        self.rfile.readline()
+                elif len(parts) == 2:
+                    self._reply("334 ")
+                    self.rfile.readline()
+                self._reply("235 2.7.0 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(line)
+                self.server.store(b"".join(lines))
+                self._reply("250 OK queued")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """In-process SMTP server on 127.0.0.1; use as a context manager."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0, latency_seconds: float = 0.0):
+        super().__init__(("127.0.0.1", port), _SmtpHandler)
+        self.latency_seconds = latency_seconds
+        self.messages: List[bytes] = []
+        self.stats = {"connections": 0, "messages": 0}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def store(self, message: bytes) -> None:
+        with self._lock:
+            self.messages.append(message)
+            self.stats["messages"] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+# ────────────────────────────────────────────────────────
+# Benchmark
+# ────────────────────────────────────────────────────────
+def _send_per_connection(port: int, messages) -> None:
+    """The previous behaviour: a new connection, EHLO and login for every message."""
+    for msg in messages:
+        with smtplib.SMTP("127.0.0.1", port) as server:
+            server.ehlo()
+            server.login("user", "password")
+            server.send_message(msg)
+
+
+def run_benchmark(message_count: int = 200, latency_seconds: float = 0.005, pool_size: int = 4) -> List[dict]:
+    notices = [(f"customer{i}@example.com", f"Dispute {i} resolved", "Your dispute has been resolved.")
+               for i in range(message_count)]
+    rows = []
+
+    def measure(label, fn):
+        with SmtpStandIn(latency_seconds=latency_seconds) as server:
+            start = time.perf_counter()
+            fn(server.port)
+            elapsed = time.perf_counter() - start
+            rows.append({"mode": label, "seconds": elapsed, "messages": server.stats["messages"],
+                         "connections": server.stats["connections"],
+                         "messages_per_second": server.stats["messages"] / elapsed if elapsed else 0.0})
+
+    def new_pool(port, size):
+        return SmtpConnectionPool("127.0.0.1", port, "user", "password", use_tls=False, size=size,
+                                  rate_limiter=RateLimiter(0))
+
+    measure("connection per message", lambda port: _send_per_connection(
+        port, [_build_message(*n, sender="noreply@example.com") for n in notices]))
+
+    def pooled_sequential(port):
+        pool = new_pool(port, 1)
+        for notice in notices:
+            pool.send(_build_message(*notice, sender="noreply@example.com"))
+        pool.close()
+    measure("pooled session, one by one", pooled_sequential)
+
+    def pooled_batch(port):
+        pool = new_pool(port, pool_size)
+        results = send_batch(notices, pool=pool)
+        pool.close()
+        assert all(r.startswith("Email sent") for r in results), results[:3]
+    measure(f"send_batch ({pool_size} sessions)", pooled_batch)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local SMTP stand-in and email sending benchmark.")
+    parser.add_argument("--benchmark", action="store_true", help="compare per-message connections with pooled sending")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005, help="simulated seconds per server reply")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8025, help="port to serve on without --benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"{'Mode':<30} {'Seconds':>9} {'Msg/s':>9} {'Connections':>12}")
+        for row in run_benchmark(args.messages, args.latency, args.pool_size):
+            print(f"{row['mode']:<30} {row['seconds']:>9.2f} {row['messages_per_second']:>9.1f} {row['connections']:>12}")
+    else:
+        with SmtpStandIn(port=args.port, latency_seconds=args.latency) as standin:
+            print(f"SMTP stand-in listening on 127.0.0.1:{standin.port} (Ctrl+C to stop)")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,230 @@
+"""
+sql_templates.py
+
+Deterministic template query engine for the DB step.
+
+Instead of asking the agentic SQL tool to write and self-correct SQL, the
+account and transaction numbers are pulled out of the prompt with regular
+expressions and a fixed set of parameterized queries is run against the
+`Customers` / `Transactions` / `AccountUsage` / `Disputes` schema. The result
+is returned as a `DbQueryResult` with the same `user_info` / `account_usage` /
+`transactions` sections the DB agent is asked to produce (plus
+`dispute_history`), so no JSON has to be generated or parsed.
+
+Backends (DB_TEMPLATE_BACKEND):
+- "oracle": a direct connection through the `oracledb` driver using
+  ORACLE_DB_USER / ORACLE_DB_PASSWORD / ORACLE_DB_DSN (default when the DSN
+  is set). The driver is optional (`pip install oracledb`) and imported only
+  for this backend; CLOB columns such as `customer_prompt` are fetched as
+  strings.
+- "sqlite": the offline stand-in loaded from the bundled CSVs, see
+  sqlite_standin.py. Opt-in only: it is never used unless configured, or
+  requested explicitly by offline tools (fake agents, replay, benchmarks).
+Without a DSN and without DB_TEMPLATE_BACKEND, no template backend is
+configured and the DB step uses the agentic SQL tool.
+
+Transaction numbers are matched case-insensitively: the prompt regex ignores
+case, so "p-1234567890" must find "P-1234567890".
+"""
+
+import os
+import re
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.agents.db_result import DbQueryResult
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+ORACLE_DB_USER = os.getenv("ORACLE_DB_USER")
+ORACLE_DB_PASSWORD = os.getenv("ORACLE_DB_PASSWORD")
+ORACLE_DB_DSN = os.getenv("ORACLE_DB_DSN")
+DB_TEMPLATE_BACKEND = os.getenv("DB_TEMPLATE_BACKEND", "oracle" if ORACLE_DB_DSN else "")
+TEMPLATE_BACKENDS = ("oracle", "sqlite")
+TEMPLATE_BACKEND_CONFIGURED = DB_TEMPLATE_BACKEND in TEMPLATE_BACKENDS
+SQLITE_STANDIN_PATH = os.getenv("SQLITE_STANDIN_PATH", ":memory:")
+# Upper bound on rows returned per list section
+MAX_ROWS_PER_SECTION = int(os.getenv("DB_TEMPLATE_MAX_ROWS", "20"))
+
+# ────────────────────────────────────────────────────────
+# 1) Identifier extraction
+# ────────────────────────────────────────────────────────
+ACCOUNT_NUMBER_RE = re.compile(
+    r"account\s*(?:number|no\.?|num|#)?\s*(?:is|:|#)?\s*(\d{6,})", re.IGNORECASE)
+TRANSACTION_NUMBER_RE = re.compile(
+    r"(?:transaction|invoice|payment)\s*(?:number|no\.?|num|id|#)?\s*(?:is|:|#)?\s*"
+    r"([A-Z]{1,4}-?[A-Z0-9]*\d[A-Z0-9]*)", re.IGNORECASE)
+
+
+def extract_identifiers(prompt: str) -> Tuple[Optional[str], Optional[str]]:
+    """Returns (account_number, transaction_number) found in the prompt, or None for each."""
+    account = ACCOUNT_NUMBER_RE.search(prompt)
+    transaction = TRANSACTION_NUMBER_RE.search(prompt)
+    return (account.group(1) if account else None,
+            transaction.group(1) if transaction else None)
+
+
+# ────────────────────────────────────────────────────────
+# 2) Query templates (named binds work for both sqlite3 and oracledb)
+# ────────────────────────────────────────────────────────
+# Transaction numbers compare case-insensitively (index UPPER(transaction_number) on large tables)
+SQL_ACCOUNT_FOR_TRANSACTION = (
+    "SELECT account_number FROM Transactions WHERE UPPER(transaction_number) = UPPER(:transaction_number)")
+
+# Every column: optional ones (business_unit, customer_name, ship-to) address the refund's credit memo
+SQL_CUSTOMER = (
+    "SELECT * FROM Customers WHERE account_number = :account_number")
+
+SQL_ACCOUNT_USAGE = (
+    "SELECT usage_id, usage_date, envelope_count, usage_notes, product "
+    "FROM AccountUsage WHERE account_number = :account_number "
+    "ORDER BY usage_date DESC")
+
+# Only the disputed transaction: another invoice of the account must never stand in for it
+SQL_TRANSACTIONS = (
+    "SELECT transaction_number, account_number, invoice_date, amount, currency_code, product "
+    "FROM Transactions WHERE account_number = :account_number "
+    "AND UPPER(transaction_number) = UPPER(:transaction_number)")
+
+SQL_DISPUTE_HISTORY = (
+    "SELECT dispute_id, transaction_number, request_type, dispute_status, outcome_details, "
+    "is_refund_in_progress, is_duplicate_payment, created_at "
+    "FROM Disputes WHERE account_number = :account_number "
+    "ORDER BY created_at DESC")
+
+SQL_DISPUTE_EXAMPLES = (
+    "SELECT request_type, customer_prompt FROM Disputes WHERE request_type IS NOT NULL")
+
+SQL_DISPUTE_PRECEDENTS = (
+    "SELECT dispute_id, account_number, transaction_number, request_type, customer_prompt, "
+    "dispute_status, outcome_details FROM Disputes "
+    "WHERE dispute_id > :after_id AND customer_prompt IS NOT NULL ORDER BY dispute_id")
+
+
+# ────────────────────────────────────────────────────────
+# 3) Connections
+# ────────────────────────────────────────────────────────
+_connection_lock = threading.Lock()
+_sqlite_connection = None
+_oracle_pool = None
+
+
+class TemplateBackendUnavailable(RuntimeError):
+    """No template backend is configured (no ORACLE_DB_DSN and no DB_TEMPLATE_BACKEND)."""
+
+
+@contextmanager
+def template_connection(backend: Optional[str] = None):
+    """Yields a DB-API connection for `backend`, by default the configured template backend."""
+    global _sqlite_connection, _oracle_pool
+    backend = backend or DB_TEMPLATE_BACKEND
+    if backend not in TEMPLATE_BACKENDS:
+        raise TemplateBackendUnavailable(
+            "No template DB backend configured: set ORACLE_DB_DSN, or DB_TEMPLATE_BACKEND=sqlite for the stand-in")
+    if backend == "oracle":
+        if _oracle_pool is None:
+            try:
+                import oracledb  # optional dependency, only needed for the direct Oracle backend
+            except ImportError:
+                raise TemplateBackendUnavailable("The Oracle template backend needs the driver: pip install oracledb")
+            # CLOBs (Disputes.customer_prompt) come back as str instead of LOB handles
+            oracledb.defaults.fetch_lobs = False
+            with _connection_lock:
+                if _oracle_pool is None:
+                    _oracle_pool = oracledb.create_pool(user=ORACLE_DB_USER, password=ORACLE_DB_PASSWORD,
+                                                        dsn=ORACLE_DB_DSN, min=1, max=4, increment=1)
+        with _oracle_pool.acquire() as conn:
+            yield conn
+    else:
+        from src.agents.sqlite_standin import build_sqlite_standin
+        with _connection_lock:
+            if _sqlite_connection is None:
+                _sqlite_connection = build_sqlite_standin(SQLITE_STANDIN_PATH)
+            # sqlite3 connections are shared between threads, so serialize access
+            yield _sqlite_connection
+
+
+def _plain(value: Any) -> Any:
+    """JSON-friendly column value: dates as ISO strings, any LOB handle that slipped through read out."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, "read"):
+        return value.read()
+    return value
+
+
+def _fetch(conn, sql: str, params: Dict[str, Any], limit: int = MAX_ROWS_PER_SECTION) -> List[Dict[str, Any]]:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        columns = [col[0].lower() for col in cursor.description]
+        return [{col: _plain(value) for col, value in zip(columns, row)} for row in cursor.fetchmany(limit)]
+    finally:
+        cursor.close()
+
+
+# ────────────────────────────────────────────────────────
+# 4) Engine
+# ────────────────────────────────────────────────────────
+def fetch_dispute_data(account_number: Optional[str], transaction_number: Optional[str],
+                       backend: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Runs the template queries for one dispute.
+    Returns None when no account can be resolved from the identifiers.
+    """
+    with template_connection(backend) as conn:
+        if not account_number and transaction_number:
+            rows = _fetch(conn, SQL_ACCOUNT_FOR_TRANSACTION, {"transaction_number": transaction_number}, 2)
+            # An ambiguous transaction number cannot be tied to a single account
+            if len(rows) == 1:
+                account_number = rows[0]["account_number"]
+        if not account_number:
+            return None
+
+        by_account = {"account_number": account_number}
+        customer = _fetch(conn, SQL_CUSTOMER, by_account, 1)
+        return {
+            "user_info": customer[0] if customer else {"account_number": account_number},
+            "account_usage": _fetch(conn, SQL_ACCOUNT_USAGE, by_account),
+            "transactions": _fetch(conn, SQL_TRANSACTIONS,
+                                   {**by_account, "transaction_number": transaction_number}),
+            "dispute_history": _fetch(conn, SQL_DISPUTE_HISTORY, by_account),
+        }
+
+
+def run_template_query(user_prompt: str, classification: str,
+                       backend: Optional[str] = None) -> Optional[DbQueryResult]:
+    """
+    Answers the DB step deterministically. Returns the typed result, or None if
+    the prompt has no usable identifiers (callers then fall back to the agentic
+    SQL path). A transaction number that is not on the account leaves the
+    result without a disputed transaction and sets `parse_error`.
+    """
+    account_number, transaction_number = extract_identifiers(user_prompt)
+    if not account_number and not transaction_number:
+        return None
+    data = fetch_dispute_data(account_number, transaction_number, backend)
+    if data is None:
+        return None
+    logging.info(f"DB template query served '{classification}' for account {data['user_info'].get('account_number')}")
+    return DbQueryResult.from_dict(data, source="template", transaction_number=transaction_number)
+
+
+def load_dispute_examples() -> List[Tuple[str, str]]:
+    """(request_type, customer_prompt) pairs from the Disputes table, for the local classifier."""
+    with template_connection() as conn:
+        return [(row["request_type"], row["customer_prompt"])
+                for row in _fetch(conn, SQL_DISPUTE_EXAMPLES, {}, limit=100000)]
+
+
+def load_dispute_precedents(after_id: int = 0, limit: int = 100000) -> List[Dict[str, Any]]:
+    """Disputes rows with an ID above `after_id`, oldest first, for the precedent index."""
+    with template_connection() as conn:
+        return _fetch(conn, SQL_DISPUTE_PRECEDENTS, {"after_id": after_id}, limit=limit)
@@ -0,0 +1,147 @@
+"""
+sqlite_standin.py
+
+Offline SQLite stand-in for the dispute database.
+
+Creates the `Customers`, `Transactions`, `AccountUsage` and `Disputes` tables
+described by `INLINE_DATABASE_SCHEMA` and loads them from the bundled
+chargeback CSVs, so the template query engine can run without OCI access.
+
+Differences from the Oracle schema:
+- Transactions are keyed by (transaction_number, account_number) because the
+  CSV reuses P-1234567890 for two different accounts.
+- Foreign keys are not enforced.
+- `Disputes.created_at` comes from an optional "Dispute Date" column and is
+  NULL without one; the bundled CSV does not record when disputes were raised.
+
+Other CSVs with the same layout (e.g. labelled disputes for validating the
+rules) can be loaded with SQLITE_STANDIN_DISPUTES_CSV / SQLITE_STANDIN_USAGE_CSV.
+
+Usage:
+    python -m src.agents.sqlite_standin standin.db   # write a database file
+"""
+
+import os
+import csv
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+DISPUTES_CSV = Path(os.getenv("SQLITE_STANDIN_DISPUTES_CSV", BASE_DIR / "Chargeback Analysis_ Dispute (1).csv"))
+USAGE_CSV = Path(os.getenv("SQLITE_STANDIN_USAGE_CSV", BASE_DIR / "Chargeback Analysis_ Dispute(Usage).csv"))
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Customers (
+        account_number TEXT PRIMARY KEY,
+        customer_segment TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS Transactions (
+        transaction_number TEXT NOT NULL,
+        account_number TEXT NOT NULL,
+        invoice_date TEXT,
+        amount REAL NOT NULL,
+        currency_code TEXT NOT NULL,
+        product TEXT,
+        PRIMARY KEY (transaction_number, account_number)
+    );
+
+    CREATE TABLE IF NOT EXISTS AccountUsage (
+        usage_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_number TEXT NOT NULL,
+        usage_date TEXT,
+        envelope_count INTEGER,
+        usage_notes TEXT,
+        product TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS Disputes (
+        dispute_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_number TEXT NOT NULL,
+        transaction_number TEXT,
+        request_type TEXT,
+        customer_prompt TEXT NOT NULL,
+        dispute_status TEXT NOT NULL,
+        outcome_details TEXT,
+        is_refund_in_progress INTEGER DEFAULT 0,
+        is_duplicate_payment INTEGER DEFAULT 0,
+        created_at TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_transactions_account ON Transactions(account_number);
+    CREATE INDEX IF NOT EXISTS idx_usage_account ON AccountUsage(account_number);
+    CREATE INDEX IF NOT EXISTS idx_disputes_account ON Disputes(account_number);
+"""
+
+
+def _read_csv(path: Path):
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        for row in csv.DictReader(f):
+            yield {k.strip(): (v or "").strip() for k, v in row.items() if k}
+
+
+def _iso_date(value: str):
+    try:
+        return datetime.strptime(value, "%m/%d/%Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+def _flag(value: str) -> int:
+    return 1 if value.lower() == "yes" else 0
+
+
+def load_standin(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Creates the schema on `conn` and loads the bundled CSV data into it."""
+    conn.executescript(SQLITE_SCHEMA)
+    with conn:
+        for row in _read_csv(DISPUTES_CSV):
+            account = row.get("Account Number")
+            if not account:
+                continue
+            transaction = row.get("Transaction Number") or None
+            conn.execute("INSERT OR IGNORE INTO Customers VALUES (?, ?)",
+                         (account, row.get("Customer Sgement")))
+            if transaction:
+                conn.execute("INSERT OR IGNORE INTO Transactions VALUES (?, ?, ?, ?, ?, ?)",
+                             (transaction, account, _iso_date(row.get("Invoice Date", "")),
+                              float(row.get("Amount") or 0), row.get("Currency"), None))
+            conn.execute(
+                "INSERT INTO Disputes (account_number, transaction_number, request_type, customer_prompt, "
+                "dispute_status, outcome_details, is_refund_in_progress, is_duplicate_payment, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (account, transaction, row.get("Request Type"), row.get("NLP Prompt"),
+                 row.get("Dispute Status"), row.get("Outcome"),
+                 _flag(row.get("Refund in progress", "")),
+                 _flag(row.get("Excess Changes/ Duplicate Payments", "")),
+                 _iso_date(row.get("Dispute Date", ""))))
+        for row in _read_csv(USAGE_CSV):
+            if not row.get("Account Number"):
+                continue
+            conn.execute(
+                "INSERT INTO AccountUsage (account_number, usage_date, envelope_count, usage_notes, product) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (row["Account Number"], None, int(row.get("eSign Envolope Usage") or 0),
+                 # The CSV spells it "No Loggged In"; the schema docs use "No Logged In"
+                 row.get("Comments", "").replace("Loggged", "Logged"), None))
+    return conn
+
+
+def build_sqlite_standin(path: str = ":memory:") -> sqlite3.Connection:
+    """Returns a connection to a freshly loaded stand-in database at `path`."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    existing = conn.execute("SELECT name FROM sqlite_master WHERE name = 'Customers'").fetchone()
+    if existing is None:
+        load_standin(conn)
+    return conn
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "standin.db"
+    connection = build_sqlite_standin(target)
+    for table in ("Customers", "Transactions", "AccountUsage", "Disputes"):
+        count = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        print(f"{table:<14}: {count} rows")
@@ -0,0 +1,321 @@
+"""
+benchmarks.py
+
+Benchmark suite for the dispute pipeline, with JSON baselines and
+regression checks.
+
+Microbenchmarks (time per call, in microseconds):
+- db_parse: `DbQueryResult.parse` on DB agent output (prose plus JSON);
+- prompt_build: `build_decision_prompt_with_report` (context compaction);
+- classifier: `LocalClassifier.predict` over the CSV prompts;
+- json_cleanup: `parse_llm_decision` on a fenced LLM answer;
+- rules: fact extraction plus rule evaluation;
+- precedent_search: top-k search of the precedent index.
+
+Macrobenchmarks (milliseconds per dispute) run against the fake agent backend
+with zero simulated latency, so they measure the orchestration code itself:
+- resolve_dispute: the full workflow, one CSV dispute after another;
+- batch: `resolve_disputes_batch` over the CSV with 4 concurrent disputes.
+Caches that would turn a repeated dispute into a free hit are switched off.
+
+Each benchmark reports the median (and min / p95) over several repeats.
+`compare` flags benchmarks whose median got slower than the baseline by more
+than the threshold, and exits with status 1 if there is any.
+
+The committed baseline is benchmarks/baseline.json. Its "meta" records the
+commit, Python version, platform and CPU count it was measured with; a
+comparison against a baseline from another machine prints a warning, since
+its timings say little about a regression.
+
+Usage:
+    python -m src.benchmarks run --output benchmarks/baseline.json
+    python -m src.benchmarks run --compare benchmarks/baseline.json --threshold 0.2
+    python -m src.benchmarks compare benchmarks/baseline.json current.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import logging
+import tempfile
+import contextlib
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+BENCHMARK_DIR = BASE_DIR / "benchmarks"
+DISPUTES_CSV = BASE_DIR / "Chargeback Analysis_ Dispute (1).csv"
+DEFAULT_THRESHOLD = 0.2   # 20% slower than the baseline is a regression
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline.json"
+# Result metadata that must match for timings to be comparable
+MACHINE_KEYS = ("python", "platform", "cpu_count")
+
+SAMPLE_PROMPT = """
+This is an unauthorized transaction for a service I never signed up for.
+I already had an account through a reseller but was charged for a duplicate one.
+Please process an immediate refund as this is a fraudulent charge.
+The reference transaction number: P-1234567890 Account Number: 5931479520
+"""
+
+
+def _median(values: List[float]) -> float:
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def time_micro(fn: Callable[[], Any], repeat: int = 5, min_seconds: float = 0.2) -> Dict[str, Any]:
+    """
+    Times `fn` like `timeit`: the loop count is calibrated so that one repeat
+    takes at least `min_seconds`. Returns microseconds per call.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= min_seconds or loops >= 1_000_000:
+            break
+        loops *= 4
+    per_call = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_call.append((time.perf_counter() - start) / loops * 1e6)
+    return {"kind": "micro", "unit": "us", "median": round(_median(per_call), 3),
+            "min": round(min(per_call), 3), "max": round(max(per_call), 3), "loops": loops, "repeat": repeat}
+
+
+def _summarize_macro(samples_ms: List[float], repeat: int) -> Dict[str, Any]:
+    from src.workflows.batch_runner import percentile
+    return {"kind": "macro", "unit": "ms", "median": round(_median(samples_ms), 3),
+            "min": round(min(samples_ms), 3), "p95": round(percentile(samples_ms, 95), 3),
+            "samples": len(samples_ms), "repeat": repeat}
+
+
+# ────────────────────────────────────────────────────────
+# Microbenchmarks
+# ────────────────────────────────────────────────────────
+def _fixtures() -> Dict[str, Any]:
+    """Inputs shared by the microbenchmarks, built from the bundled CSVs."""
+    from src.agents.agent_backends import FAKE_TERMS_AND_CONDITIONS
+    from src.agents.db_result import DbQueryResult
+    from src.agents.sql_templates import extract_identifiers, fetch_dispute_data
+    from src.workflows.batch_runner import iter_disputes
+
+    account_number, transaction_number = extract_identifiers(SAMPLE_PROMPT)
+    data = fetch_dispute_data(account_number, transaction_number, backend="sqlite")
+    db_agent_output = ("Here is the data I retrieved for the customer:\n```json\n"
+                       + json.dumps(data, indent=2, default=str) + "\n```\nLet me know if you need anything else.")
+    decision = {"dispute_status": "Accepted",
+                "reason": "The account has no usage and no logins, so the charge is treated as unauthorized.",
+                "recommended_action": "Process Refund in Oracle."}
+    return {
+        "prompts": [d["prompt"] for d in iter_disputes(DISPUTES_CSV)],
+        "db_agent_output": db_agent_output,
+        "transaction_number": transaction_number,
+        "db_result": DbQueryResult.parse(db_agent_output, transaction_number),
+        "terms": FAKE_TERMS_AND_CONDITIONS,
+        "llm_answer": "```json\n" + json.dumps(decision, indent=2) + "\n```",
+    }
+
+
+def micro_benchmarks(repeat: int = 5) -> Dict[str, Dict[str, Any]]:
+    from src.agents.db_result import DbQueryResult
+    from src.agents.local_classifier import get_local_classifier
+    from src.agents.precedent_index import get_precedent_index
+    from src.workflows.dispute_resolution_workflow import build_decision_prompt_with_report, parse_llm_decision
+    from src.workflows.rule_engine import extract_facts, get_rule_engine
+
+    fx = _fixtures()
+    classifier = get_local_classifier()
+    index = get_precedent_index()
+    engine = get_rule_engine()
+    precedents = index.search(SAMPLE_PROMPT, k=3)
+    prompts = fx["prompts"]
+    counter = [0]
+
+    def next_prompt() -> str:
+        counter[0] += 1
+        return prompts[counter[0] % len(prompts)]
+
+    cases: List[Tuple[str, Callable[[], Any]]] = [
+        ("db_parse", lambda: DbQueryResult.parse(fx["db_agent_output"], fx["transaction_number"])),
+        ("prompt_build", lambda: build_decision_prompt_with_report(
+            SAMPLE_PROMPT, "Unauthorized Charge", fx["terms"], fx["db_result"], precedents)),
+        ("classifier", lambda: classifier.predict(next_prompt())),
+        ("json_cleanup", lambda: parse_llm_decision(fx["llm_answer"])),
+        ("rules", lambda: engine.evaluate(extract_facts("Unauthorized Charge", fx["db_result"]))),
+        ("precedent_search", lambda: index.search(next_prompt(), k=3)),
+    ]
+    results = {}
+    for name, fn in cases:
+        results[name] = time_micro(fn, repeat=repeat)
+        logging.info(f"micro {name}: {results[name]['median']:.1f} us")
+    return results
+
+
+# ────────────────────────────────────────────────────────
+# Macrobenchmarks
+# ────────────────────────────────────────────────────────
+def _use_fake_agents() -> None:
+    from src.agents.agent_backends import FakeAgentBackend, FakeProfile
+    from src.agents.agent_pool import AGENT_POOL
+    AGENT_POOL.set_backend(FakeAgentBackend(FakeProfile(time_scale=0.0)))
+
+
+def macro_benchmarks(repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    from src.workflows.batch_runner import resolve_disputes_batch
+    from src.workflows.dispute_resolution_workflow import resolve_dispute, warm_up_agents
+
+    _use_fake_agents()
+    warm_up_agents()
+    prompts = _fixtures()["prompts"]
+    results = {}
+
+    # The workflow prints its human-in-the-loop check; keep it off the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        samples = []
+        for _ in range(repeat):
+            for prompt in prompts:
+                start = time.perf_counter()
+                for _step in resolve_dispute(prompt):
+                    pass
+                samples.append((time.perf_counter() - start) * 1e3)
+        results["resolve_dispute"] = _summarize_macro(samples, repeat)
+
+        samples = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(repeat):
+                stats = resolve_disputes_batch(DISPUTES_CSV, Path(tmp) / f"batch-{i}.jsonl", concurrency=4,
+                                               resume=False)
+                samples.append(stats.elapsed_seconds * 1e3 / max(1, stats.processed))
+        results["batch"] = _summarize_macro(samples, repeat)
+    for name, result in results.items():
+        logging.info(f"macro {name}: {result['median']:.2f} ms per dispute")
+    return results
+
+
+# ────────────────────────────────────────────────────────
+# Baselines
+# ────────────────────────────────────────────────────────
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(only: Optional[str] = None, repeat_micro: int = 5, repeat_macro: int = 3) -> Dict[str, Any]:
+    """Runs the suite (or only "micro" / "macro") and returns the result document."""
+    from src.workflows.load_test import disable_caches
+    # Must happen before the workflow modules are imported
+    disable_caches()
+    benchmarks = {}
+    if only in (None, "micro"):
+        benchmarks.update(micro_benchmarks(repeat_micro))
+    if only in (None, "macro"):
+        benchmarks.update(macro_benchmarks(repeat_macro))
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float = DEFAULT_THRESHOLD) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Per benchmark present in both: the median ratio current / baseline and
+    whether it is a regression (ratio > 1 + threshold). Returns (rows, any regression).
+    """
+    rows = []
+    for name, base in baseline["benchmarks"].items():
+        now = current["benchmarks"].get(name)
+        if now is None or not base["median"]:
+            continue
+        ratio = now["median"] / base["median"]
+        status = "REGRESSION" if ratio > 1 + threshold else ("faster" if ratio < 1 - threshold else "ok")
+        rows.append({"name": name, "unit": base["unit"], "baseline": base["median"], "current": now["median"],
+                     "ratio": round(ratio, 3), "status": status})
+    return rows, any(r["status"] == "REGRESSION" for r in rows)
+
+
+def machine_differences(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Machine metadata (python, platform, cpu_count) that differs between two result documents."""
+    return [f"{key}: {baseline['meta'].get(key)} -> {current['meta'].get(key)}"
+            for key in MACHINE_KEYS if baseline["meta"].get(key) != current["meta"].get(key)]
+
+
+def format_comparison(rows: List[Dict[str, Any]], threshold: float) -> str:
+    lines = [f"{'Benchmark':<20} {'Baseline':>12} {'Current':>12} {'Change':>8}  Status (threshold {threshold:.0%})",
+             "-" * 72]
+    for r in rows:
+        lines.append(f"{r['name']:<20} {r['baseline']:>9.2f} {r['unit']:<2} {r['current']:>9.2f} {r['unit']:<2} "
+                     f"{r['ratio'] - 1:>+8.1%}  {r['status']}")
+    return "\n".join(lines)
+
+
+def format_results(document: Dict[str, Any]) -> str:
+    lines = [f"{'Benchmark':<20} {'Median':>12} {'Min':>12}", "-" * 46]
+    for name, r in document["benchmarks"].items():
+        lines.append(f"{name:<20} {r['median']:>9.2f} {r['unit']:<2} {r['min']:>9.2f} {r['unit']:<2}")
+    return "\n".join(lines)
+
+
+def _load(path) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Dispute pipeline benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the suite")
+    run_parser.add_argument("--only", choices=("micro", "macro"))
+    run_parser.add_argument("--repeat-micro", type=int, default=5)
+    run_parser.add_argument("--repeat-macro", type=int, default=3)
+    run_parser.add_argument("--output", help="write the results (e.g. a new baseline) to this JSON file")
+    run_parser.add_argument("--compare", metavar="BASELINE", nargs="?", const=str(DEFAULT_BASELINE),
+                            help="compare the results with a baseline file (default: benchmarks/baseline.json)")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        document = run_suite(args.only, args.repeat_micro, args.repeat_macro)
+        print(format_results(document))
+        if args.output:
+            Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(document, f, indent=2)
+            print(f"\nResults written to {args.output}")
+        if not args.compare:
+            sys.exit(0)
+        baseline_doc, current_doc = _load(args.compare), document
+    else:
+        baseline_doc, current_doc = _load(args.baseline), _load(args.current)
+
+    comparison, regressed = compare(baseline_doc, current_doc, args.threshold)
+    differences = machine_differences(baseline_doc, current_doc)
+    if differences:
+        print(f"\nWARNING: the baseline was recorded on another machine ({'; '.join(differences)}); "
+              f"timings may not be comparable, record a new baseline here with --output")
+    print()
+    print(format_comparison(comparison, args.threshold))
+    sys.exit(1 if regressed else 0)
@@ -1,40 +1,296 @@
+"""
+human_action_handler.py
+
+Handles operator decisions (approve / reject) on disputes that required human
+approval.
+
+The Streamlit app submits decisions to an in-process `HumanActionService`
+instead of spawning a Python process per click:
+1. `submit()` appends the decision to a durable append-only JSONL log
+   (fsync'd) and puts it on an in-memory queue, then returns immediately.
+2. A background worker takes decisions off the queue, runs
+   `process_human_action` and appends a "processed" entry to the log.
+3. Decisions are idempotent per approval request: the workflow gives every
+   request for approval an `approval_id` (stored with the approval data). The
+   first decision on a request wins and later submissions for it return the
+   recorded one. A later run of the same dispute asks for approval again under
+   a new ID, so its decision is processed. Details without an `approval_id`
+   (older log entries, scripts) fall back to the dispute ID.
+4. A decision whose processing raised (e.g. the refund failed) is logged as
+   "failed" and retried: when it is submitted again, and on the next start.
+   On start the log is replayed, so decisions that were logged but not yet
+   processed (or that failed) before a restart are queued again.
+5. The decision details are taken from the dispute's checkpoint (the
+   recommendation stored when the workflow asked for approval) when there is
+   one, so approving never depends on re-running the agents. Once processed,
+   the dispute's checkpoints are marked completed and the customer's
+   resolution notice is queued in the notification outbox.
+
+The command line entry point is kept for scripts:
+    python src/human_action_handler.py <action> <details_json>
+"""
+
+import os
 import sys
 import json
+import queue
+import hashlib
 import logging
+import threading
+from dataclasses import asdict, dataclass
 from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+from dotenv import load_dotenv
 
-# Configure basic logging to print to the terminal
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - HUMAN ACTION - %(levelname)s - %(message)s'
-)
+BASE_DIR = Path(__file__).resolve().parent.parent
+load_dotenv(BASE_DIR / "config/.env")
 
-def process_human_action(action, details_json):
+HUMAN_ACTION_LOG_PATH = os.getenv("HUMAN_ACTION_LOG_PATH", str(BASE_DIR / ".cache" / "human_actions.jsonl"))
+HUMAN_ACTIONS = ("approve", "reject")
+
+
+def process_human_action(action, details_json: Union[str, Dict[str, Any]]):
     """
     Processes the human action and logs it.
     In a real application, this could trigger other workflows,
     update a database, or call an external API.
+    Errors (including a failed refund) are raised to the caller, so the
+    service records the decision as failed and retries it.
     """
-    try:
-        details = json.loads(details_json)
-        logging.info(f"Decision: {action.upper()}")
-        logging.info(f"Original Reason: {details.get('reason')}")
-        logging.info(f"Dispute Amount: {details.get('dispute_amount')}")
-        
-        # This is where you would add logic to interact with other systems.
-        # For now, we just confirm it was processed.
-        print(f"Action '{action}' processed successfully.")
-
-    except json.JSONDecodeError:
-        logging.error("Failed to parse details JSON.")
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
+    details = json.loads(details_json) if isinstance(details_json, str) else details_json
+    logging.info(f"Decision: {action.upper()}")
+    logging.info(f"Original Reason: {details.get('reason')}")
+    logging.info(f"Dispute Amount: {details.get('dispute_amount')}")
+
+    # An approved refund is issued at most once per account/transaction, so retries are safe
+    if action == "approve" and details.get("account_number") and details.get("transaction_number"):
+        from src.workflows.refund_pipeline import PARTY_FIELDS, REFUND_EXECUTION_ENABLED, RefundRequest, execute_refund
+        if REFUND_EXECUTION_ENABLED and details.get("dispute_amount") is not None:
+            refund = execute_refund(RefundRequest(
+                account_number=str(details["account_number"]),
+                transaction_number=str(details["transaction_number"]),
+                amount=abs(float(details["dispute_amount"])),
+                currency_code=details.get("currency_code") or "USD",
+                reason=details.get("reason") or "",
+                **{name: details.get(name) for name in PARTY_FIELDS}))
+            logging.info(f"Refund: {refund}")
+
+    # This is where you would add logic to interact with other systems.
+    # For now, we just confirm it was processed.
+    print(f"Action '{action}' processed successfully.")
+
+
+def dispute_id_for(prompt: str) -> str:
+    """
+    Stable dispute ID for a prompt: "<account>:<TRANSACTION>" when the prompt
+    names both (transaction numbers match case-insensitively, so the ID is
+    upper-cased), otherwise a hash of the normalized prompt text (an account
+    alone would merge every dispute on that account).
+    """
+    from src.agents.sql_templates import extract_identifiers
+    account_number, transaction_number = extract_identifiers(prompt)
+    if account_number and transaction_number:
+        return f"{account_number}:{transaction_number.upper()}"
+    normalized = " ".join(prompt.lower().split())
+    return "prompt-" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class HumanDecision:
+    dispute_id: str
+    action: str
+    details: Dict[str, Any]
+    decided_at: str
+    status: str = "queued"          # "queued" -> "processed" | "failed"
+    duplicate: bool = False         # True when returned for a repeated submission
+    error: Optional[str] = None
+    request_id: Optional[str] = None    # approval request the decision answers
+
+    @property
+    def key(self) -> str:
+        """Idempotency key: the approval request, or the dispute for details without one."""
+        return self.request_id or self.dispute_id
+
+
+class HumanActionService:
+    """In-process queue + background worker for operator decisions."""
+
+    def __init__(self, log_path=HUMAN_ACTION_LOG_PATH,
+                 handler: Callable[[str, Dict[str, Any]], Any] = process_human_action):
+        self.log_path = Path(log_path)
+        self.handler = handler
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._decisions: Dict[str, HumanDecision] = {}
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._replay_log()
+
+    # ---- durable log --------------------------------------------------------
+    def _append_log(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, default=str)
+        with self._log_lock:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _replay_log(self) -> None:
+        """Rebuilds decision state from the log and re-queues unprocessed decisions."""
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # line truncated by a crash
+                    key = entry.get("request_id") or entry["dispute_id"]
+                    if entry["event"] == "decided" and key not in self._decisions:
+                        self._decisions[key] = HumanDecision(
+                            entry["dispute_id"], entry["action"], entry["details"], entry["decided_at"],
+                            request_id=entry.get("request_id"))
+                    elif entry["event"] in ("processed", "failed") and key in self._decisions:
+                        self._decisions[key].status = entry["event"]
+                        self._decisions[key].error = entry.get("error")
+        except FileNotFoundError:
+            return
+        # Terminate a truncated last line so the next entry starts on its own line
+        with open(self.log_path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        pending = [key for key, d in self._decisions.items() if d.status in ("queued", "failed")]
+        for key in pending:
+            self._decisions[key].status = "queued"
+            self._queue.put(key)
+        if pending:
+            logging.info(f"Human actions: re-queued {len(pending)} unprocessed or failed decision(s) from {self.log_path}")
+
+    # ---- worker -------------------------------------------------------------
+    def start(self) -> "HumanActionService":
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="human-action-worker", daemon=True)
+                self._worker.start()
+        return self
+
+    def _run(self) -> None:
+        while True:
+            key = self._queue.get()
+            if key is None:
+                self._queue.task_done()
+                return
+            decision = self._decisions[key]
+            dispute_id = decision.dispute_id
+            try:
+                self.handler(decision.action, decision.details)
+                decision.status = "processed"
+                # The customer learns the outcome through the outbox; queueing never blocks or fails the decision
+                from src.agents.notification_outbox import notify_resolution
+                notify_resolution(dispute_id, decision.details.get("customer_email"), {
+                    "dispute_status": "Accepted" if decision.action == "approve" else "Rejected",
+                    "reason": decision.details.get("reason"),
+                    "recommended_action": decision.details.get("recommended_action")})
+                from src.workflows.checkpoint_store import get_checkpoint_store
+                store = get_checkpoint_store()
+                if store is not None:
+                    store.complete(dispute_id)
+                self._append_log({"event": "processed", "dispute_id": dispute_id, "request_id": decision.request_id,
+                                  "at": datetime.now().isoformat()})
+            except Exception as e:
+                logging.error(f"Human action for dispute {dispute_id} failed: {e}")
+                decision.status, decision.error = "failed", str(e)
+                self._append_log({"event": "failed", "dispute_id": dispute_id, "request_id": decision.request_id,
+                                  "error": str(e), "at": datetime.now().isoformat()})
+            finally:
+                self._queue.task_done()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Finishes queued decisions, then stops the worker."""
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join(timeout)
+
+    # ---- public API ---------------------------------------------------------
+    def submit(self, action: str, details: Optional[Dict[str, Any]], dispute_id: str) -> HumanDecision:
+        """
+        Records and queues an operator decision. Returns as soon as the decision
+        is durably logged; a repeated submission for the same approval request
+        returns the original decision with `duplicate=True` and is not processed
+        again, unless the original failed, in which case it is retried.
+        The checkpointed approval data of the dispute takes precedence over `details`.
+        """
+        if action not in HUMAN_ACTIONS:
+            raise ValueError(f"Unknown human action '{action}', expected one of {HUMAN_ACTIONS}")
+        from src.workflows.checkpoint_store import get_checkpoint_store
+        store = get_checkpoint_store()
+        stored = store.approval_data(dispute_id) if store is not None else None
+        details = stored or details
+        if details is None:
+            raise ValueError(f"No decision details for dispute {dispute_id}")
+        request_id = details.get("approval_id")
+        with self._lock:
+            existing = self._decisions.get(request_id or dispute_id)
+            if existing is None:
+                result = HumanDecision(dispute_id, action, details, datetime.now().isoformat(), request_id=request_id)
+                self._append_log({"event": "decided", **asdict(result)})
+                self._decisions[result.key] = result
+            else:
+                retry = existing.status == "failed"
+                if retry:
+                    existing.status, existing.error = "queued", None
+                result = HumanDecision(**{**asdict(existing), "duplicate": True})
+                if not retry:
+                    return result
+        self.start()
+        self._queue.put(result.key)
+        return result
+
+    def get(self, key: str) -> Optional[HumanDecision]:
+        """Decision for an approval request ID (or a dispute ID, for details without one)."""
+        return self._decisions.get(key)
+
+    def pending(self) -> int:
+        """Number of decisions waiting for the worker."""
+        return self._queue.unfinished_tasks
+
+    def join(self) -> None:
+        """Blocks until every queued decision has been handled."""
+        self._queue.join()
+
+
+_service: Optional[HumanActionService] = None
+_service_lock = threading.Lock()
+
+
+def get_human_action_service() -> HumanActionService:
+    """Process-wide service with its worker started."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = HumanActionService()
+    return _service.start()
+
 
 if __name__ == "__main__":
+    # Configure basic logging to print to the terminal
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - HUMAN ACTION - %(levelname)s - %(message)s'
+    )
     if len(sys.argv) > 2:
         action_arg = sys.argv[1]
         details_arg = sys.argv[2]
-        process_human_action(action_arg, details_arg)
+        try:
+            process_human_action(action_arg, details_arg)
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+            sys.exit(1)
     else:
         logging.error("Insufficient arguments. Usage: python human_action_handler.py <action> <details_json>")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,255 @@
+"""
+instrumentation.py
+
+Per-step latency and size instrumentation for the dispute workflow.
+
+Every agent call records wall time, queue wait (time spent waiting for a
+worker thread), setup time (leasing/building the pooled agent) versus run
+time, prompt and response sizes and retry counts. Calls are attributed to the
+workflow step that made them through a context variable, so the numbers
+follow the call across asyncio tasks and `asyncio.to_thread` workers.
+
+Each yielded workflow step carries its metrics under the "metrics" key, and a
+record per dispute is exported to every registered sink:
+- JsonlMetricsSink: appends one JSON line per dispute (METRICS_JSONL_PATH).
+- PrometheusMetricsSink: in-process aggregates rendered in the Prometheus text
+  format, optionally served over HTTP on METRICS_PROMETHEUS_PORT at /metrics.
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH")
+METRICS_PROMETHEUS_PORT = os.getenv("METRICS_PROMETHEUS_PORT")
+
+
+@dataclass
+class AgentCallMetrics:
+    agent: str
+    wall_seconds: float = 0.0
+    queue_wait_seconds: float = 0.0
+    setup_seconds: float = 0.0
+    run_seconds: float = 0.0
+    prompt_chars: int = 0
+    response_chars: int = 0
+    retries: int = 0
+    error: Optional[str] = None
+    streamed: bool = False
+    first_chunk_seconds: float = 0.0   # time to the first partial answer (0 when nobody listened)
+
+
+@dataclass
+class StepMetrics:
+    step: str
+    wall_seconds: float = 0.0
+    queue_wait_seconds: float = 0.0
+    agent_calls: List[AgentCallMetrics] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+_current_step: ContextVar[Optional[StepMetrics]] = ContextVar("current_step_metrics", default=None)
+
+
+def start_step(step: str) -> StepMetrics:
+    """Makes `step` the target for agent calls made from the current context (task/thread)."""
+    metrics = StepMetrics(step=step)
+    _current_step.set(metrics)
+    return metrics
+
+
+def record_agent_call(call: AgentCallMetrics) -> None:
+    """Attributes an agent call to the current step (no-op outside a workflow step)."""
+    metrics = _current_step.get()
+    if metrics is not None:
+        metrics.agent_calls.append(call)
+
+
+# ────────────────────────────────────────────────────────
+# Sinks
+# ────────────────────────────────────────────────────────
+class MetricsSink(ABC):
+    """Receives one record per resolved dispute."""
+
+    @abstractmethod
+    def emit(self, record: Dict[str, Any]) -> None:
+        ...
+
+
+class JsonlMetricsSink(MetricsSink):
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metric families rendered by PrometheusMetricsSink: name -> (type, help).
+# Summaries are exported as <name>_sum / <name>_count with the same labels.
+PROMETHEUS_METRICS = {
+    "dispute_workflow_seconds": ("summary", "Wall time of a dispute workflow run."),
+    "dispute_decisions_total": ("counter", "Disputes decided, by who decided them."),
+    "decision_prompt_tokens_total": ("counter", "Estimated tokens of the decision prompts sent to the LLM."),
+    "decision_prompt_tokens_before_compaction_total": ("counter", "Estimated tokens of the decision prompts before compaction."),
+    "dispute_step_seconds": ("summary", "Wall time of a workflow step."),
+    "dispute_step_queue_wait_seconds": ("summary", "Time a workflow step waited for a worker thread."),
+    "agent_call_seconds": ("summary", "Time of an agent call, split into queue wait, setup and run phases."),
+    "agent_prompt_chars_total": ("counter", "Characters of the prompts sent to an agent."),
+    "agent_response_chars_total": ("counter", "Characters of the answers returned by an agent."),
+    "agent_retries_total": ("counter", "Retried agent runs."),
+    "agent_first_chunk_seconds": ("summary", "Time until a streamed agent answer produced its first text."),
+    "agent_errors_total": ("counter", "Agent calls that failed."),
+}
+
+
+def _metric_family(name: str) -> str:
+    for suffix in ("_sum", "_count"):
+        if name.endswith(suffix) and name[:-len(suffix)] in PROMETHEUS_METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+class PrometheusMetricsSink(MetricsSink):
+    """Aggregates dispute records into counters/summaries and renders them as Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = defaultdict(float)
+
+    def _add(self, name: str, labels: Dict[str, str], value: float) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._values[key] += value
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._add("dispute_workflow_seconds_sum", {}, record.get("wall_seconds", 0.0))
+            self._add("dispute_workflow_seconds_count", {}, 1)
+            if record.get("decided_by"):
+                self._add("dispute_decisions_total", {"decided_by": record["decided_by"]}, 1)
+            if record.get("decision_prompt_tokens"):
+                self._add("decision_prompt_tokens_total", {}, record["decision_prompt_tokens"])
+                self._add("decision_prompt_tokens_before_compaction_total", {}, record["decision_prompt_tokens_before"])
+            for step in record.get("steps", []):
+                labels = {"step": step["step"]}
+                self._add("dispute_step_seconds_sum", labels, step["wall_seconds"])
+                self._add("dispute_step_seconds_count", labels, 1)
+                self._add("dispute_step_queue_wait_seconds_sum", labels, step["queue_wait_seconds"])
+                self._add("dispute_step_queue_wait_seconds_count", labels, 1)
+                for call in step["agent_calls"]:
+                    agent = {"agent": call["agent"]}
+                    for phase in ("queue_wait", "setup", "run"):
+                        self._add("agent_call_seconds_sum", {**agent, "phase": phase}, call[f"{phase}_seconds"])
+                        self._add("agent_call_seconds_count", {**agent, "phase": phase}, 1)
+                    self._add("agent_prompt_chars_total", agent, call["prompt_chars"])
+                    self._add("agent_response_chars_total", agent, call["response_chars"])
+                    self._add("agent_retries_total", agent, call["retries"])
+                    if call.get("first_chunk_seconds"):
+                        self._add("agent_first_chunk_seconds_sum", agent, call["first_chunk_seconds"])
+                        self._add("agent_first_chunk_seconds_count", agent, 1)
+                    if call.get("error"):
+                        self._add("agent_errors_total", agent, 1)
+
+    def render(self) -> str:
+        """Prometheus text format: each family's samples follow its # HELP and # TYPE lines."""
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: (_metric_family(item[0][0]), item[0]))
+        lines = []
+        family = None
+        for (name, labels), value in items:
+            if _metric_family(name) != family:
+                family = _metric_family(name)
+                metric_type, help_text = PROMETHEUS_METRICS.get(family, ("untyped", family))
+                lines += [f"# HELP {family} {help_text}", f"# TYPE {family} {metric_type}"]
+            label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{name}{{{label_str}}} {value:g}" if label_str else f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Serves `render()` at http://host:port/metrics from a daemon thread."""
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+        return server
+
+
+_sinks: List[MetricsSink] = []
+_sinks_lock = threading.Lock()
+
+
+def register_sink(sink: MetricsSink) -> MetricsSink:
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+
+def emit_dispute_metrics(record: Dict[str, Any]) -> None:
+    """Sends a per-dispute record to every sink; sink failures never fail the dispute."""
+    record.setdefault("timestamp", time.time())
+    for sink in list(_sinks):
+        try:
+            sink.emit(record)
+        except Exception as e:
+            logging.warning(f"Metrics sink {type(sink).__name__} failed: {e}")
+
+
+# Shared in-process Prometheus aggregate (always on, cheap)
+PROMETHEUS_SINK = register_sink(PrometheusMetricsSink())
+if METRICS_JSONL_PATH:
+    register_sink(JsonlMetricsSink(METRICS_JSONL_PATH))
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """Starts the /metrics endpoint once per process (port from METRICS_PROMETHEUS_PORT by default)."""
+    global _metrics_server
+    port = port or (int(METRICS_PROMETHEUS_PORT) if METRICS_PROMETHEUS_PORT else None)
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = PROMETHEUS_SINK.serve(port)
+    return _metrics_server
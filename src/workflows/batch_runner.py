@@ -0,0 +1,215 @@
+"""
+batch_runner.py
+
+Batch dispute processing over CSV or JSONL input.
+
+Disputes are streamed from the input file, resolved with bounded concurrency
+and written to a JSONL results file one line per dispute as soon as each one
+finishes. Re-running the same command after a crash skips disputes that
+already have a successful result line.
+
+Input formats:
+- CSV in the `Chargeback Analysis_ Dispute (1).csv` layout (the `NLP Prompt`
+  column is the dispute text, rows without a prompt are skipped).
+- JSONL with a `prompt` (or `customer_prompt` / `NLP Prompt`) field and an
+  optional `dispute_id`.
+
+Usage:
+    python -m src.workflows.batch_runner "Chargeback Analysis_ Dispute (1).csv" results.jsonl --concurrency 4
+"""
+
+import os
+import csv
+import json
+import math
+import time
+import argparse
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Set
+
+from src.agents.db_result import json_default
+from src.workflows.dispute_resolution_workflow import resolve_dispute
+
+PROMPT_FIELDS = ("prompt", "customer_prompt", "NLP Prompt")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `values` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct * len(ordered) / 100.0) - 1))
+    return ordered[rank]
+
+
+# ────────────────────────────────────────────────────────
+# 1) Input
+# ────────────────────────────────────────────────────────
+def iter_disputes(input_path) -> Iterator[Dict[str, str]]:
+    """Yields {"dispute_id", "prompt"} records from a CSV or JSONL file, lazily."""
+    input_path = Path(input_path)
+    if input_path.suffix.lower() in (".jsonl", ".ndjson", ".json"):
+        with open(input_path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                prompt = next((record[k] for k in PROMPT_FIELDS if record.get(k)), None)
+                if prompt:
+                    yield {"dispute_id": str(record.get("dispute_id", f"line-{line_no}")), "prompt": prompt}
+    else:
+        with open(input_path, newline="", encoding="utf-8", errors="replace") as f:
+            # Header is line 1, so data rows start at line 2
+            for row_no, row in enumerate(csv.DictReader(f), start=2):
+                prompt = (row.get("NLP Prompt") or "").strip()
+                if prompt:
+                    yield {"dispute_id": str(row.get("Dispute ID") or f"row-{row_no}"), "prompt": prompt}
+
+
+def completed_dispute_ids(output_path) -> Set[str]:
+    """IDs that already have a successful result line (truncated lines are ignored)."""
+    done = set()
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("status") == "ok":
+                    done.add(record["dispute_id"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+# ────────────────────────────────────────────────────────
+# 2) Execution
+# ────────────────────────────────────────────────────────
+@dataclass
+class BatchStats:
+    processed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed_seconds: float = 0.0
+    total_latencies: List[float] = field(default_factory=list)
+    step_latencies: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+
+    @property
+    def disputes_per_minute(self) -> float:
+        return 60.0 * self.processed / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def summary(self) -> str:
+        lines = [
+            "=" * 70,
+            "Batch Summary",
+            "=" * 70,
+            f"- Processed: {self.processed}  Failed: {self.failed}  Skipped (resumed): {self.skipped}",
+            f"- Elapsed: {self.elapsed_seconds:.2f}s  Throughput: {self.disputes_per_minute:.1f} disputes/minute",
+            "-" * 70,
+            f"  {'Step':<35} {'p50':>9} {'p95':>9} {'p99':>9}",
+        ]
+        rows = list(self.step_latencies.items()) + [("Total per dispute", self.total_latencies)]
+        for name, values in rows:
+            lines.append(f"  {name:<35} {percentile(values, 50):>8.2f}s {percentile(values, 95):>8.2f}s "
+                         f"{percentile(values, 99):>8.2f}s")
+        lines.append("=" * 70)
+        return "\n".join(lines)
+
+
+def _resolve_one(dispute: Dict[str, str], approval_threshold: float) -> dict:
+    """Runs the full workflow for one dispute and returns its result record."""
+    record = {"dispute_id": dispute["dispute_id"], "prompt": dispute["prompt"], "steps": {}, "step_latencies": {}}
+    start = time.perf_counter()
+    try:
+        for step in resolve_dispute(dispute["prompt"], approval_threshold):
+            record["steps"][step["step_name"]] = step["data"]
+            record["step_latencies"][step["step_name"]] = round(step["metrics"]["wall_seconds"], 4)
+            if step["is_final"] or step["step_name"] == "Human Approval Required":
+                record["final_step"] = step["step_name"]
+                record["decision"] = step["data"]
+        record["status"] = "ok"
+    except Exception as e:
+        logging.exception(f"Dispute {dispute['dispute_id']} failed")
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["latency_seconds"] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def _open_for_append(output_path: Path):
+    """Opens the results file for appending, repairing a line truncated by a crash."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(output_path, "a+", encoding="utf-8")
+    if f.tell() > 0:
+        f.seek(f.tell() - 1)
+        if f.read(1) != "\n":
+            f.write("\n")
+    return f
+
+
+def resolve_disputes_batch(input_path, output_path, concurrency: int = 4,
+                           approval_threshold: float = 500.0, resume: bool = True) -> BatchStats:
+    """
+    Resolves every dispute in `input_path`, appending one JSON result line per
+    dispute to `output_path`. At most `concurrency` disputes run at once and the
+    input is read lazily, so arbitrarily large files are fine.
+    """
+    output_path = Path(output_path)
+    if not resume and output_path.exists():
+        output_path.unlink()
+    done = completed_dispute_ids(output_path) if resume else set()
+    stats = BatchStats()
+    write_lock = threading.Lock()
+    start = time.perf_counter()
+
+    with _open_for_append(output_path) as out, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def record_result(future):
+            record = future.result()
+            with write_lock:
+                out.write(json.dumps(record, default=json_default) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                if record["status"] == "ok":
+                    stats.processed += 1
+                    stats.total_latencies.append(record["latency_seconds"])
+                    for name, seconds in record["step_latencies"].items():
+                        stats.step_latencies[name].append(seconds)
+                else:
+                    stats.failed += 1
+
+        in_flight = set()
+        for dispute in iter_disputes(input_path):
+            if dispute["dispute_id"] in done:
+                stats.skipped += 1
+                continue
+            if len(in_flight) >= concurrency:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record_result(future)
+            in_flight.add(executor.submit(_resolve_one, dispute, approval_threshold))
+        for future in wait(in_flight).done:
+            record_result(future)
+
+    stats.elapsed_seconds = time.perf_counter() - start
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Resolve disputes in batch from a CSV or JSONL file.")
+    parser.add_argument("input", help="CSV (chargeback layout) or JSONL file of disputes")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--approval-threshold", type=float, default=500.0)
+    parser.add_argument("--no-resume", action="store_true", help="start over instead of skipping finished disputes")
+    args = parser.parse_args()
+
+    batch_stats = resolve_disputes_batch(args.input, args.output, concurrency=args.concurrency,
+                                         approval_threshold=args.approval_threshold, resume=not args.no_resume)
+    print(batch_stats.summary())
@@ -0,0 +1,224 @@
+"""
+checkpoint_store.py
+
+Per-dispute checkpoints of the workflow's agent steps, so that an interrupted
+dispute resumes instead of starting over.
+
+Each completed step (classification, DB data, terms and conditions, decision)
+is saved under the dispute ID (`dispute_id_for`: "<account>:<transaction>" or
+a prompt hash) in a SQLite store shared by all threads and processes on the
+host. When the workflow runs a dispute again, steps with a checkpoint return
+the stored value and only the missing steps call their agents. That covers:
+- a failed step (e.g. the LLM call timed out after the DB and RAG steps);
+- a Streamlit rerun or a retried job on the job queue.
+
+Checkpoints are only reused while the dispute is unfinished:
+- "in_progress": at least one step is saved;
+- "awaiting_approval": the decision needs a human. The approval data is saved
+  as well, and the human action handler uses it.
+Once the dispute has a final outcome it is "completed", and a later run starts
+fresh (repeats are served by the decision cache instead). A different prompt
+for the same dispute ID, or checkpoints older than CHECKPOINT_TTL_SECONDS, are
+not reused either. Failed DB steps and unparseable decisions are never saved.
+
+Usage:
+    python -m src.workflows.checkpoint_store                 # unfinished disputes
+    python -m src.workflows.checkpoint_store --clear <dispute_id>
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.agents.db_result import DbQueryResult, json_default
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS_ENABLED", "true").lower() == "true"
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", str(BASE_DIR / ".cache" / "dispute_checkpoints.db"))
+# Unfinished disputes older than this start over (their DB rows may have changed)
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", "86400"))
+
+CHECKPOINT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS disputes (
+        dispute_id TEXT PRIMARY KEY,
+        prompt_hash TEXT NOT NULL,
+        status TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        dispute_id TEXT NOT NULL,
+        step TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        saved_at REAL NOT NULL,
+        PRIMARY KEY (dispute_id, step)
+    );
+"""
+
+STATUS_IN_PROGRESS, STATUS_AWAITING_APPROVAL, STATUS_COMPLETED = "in_progress", "awaiting_approval", "completed"
+RESUMABLE_STATUSES = (STATUS_IN_PROGRESS, STATUS_AWAITING_APPROVAL)
+
+# Workflow steps that are checkpointed, plus the data shown to the approver
+CHECKPOINT_STEPS = ("classification", "db", "rag", "decision")
+APPROVAL_STEP = "approval"
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(" ".join(prompt.split()).encode("utf-8")).hexdigest()
+
+
+def encode_step(step: str, value: Any) -> str:
+    if step == "db":
+        value = value.to_dict(include_raw=True)
+    elif step == "rag":
+        value = list(value)
+    return json.dumps(value, default=json_default)
+
+
+def decode_step(step: str, payload: str) -> Any:
+    value = json.loads(payload)
+    if step == "db":
+        db_result = DbQueryResult.from_dict(value, source=value.get("source", "template"), raw_text=value.get("raw_text"),
+                                            transaction_number=value.get("transaction_number"))
+        db_result.parse_error = value.get("parse_error")
+        return db_result
+    if step == "rag":
+        text, source = value
+        if isinstance(source, bool):   # written before steps reported their source
+            source = "cache" if source else "agent"
+        return text, source
+    return value
+
+
+def is_checkpointable(step: str, value: Any) -> bool:
+    """Failed DB results and unparseable decisions are recomputed on the next run."""
+    if step == "db":
+        return value.ok
+    if step == "decision":
+        return isinstance(value, dict) and "raw_response" not in value
+    return True
+
+
+class CheckpointStore:
+    """SQLite store of step outputs per dispute; safe to share between threads and processes on one host."""
+
+    def __init__(self, path=CHECKPOINT_DB_PATH, ttl_seconds: float = CHECKPOINT_TTL_SECONDS):
+        self.path = str(path)
+        self.ttl_seconds = ttl_seconds
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(CHECKPOINT_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation keeps this usable from any thread or process
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def resume(self, dispute_id: str, prompt: str) -> Dict[str, Any]:
+        """
+        Saved step values of an unfinished run of this dispute and prompt.
+        Anything else (finished, expired, other prompt) is discarded, and an
+        empty dict is returned.
+        """
+        digest = prompt_hash(prompt)
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM disputes WHERE dispute_id = ?", (dispute_id,)).fetchone()
+            if row is None:
+                return {}
+            if (row["status"] not in RESUMABLE_STATUSES or row["prompt_hash"] != digest
+                    or time.time() - row["updated_at"] > self.ttl_seconds):
+                conn.execute("DELETE FROM checkpoints WHERE dispute_id = ?", (dispute_id,))
+                conn.execute("DELETE FROM disputes WHERE dispute_id = ?", (dispute_id,))
+                return {}
+            rows = conn.execute("SELECT step, payload FROM checkpoints WHERE dispute_id = ?", (dispute_id,)).fetchall()
+        steps = {}
+        for r in rows:
+            if r["step"] in CHECKPOINT_STEPS:
+                try:
+                    steps[r["step"]] = decode_step(r["step"], r["payload"])
+                except (ValueError, KeyError, TypeError) as e:
+                    logging.warning(f"Ignoring unreadable checkpoint {dispute_id}/{r['step']}: {e}")
+        return steps
+
+    def save(self, dispute_id: str, prompt: str, step: str, value: Any,
+             status: str = STATUS_IN_PROGRESS) -> None:
+        now = time.time()
+        payload = json.dumps(value, default=json_default) if step == APPROVAL_STEP else encode_step(step, value)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO disputes (dispute_id, prompt_hash, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (dispute_id) DO UPDATE SET prompt_hash = excluded.prompt_hash, status = excluded.status, "
+                "updated_at = excluded.updated_at",
+                (dispute_id, prompt_hash(prompt), status, now, now))
+            conn.execute("INSERT OR REPLACE INTO checkpoints (dispute_id, step, payload, saved_at) VALUES (?, ?, ?, ?)",
+                         (dispute_id, step, payload, now))
+            conn.execute("COMMIT")
+
+    def approval_data(self, dispute_id: str) -> Optional[Dict[str, Any]]:
+        """The decision shown to the approver of a dispute awaiting approval, if any."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT c.payload FROM checkpoints c JOIN disputes d ON d.dispute_id = c.dispute_id "
+                "WHERE c.dispute_id = ? AND c.step = ? AND d.status = ?",
+                (dispute_id, APPROVAL_STEP, STATUS_AWAITING_APPROVAL)).fetchone()
+        return json.loads(row["payload"]) if row else None
+
+    def complete(self, dispute_id: str) -> None:
+        """Marks a dispute as finished; its checkpoints are no longer resumed."""
+        with self._connect() as conn:
+            conn.execute("UPDATE disputes SET status = ?, updated_at = ? WHERE dispute_id = ?",
+                         (STATUS_COMPLETED, time.time(), dispute_id))
+
+    def clear(self, dispute_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE dispute_id = ?", (dispute_id,))
+            conn.execute("DELETE FROM disputes WHERE dispute_id = ?", (dispute_id,))
+
+    def unfinished(self) -> List[Tuple[str, str, float, List[str]]]:
+        """(dispute_id, status, updated_at, saved steps) of every unfinished dispute."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT d.dispute_id, d.status, d.updated_at, GROUP_CONCAT(c.step) AS steps FROM disputes d "
+                "LEFT JOIN checkpoints c ON c.dispute_id = d.dispute_id WHERE d.status != ? "
+                "GROUP BY d.dispute_id ORDER BY d.updated_at DESC", (STATUS_COMPLETED,)).fetchall()
+        return [(r["dispute_id"], r["status"], r["updated_at"], (r["steps"] or "").split(",")) for r in rows]
+
+
+_STORE: Optional[CheckpointStore] = None
+
+
+def get_checkpoint_store() -> Optional[CheckpointStore]:
+    """The shared store, or None when checkpoints are disabled."""
+    global _STORE
+    if not CHECKPOINTS_ENABLED:
+        return None
+    if _STORE is None:
+        _STORE = CheckpointStore()
+    return _STORE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-dispute workflow checkpoints")
+    parser.add_argument("--clear", metavar="DISPUTE_ID", help="drop the checkpoints of one dispute")
+    args = parser.parse_args()
+
+    store = CheckpointStore()
+    if args.clear:
+        store.clear(args.clear)
+        print(f"Cleared checkpoints of {args.clear}")
+    for dispute_id, status, updated_at, steps in store.unfinished():
+        print(f"{dispute_id:<30} {status:<18} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(updated_at))}  "
+              f"steps: {', '.join(s for s in steps if s)}")
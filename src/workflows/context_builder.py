@@ -0,0 +1,220 @@
+"""
+context_builder.py
+
+Builds the context JSON for the LLM decision prompt within a token budget.
+
+Compared with dumping the whole context with `json.dumps(..., indent=2)`:
+1. JSON is minified (no indentation, compact separators).
+2. The terms-and-conditions text is split into clauses. Only the clauses that
+   match the dispute's classification (the local classifier's category
+   keywords plus general refund terms) are kept, in their original order.
+3. Every section has its own token budget, checked with a fast local token
+   estimate. Over-budget sections are trimmed from their least useful end:
+   - T&C: the lowest scoring clauses are dropped;
+   - customer data: the oldest usage / dispute history rows are dropped, and
+     the disputed transaction always stays;
+   - precedents: the least similar ones are dropped;
+   - the dispute text: it is truncated.
+4. A `PromptSizeReport` compares the legacy prompt with the compact one, per
+   section, in characters and estimated tokens.
+
+Budgets are set with CONTEXT_BUDGET_* (estimated tokens, 0 = unlimited).
+"""
+
+import os
+import re
+import json
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+CONTEXT_COMPACTION_ENABLED = os.getenv("CONTEXT_COMPACTION_ENABLED", "true").lower() == "true"
+SECTION_BUDGETS = {
+    "user_dispute": int(os.getenv("CONTEXT_BUDGET_DISPUTE", "400")),
+    "terms_and_conditions": int(os.getenv("CONTEXT_BUDGET_TERMS", "600")),
+    "customer_data": int(os.getenv("CONTEXT_BUDGET_CUSTOMER_DATA", "800")),
+    "similar_past_disputes": int(os.getenv("CONTEXT_BUDGET_PRECEDENTS", "300")),
+}
+
+# Clauses about these topics are relevant to every dispute
+GENERAL_TERMS = "refund cancel cancellation dispute charge billing period days window policy"
+
+# Words, punctuation marks and whitespace runs that contain a line break or indentation
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]|\s*\n\s*| {2,}")
+_CLAUSE_SPLIT_RE = re.compile(r"\n\s*\n|\n(?=\s*(?:[-*•]|\d+[.)]|[A-Za-z][.)])\s)")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9])")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast token estimate without a tokenizer: words, punctuation marks and
+    line breaks / indentation each count as one token, long words as one per
+    ~7 characters.
+    """
+    return sum(1 + len(piece) // 7 for piece in _TOKEN_RE.findall(text))
+
+
+def minify(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+# ────────────────────────────────────────────────────────
+# Terms and conditions
+# ────────────────────────────────────────────────────────
+def split_clauses(text: str) -> List[str]:
+    """Paragraphs and list items; a single long paragraph is split into sentences."""
+    clauses = [c.strip() for c in _CLAUSE_SPLIT_RE.split(text or "") if c and c.strip()]
+    if len(clauses) <= 1:
+        clauses = [c.strip() for c in _SENTENCE_SPLIT_RE.split(text or "") if c.strip()]
+    return clauses
+
+
+def select_clauses(text: str, classification: str, budget: int) -> str:
+    """Clauses most relevant to `classification` that fit `budget` tokens, in document order."""
+    from src.agents.local_classifier import CATEGORY_KEYWORDS, tokenize
+    clauses = split_clauses(text)
+    if not clauses:
+        return ""
+    topic = set(tokenize(f"{classification} {CATEGORY_KEYWORDS.get(classification, '')}"))
+    general = set(tokenize(GENERAL_TERMS))
+    scored = []
+    for position, clause in enumerate(clauses):
+        words = set(tokenize(clause))
+        # Category matches count double; ties keep the earlier clause
+        score = 2 * len(words & topic) + len(words & general)
+        scored.append((score, -position, clause))
+
+    kept, used = [], 0
+    for score, neg_position, clause in sorted(scored, reverse=True):
+        if score == 0 and kept:
+            break
+        cost = estimate_tokens(clause)
+        if budget and used + cost > budget:
+            continue
+        kept.append((-neg_position, clause))
+        used += cost
+    if not kept:
+        # Not even one clause fits: keep the best one, truncated to the budget
+        return truncate_to_budget(sorted(scored, reverse=True)[0][2], budget)
+    return "\n".join(clause for _, clause in sorted(kept))
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    if not budget or estimate_tokens(text) <= budget:
+        return text
+    # Estimate the cut point from the average characters per token, then tighten
+    cut = max(1, int(len(text) * budget / estimate_tokens(text)))
+    while cut > 1 and estimate_tokens(text[:cut]) > budget:
+        cut = int(cut * 0.9)
+    return text[:cut].rstrip() + " …"
+
+
+# ────────────────────────────────────────────────────────
+# Customer data and precedents
+# ────────────────────────────────────────────────────────
+def trim_customer_data(data: Dict[str, Any], budget: int) -> Tuple[Dict[str, Any], int]:
+    """
+    Drops the oldest rows until the minified section fits `budget`. Rows are
+    taken from dispute history first, then usage, then other transactions
+    (the disputed transaction, listed first, is kept). Returns (data, rows dropped).
+    """
+    data = {k: list(v) if isinstance(v, list) else v for k, v in data.items()}
+    dropped = 0
+    for section, keep in (("dispute_history", 0), ("account_usage", 0), ("transactions", 1)):
+        rows = data.get(section)
+        while budget and isinstance(rows, list) and len(rows) > keep and estimate_tokens(minify(data)) > budget:
+            rows.pop()   # sections are ordered newest first (transactions: disputed one first)
+            dropped += 1
+    return data, dropped
+
+
+def trim_precedents(precedents: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """Keeps the most similar precedents (they arrive best first) that fit `budget`."""
+    kept = list(precedents)
+    while budget and kept and estimate_tokens(minify(kept)) > budget:
+        kept.pop()
+    return kept
+
+
+# ────────────────────────────────────────────────────────
+# Report
+# ────────────────────────────────────────────────────────
+@dataclass
+class SectionSize:
+    chars_before: int = 0
+    tokens_before: int = 0
+    chars_after: int = 0
+    tokens_after: int = 0
+
+
+@dataclass
+class PromptSizeReport:
+    chars_before: int = 0
+    tokens_before: int = 0
+    chars_after: int = 0
+    tokens_after: int = 0
+    sections: Dict[str, SectionSize] = field(default_factory=dict)
+    dropped_rows: int = 0
+    terms_clauses_kept: str = ""
+
+    @property
+    def token_reduction(self) -> float:
+        return 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["token_reduction"] = round(self.token_reduction, 3)
+        return data
+
+
+def build_context(user_dispute: str, classification: str, terms_and_conditions: str,
+                  customer_data: Dict[str, Any], precedents: Optional[List[Dict[str, Any]]] = None,
+                  budgets: Optional[Dict[str, int]] = None) -> Tuple[str, PromptSizeReport]:
+    """
+    Returns (context JSON, size report). `customer_data` and `precedents` are
+    the compact dicts from `DbQueryResult.to_context()` / `Precedent.to_context()`.
+    """
+    budgets = {**SECTION_BUDGETS, **(budgets or {})}
+    full = {
+        "user_dispute": user_dispute,
+        "issue_classification": classification,
+        "terms_and_conditions": terms_and_conditions,
+        "customer_data": customer_data,
+    }
+    if precedents:
+        full["similar_past_disputes"] = precedents
+
+    report = PromptSizeReport()
+    if not CONTEXT_COMPACTION_ENABLED:
+        context_json = json.dumps(full, indent=2, default=str)
+        report.chars_before = report.chars_after = len(context_json)
+        report.tokens_before = report.tokens_after = estimate_tokens(context_json)
+        return context_json, report
+
+    compact = dict(full)
+    compact["user_dispute"] = truncate_to_budget(user_dispute, budgets["user_dispute"])
+    terms = select_clauses(terms_and_conditions, classification, budgets["terms_and_conditions"])
+    compact["terms_and_conditions"] = terms
+    report.terms_clauses_kept = f"{len(split_clauses(terms))}/{len(split_clauses(terms_and_conditions))}"
+    if "raw_db_agent_output" in customer_data:
+        compact["customer_data"] = {**customer_data, "raw_db_agent_output": truncate_to_budget(
+            customer_data["raw_db_agent_output"], budgets["customer_data"])}
+    else:
+        compact["customer_data"], report.dropped_rows = trim_customer_data(customer_data, budgets["customer_data"])
+    if precedents:
+        compact["similar_past_disputes"] = trim_precedents(precedents, budgets["similar_past_disputes"])
+
+    for name in full:
+        before = json.dumps(full[name], indent=2, default=str)
+        after = minify(compact[name])
+        report.sections[name] = SectionSize(len(before), estimate_tokens(before), len(after), estimate_tokens(after))
+    before_json = json.dumps(full, indent=2, default=str)
+    context_json = minify(compact)
+    report.chars_before, report.tokens_before = len(before_json), estimate_tokens(before_json)
+    report.chars_after, report.tokens_after = len(context_json), estimate_tokens(context_json)
+    return context_json, report
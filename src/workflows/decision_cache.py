@@ -0,0 +1,214 @@
+"""
+decision_cache.py
+
+Cache of complete workflow results for repeated disputes.
+
+Customers often resubmit the same complaint for the same transaction. Each
+resubmission would otherwise rerun the classification, DB, RAG and decision
+agents. An entry holds the outputs of those four steps and is keyed on:
+- the normalized prompt text (case and whitespace folded),
+- the account / transaction numbers extracted from it (sql_templates.py).
+Next to the outputs it stores a hash of the DB snapshot the decision was based
+on (customer row, transactions and usage rows of the account, read with the
+deterministic template queries). A lookup recomputes that hash, so the entry
+is dropped as soon as the underlying transactions or usage rows change.
+
+Prompts without identifiers are never cached, because there is no snapshot to
+validate them against. Entries live in memory and are written through to a
+JSON file, like the RAG answer cache: each write goes through its own temp
+file, merges in what other processes stored, and only logs a failure. The
+cache is created on first use by `get_decision_cache()`.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.agents.db_result import DbQueryResult
+from src.agents.sql_templates import TEMPLATE_BACKEND_CONFIGURED, extract_identifiers, fetch_dispute_data
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+DECISION_CACHE_ENABLED = os.getenv("DECISION_CACHE_ENABLED", "true").lower() == "true"
+DECISION_CACHE_PATH = os.getenv("DECISION_CACHE_PATH", str(BASE_DIR / ".cache" / "decisions.json"))
+DECISION_CACHE_TTL_SECONDS = float(os.getenv("DECISION_CACHE_TTL_SECONDS", "604800"))
+DECISION_CACHE_MAX_ENTRIES = int(os.getenv("DECISION_CACHE_MAX_ENTRIES", "5000"))
+
+# DB sections that make up the snapshot; dispute history is excluded so that
+# logging the resubmission itself does not invalidate the entry
+SNAPSHOT_SECTIONS = ("user_info", "account_usage", "transactions")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+def snapshot_hash(data: Dict[str, Any]) -> str:
+    """Stable hash of the DB rows a decision depends on."""
+    snapshot = {name: data.get(name) for name in SNAPSHOT_SECTIONS}
+    encoded = json.dumps(snapshot, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class DecisionCache:
+    """
+    Disk-backed cache of workflow step outputs keyed by (normalized prompt,
+    account number, transaction number) and validated by a DB snapshot hash.
+    """
+
+    def __init__(self, path=DECISION_CACHE_PATH, ttl_seconds: float = DECISION_CACHE_TTL_SECONDS,
+                 max_entries: int = DECISION_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = self._load()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(prompt: str, account_number: Optional[str], transaction_number: Optional[str]) -> str:
+        return hashlib.sha256(
+            f"{account_number}\x00{transaction_number}\x00{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, OSError) as e:
+            logging.warning(f"Ignoring unreadable decision cache file {self.path}: {e}")
+            return {}
+
+    def _persist(self) -> None:
+        """Atomically rewrites the file; a failed write is logged and the entries stay in memory."""
+        tmp_path = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.path.parent, prefix=self.path.name,
+                                             suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not write decision cache file {self.path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def snapshot_for(self, prompt: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns (cache key, DB snapshot hash) for a prompt, or None when the
+        prompt cannot be cached (no identifiers, unknown account, DB error).
+        """
+        account_number, transaction_number = extract_identifiers(prompt)
+        if not TEMPLATE_BACKEND_CONFIGURED or (not account_number and not transaction_number):
+            return None
+        try:
+            data = fetch_dispute_data(account_number, transaction_number)
+        except Exception as e:
+            logging.warning(f"Decision cache disabled for this dispute, DB snapshot failed: {e}")
+            return None
+        if data is None:
+            return None
+        return self.make_key(prompt, account_number, transaction_number), snapshot_hash(data)
+
+    def get(self, key: str, db_snapshot: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the stored step outputs, or None. An entry recorded against a
+        different DB snapshot, or older than the TTL, is removed.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry["db_snapshot"] != db_snapshot or time.time() - entry["created_at"] > self.ttl_seconds:
+                del self._entries[key]
+                self._persist()
+                self.misses += 1
+                self.invalidations += 1
+                return None
+            self.hits += 1
+            return self._decode(entry)
+
+    def put(self, key: str, db_snapshot: str, results: Dict[str, Any], account_number: Optional[str] = None) -> None:
+        """Stores the outputs of a completed run (a failed DB step is not cached)."""
+        db_result: DbQueryResult = results["db"]
+        if not db_result.ok:
+            return
+        terms_and_conditions, rag_source = results["rag"]
+        entry = {
+            "created_at": time.time(),
+            "db_snapshot": db_snapshot,
+            "account_number": account_number or db_result.user_info.account_number,
+            "classification": results["classification"],
+            "db": {"source": db_result.source, "raw_text": db_result.raw_text, "data": db_result.to_context(),
+                   "transaction_number": db_result.transaction_number},
+            "rag": terms_and_conditions,
+            "rag_source": rag_source,
+            "decision": results["decision"],
+        }
+        with self._lock:
+            # Keep what other processes stored since this one loaded the file
+            self._entries = {**self._load(), **self._entries}
+            self._entries[key] = entry
+            if len(self._entries) > self.max_entries:
+                # Dicts keep insertion order, so the oldest entries go first
+                for old_key in list(self._entries)[:len(self._entries) - self.max_entries]:
+                    del self._entries[old_key]
+            self._persist()
+
+    @staticmethod
+    def _decode(entry: dict) -> Dict[str, Any]:
+        db = entry["db"]
+        return {
+            "classification": entry["classification"],
+            "db": DbQueryResult.from_dict(db["data"], source=db["source"], raw_text=db["raw_text"],
+                                         transaction_number=db.get("transaction_number")),
+            "rag": (entry["rag"], entry.get("rag_source", "cache")),
+            "decision": dict(entry["decision"]),
+            "cached_at": entry["created_at"],
+        }
+
+    def invalidate_account(self, account_number: str) -> int:
+        """Drops every entry for an account (e.g. after its rows were corrected). Returns the count."""
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if v.get("account_number") == str(account_number)]
+            for key in keys:
+                del self._entries[key]
+            if keys:
+                self._persist()
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._persist()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "invalidations": self.invalidations}
+
+
+_CACHE: Optional[DecisionCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_decision_cache() -> DecisionCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = DecisionCache()
+        return _CACHE
@@ -3,80 +3,114 @@ dispute_resolution_workflow.py
 
 This script orchestrates the dispute resolution process by coordinating multiple agents.
 Workflow:
-1. Receives a user's dispute prompt.
-2. Calls the RAG agent to fetch relevant terms and conditions.
-3. Calls the DB agent to retrieve user transaction and usage data.
-4. Compiles the collected information into a structured JSON object.
-5. Calls the LLM agent with the compiled data to get a final decision.
+1. Receives a user's dispute prompt and classifies it.
+2. Looks up the terms and conditions for the classification in the
+   precomputed policy index (policy_index.py), falling back to the RAG agent.
+3. Calls the DB agent to retrieve user transaction and usage data
+   (steps 2 and 3 run concurrently, see dag_executor.py).
+4. Compiles the collected information, plus the most similar earlier disputes
+   and their outcomes (agents/precedent_index.py), into a structured JSON object.
+5. Calls the LLM agent with the compiled data to get a final decision. An
+   exact repeat of an already decided dispute still goes to the LLM, with the
+   earlier dispute as its top-ranked precedent; clear-cut cases are decided by
+   the declarative rules in rule_engine.py.
+6. Optionally issues the refund credit memo for an accepted dispute, at most
+   once per account/transaction (REFUND_EXECUTION_ENABLED, see refund_pipeline.py).
+7. Optionally queues the customer's resolution notice in the notification
+   outbox without waiting for delivery (RESOLUTION_NOTICE_ENABLED, see
+   agents/notification_outbox.py). A dispute that needs human approval is
+   notified by the human action handler once the operator decides.
+A repeated dispute (same prompt, identifiers and DB rows) is replayed from the
+decision cache instead of calling the agents again, see decision_cache.py.
+Completed agent steps are checkpointed per dispute ID (checkpoint_store.py), so
+an interrupted dispute resumes from its missing steps when it is run again.
+Every yielded step carries its latency/size metrics under "metrics", and one
+record per dispute is exported to the sinks in src/instrumentation.py.
+With `stream=True`, the agents' answers are also yielded while they are being
+generated, as partial updates ("partial": True) ahead of each step's result.
 """
 
 import json
 import os
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
 import time
+import uuid
 import logging
+from contextlib import aclosing
 
 # --- MODIFIED: Import the new classification agent ---
-from src.agents.classification_agent import run_classification_query
-from src.agents.rag_agent import run_rag_query
-from src.agents.db_agent import run_db_query
-from src.agents.llm_agent import run_llm_decision
+from src.agents.classification_agent import arun_classification_query
+from src.agents.policy_index import arun_policy_lookup
+from src.agents.db_agent import arun_db_query
+from src.agents.llm_agent import arun_llm_decision
+from src.agents.agent_pool import AGENT_POOL, set_text_sink
+from src.agents.notification_outbox import RESOLUTION_NOTICE_ENABLED, customer_email, notify_resolution
+from src.agents.db_result import DbQueryResult, json_default
+from src.agents.precedent_index import (
+    DECIDED_STATUSES, PRECEDENTS_ENABLED, find_precedents, get_precedent_index)
+from src.agents.sql_templates import extract_identifiers
+from src.workflows.dag_executor import DagExecutor
+from src.instrumentation import StepMetrics, emit_dispute_metrics
+from src.workflows.decision_cache import DECISION_CACHE_ENABLED, get_decision_cache
+from src.workflows.context_builder import build_context, estimate_tokens
+from src.workflows.rule_engine import decide_by_rules
+from src.workflows.checkpoint_store import (
+    APPROVAL_STEP, STATUS_AWAITING_APPROVAL, get_checkpoint_store, is_checkpointable)
+from src.workflows.refund_pipeline import (REFUND_EXECUTION_ENABLED, RefundError, credit_memo_party, execute_refund,
+                                            refund_request_from)
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 load_dotenv(BASE_DIR / "config/.env")
 
-def resolve_dispute(user_dispute_prompt: str, approval_threshold: float = 500.0):
+def warm_up_agents():
     """
-    Orchestrates the dispute resolution workflow, yielding updates at each step.
+    Builds and sets up every workflow agent in the shared pool so the first
+    dispute after a deploy does not pay for agent setup.
+    Returns the setup time (seconds) per agent.
     """
-    # --- Step 1 - Classify the issue type ---
-    classification = run_classification_query(user_dispute_prompt)
-    yield {
-        "step_name": "Classification Agent: Issue Type",
-        "data": classification,
-        "is_final": False
-    }
+    timings = AGENT_POOL.warm_up()
+    logging.info(f"Agent pool warm-up: {timings}")
+    return timings
 
-    # --- Step 2 - Get all customer data from DB ---
-    # We now pass the classification to the DB agent
-    transaction_data_str = run_db_query(user_dispute_prompt, classification)
-    yield {
-        "step_name": "DB Agent: Customer Data",
-        "data": transaction_data_str,
-        "is_final": False
-    }
+T_AND_C_QUERY = "What are the terms and conditions for refunds and cancellations?"
 
-    # --- Step 3 - Call RAG agent ---
-    t_and_c_query = "What are the terms and conditions for refunds and cancellations?"
-    terms_and_conditions = run_rag_query(t_and_c_query)
-    yield {
-        "step_name": "RAG Agent: Terms & Conditions",
-        "data": terms_and_conditions,
-        "is_final": False
-    }
+DECISION_INSTRUCTIONS = """Analyze the following customer dispute based on the provided context.
+Your response must be a JSON object with three keys:
+1. "dispute_status": "Accepted" or "Rejected".
+2. "reason": A brief, clear explanation for your decision.
+3. "recommended_action": A specific next step.
 
-    # Step 4: Compile data and call LLM agent
-    dispute_context = {
-        "user_dispute": user_dispute_prompt,
-        "issue_classification": classification, # Include the classification
-        "terms_and_conditions": terms_and_conditions,
-        "customer_data": transaction_data_str
-    }
-    dispute_json = json.dumps(dispute_context, indent=2)
-    
-    llm_prompt = f"""
-    Analyze the following customer dispute based on the provided context.
-    Your response must be a JSON object with three keys:
-    1. "dispute_status": "Accepted" or "Rejected".
-    2. "reason": A brief, clear explanation for your decision.
-    3. "recommended_action": A specific next step.
-
-    Context:
-    {dispute_json}
+Context:
+"""
+
+def build_decision_prompt_with_report(user_dispute_prompt, classification, terms_and_conditions,
+                                      db_result: DbQueryResult, precedents=None):
     """
-    final_decision_str = run_llm_decision(llm_prompt)
-    
+    Compiles the collected context into the prompt for the LLM decision agent.
+    Returns (prompt, PromptSizeReport): the context is minified and trimmed to
+    the per-section token budgets in context_builder.py.
+    """
+    # Similar earlier disputes and how they were resolved, most similar first
+    precedent_context = [p.to_context() for p in precedents] if precedents else None
+    dispute_json, report = build_context(user_dispute_prompt, classification, terms_and_conditions,
+                                         db_result.to_context(), precedent_context)
+    instructions_tokens = estimate_tokens(DECISION_INSTRUCTIONS)
+    report.tokens_before += instructions_tokens
+    report.tokens_after += instructions_tokens
+    report.chars_before += len(DECISION_INSTRUCTIONS)
+    report.chars_after += len(DECISION_INSTRUCTIONS)
+    return DECISION_INSTRUCTIONS + dispute_json, report
+
+def build_decision_prompt(user_dispute_prompt, classification, terms_and_conditions, db_result: DbQueryResult,
+                          precedents=None):
+    """Compiles the collected context into the prompt for the LLM decision agent."""
+    return build_decision_prompt_with_report(user_dispute_prompt, classification, terms_and_conditions,
+                                             db_result, precedents)[0]
+
+def parse_llm_decision(final_decision_str):
+    """Strips markdown fences from the LLM response and parses the decision JSON."""
     cleaned_json_str = final_decision_str.strip()
     if cleaned_json_str.startswith("```json"):
         cleaned_json_str = cleaned_json_str[7:]
@@ -85,67 +119,319 @@ def resolve_dispute(user_dispute_prompt: str, approval_threshold: float = 500.0)
     cleaned_json_str = cleaned_json_str.strip()
 
     try:
-        final_decision = json.loads(cleaned_json_str)
+        return json.loads(cleaned_json_str)
     except json.JSONDecodeError:
-        final_decision = {"raw_response": final_decision_str}
+        return {"raw_response": final_decision_str}
 
-    # --- Step 5: Check for Human-in-the-Loop condition ---
-    dispute_amount = 0
+def resolve_dispute(user_dispute_prompt: str, approval_threshold: float = 500.0, stream: bool = False):
+    """
+    Orchestrates the dispute resolution workflow, yielding updates at each step.
+    Synchronous wrapper around `aresolve_dispute` for the Streamlit app and
+    scripts: the async workflow is driven on a private event loop.
+    """
+    loop = asyncio.new_event_loop()
+    steps = aresolve_dispute(user_dispute_prompt, approval_threshold, stream)
     try:
-        # Attempt to parse the transaction data to find the amount
-        json_start = transaction_data_str.find('{')
-        json_end = transaction_data_str.rfind('}') + 1
-        if json_start != -1 and json_end != 0:
-            db_data = json.loads(transaction_data_str[json_start:json_end])
-            transactions = db_data.get("transactions")
-            
-            # --- MODIFICATION START ---
-            # Handle cases where 'transactions' is a string-encoded JSON list/object
-            if isinstance(transactions, str):
-                transactions = json.loads(transactions)
-            
-            # Ensure transactions is a list for consistent processing
-            if transactions and not isinstance(transactions, list):
-                transactions = [transactions]
-
-            # Now safely access the first transaction
-            if transactions: # Check again in case it was an empty list
-                first_transaction = transactions[0]
-                # The item in the list might *still* be a string if it was a list of JSON strings
-                if isinstance(first_transaction, str):
-                    first_transaction = json.loads(first_transaction)
-                
-                dispute_amount = float(first_transaction.get("amount", 0))
-            # --- MODIFICATION END ---
-        
-    except (json.JSONDecodeError, ValueError, TypeError, AttributeError):
-        dispute_amount = 0 # Default to 0 if parsing fails
+        while True:
+            try:
+                yield loop.run_until_complete(steps.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(steps.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+async def aresolve_dispute(user_dispute_prompt: str, approval_threshold: float = 500.0, stream: bool = False):
+    """
+    Async generator version of the dispute resolution workflow.
+
+    Steps run on a small DAG: the policy lookup and the DB lookup only need the
+    classification, so both run concurrently. Updates
+    are still yielded in the order Classification -> DB -> RAG -> Decision.
+    Many disputes can share one event loop and overlap their agent calls.
+
+    With `stream=True`, partial updates are yielded as soon as an agent
+    produces text, whichever step it belongs to:
+        {"step_name": ..., "partial": True, "text": answer so far,
+         "delta": new text, "is_final": False}
+    Callers that track step order must skip updates with "partial".
+    """
+    from src.human_action_handler import dispute_id_for
+    account_number, transaction_number = extract_identifiers(user_dispute_prompt)
+    dispute_id = dispute_id_for(user_dispute_prompt)
+    prompt_size = {}   # filled by the decision step when it builds an LLM prompt
+
+    async def decide(r):
+        # Clear-cut cases are settled by the rules on the structured DB data
+        rule_decision = decide_by_rules(r["classification"], r["db"])
+        if rule_decision is not None:
+            logging.info(f"Decided by rule '{rule_decision['rule']}', LLM decision skipped")
+            return rule_decision
+        llm_prompt, report = build_decision_prompt_with_report(
+            user_dispute_prompt, r["classification"], r["rag"][0], r["db"], r["precedents"])
+        prompt_size.update(report.to_dict())
+        logging.info(f"Decision prompt: ~{report.tokens_after} tokens (was ~{report.tokens_before}, "
+                     f"{report.token_reduction:.0%} smaller), {report.chars_after} chars")
+        return parse_llm_decision(await arun_llm_decision(llm_prompt))
+
+    step_names = {
+        "classification": "Classification Agent: Issue Type",
+        "db": "DB Agent: Customer Data",
+        "rag": "RAG Agent: Terms & Conditions",
+    }
+    partial_names = {**step_names, "decision": "LLM Agent: Final Decision"}
+    # (step, answer so far) from agent worker threads, see `streamed`
+    partials: asyncio.Queue = asyncio.Queue()
+    streamed_text = {}
+
+    def streamed(name, fn):
+        """Step function whose agent calls report their partial answers to `partials`."""
+        if not stream:
+            return fn
+        loop = asyncio.get_running_loop()
+
+        async def run(r):
+            set_text_sink(lambda text: loop.call_soon_threadsafe(partials.put_nowait, (name, text)))
+            return await fn(r)
+        return run
+
+    def partial_update(name, text):
+        previous = streamed_text.get(name, "")
+        streamed_text[name] = text
+        return {
+            "step_name": partial_names[name],
+            "partial": True,
+            "text": text,
+            "delta": text[len(previous):] if text.startswith(previous) else text,
+            "is_final": False,
+        }
+
+    checkpoints = get_checkpoint_store()
+    resumed = {}   # step -> value restored from a checkpoint of an earlier, unfinished run
+
+    def resumable(name, fn):
+        """Step function that returns the checkpointed value, or runs and checkpoints the step."""
+        if checkpoints is None:
+            return fn
+
+        async def run(r):
+            if name in resumed:
+                return resumed[name]
+            value = await fn(r)
+            if is_checkpointable(name, value):
+                await asyncio.to_thread(checkpoints.save, dispute_id, user_dispute_prompt, name, value)
+            return value
+        return run
+
+    def step_update(name, value, metrics, replayed=False):
+        """UI update for an intermediate step."""
+        update = {
+            "step_name": step_names[name],
+            "data": value,
+            "is_final": False,
+            "metrics": metrics
+        }
+        if name == "rag":
+            # "policy_index", "cache" (RAG answer cache) or "agent"
+            update["data"], update["source"] = value
+            update["from_cache"] = update["source"] == "cache"
+        elif name == "db" and not value.ok:
+            update["error"] = value.parse_error
+        if replayed:
+            update["from_decision_cache"] = True
+        elif name in resumed:
+            update["from_checkpoint"] = True
+        return update
+
+    # --- Decision cache: replay a repeated dispute whose DB rows have not changed ---
+    cache_slot = None
+    cached = None
+    if DECISION_CACHE_ENABLED:
+        cache_slot = await asyncio.to_thread(get_decision_cache().snapshot_for, user_dispute_prompt)
+        if cache_slot is not None:
+            cached = get_decision_cache().get(*cache_slot)
+
+    results = {}
+    step_metrics = {}
+    if cached is not None:
+        logging.info("Dispute served from the decision cache")
+        for name in ("classification", "db", "rag", "decision"):
+            results[name] = cached[name]
+            step_metrics[name] = StepMetrics(step=name).to_dict()
+            if name in step_names:
+                yield step_update(name, results[name], step_metrics[name], replayed=True)
+        timing = {
+            "wall_clock_seconds": 0.0,
+            "sequential_seconds": 0.0,
+            "time_saved_seconds": 0.0,
+            "from_decision_cache": True,
+        }
+    else:
+        # --- Resume an unfinished earlier run of this dispute: only its missing steps run ---
+        if checkpoints is not None:
+            resumed.update(await asyncio.to_thread(checkpoints.resume, dispute_id, user_dispute_prompt))
+            if resumed:
+                logging.info(f"Dispute {dispute_id}: resuming with checkpointed steps {sorted(resumed)}")
+        dag = DagExecutor()
+        # --- Step 1 - Classify the issue type ---
+        dag.add_step("classification", resumable("classification", streamed(
+            "classification", lambda r: arun_classification_query(user_dispute_prompt))))
+        # --- Step 2 - Get all customer data from DB (needs the classification) ---
+        dag.add_step("db", resumable("db", streamed(
+            "db", lambda r: arun_db_query(user_dispute_prompt, r["classification"]))),
+                     depends_on=["classification"])
+        # --- Step 3 - Policy snippet for the classification (RAG agent only if the index has none) ---
+        dag.add_step("rag", resumable("rag", streamed(
+            "rag", lambda r: arun_policy_lookup(r["classification"], T_AND_C_QUERY))),
+                     depends_on=["classification"])
+        # --- Similar earlier disputes from the local index (no agent call) ---
+        dag.add_step("precedents", lambda r: asyncio.to_thread(find_precedents, user_dispute_prompt))
+        # --- Step 4 - Compile data and call LLM agent ---
+        dag.add_step("decision", resumable("decision", streamed("decision", decide)),
+                     depends_on=["classification", "db", "rag", "precedents"])
+
+        async with aclosing(dag.run()) as dag_steps:
+            next_step = asyncio.ensure_future(anext(dag_steps, None))
+            try:
+                while True:
+                    if stream:
+                        next_partial = asyncio.ensure_future(partials.get())
+                        await asyncio.wait({next_step, next_partial}, return_when=asyncio.FIRST_COMPLETED)
+                        if next_partial.done():
+                            yield partial_update(*next_partial.result())
+                        else:
+                            next_partial.cancel()
+                        if not next_step.done():
+                            continue
+                        # Text reported before the step finished goes out ahead of its result
+                        while not partials.empty():
+                            yield partial_update(*partials.get_nowait())
+                    step = await next_step
+                    if step is None:
+                        break
+                    results[step.name] = step.value
+                    step_metrics[step.name] = step.metrics.to_dict()
+                    if step.name in step_names:
+                        yield step_update(step.name, step.value, step_metrics[step.name])
+                    next_step = asyncio.ensure_future(anext(dag_steps, None))
+            finally:
+                next_step.cancel()
+                await asyncio.gather(next_step, return_exceptions=True)
+
+        timing = {
+            "wall_clock_seconds": round(dag.wall_clock, 3),
+            "sequential_seconds": round(dag.sequential_time, 3),
+            "time_saved_seconds": round(dag.time_saved, 3),
+        }
+        if resumed:
+            timing["resumed_steps"] = sorted(resumed)
+        # Checkpointed DB rows may predate the current snapshot, so such runs are not cached
+        if cache_slot is not None and "raw_response" not in results["decision"] and "db" not in resumed:
+            await asyncio.to_thread(get_decision_cache().put, *cache_slot, results)
+
+    db_result = results["db"]
+    final_decision = results["decision"]
+    precedents = [p.to_context() for p in results.get("precedents", [])]
+    logging.info(f"Dispute workflow timing: {timing}")
+    emit_dispute_metrics({
+        "wall_seconds": timing["wall_clock_seconds"],
+        "sequential_seconds": timing["sequential_seconds"],
+        "prompt_chars": len(user_dispute_prompt),
+        "classification": results["classification"],
+        "dispute_status": final_decision.get("dispute_status"),
+        "from_decision_cache": cached is not None,
+        "rag_source": results["rag"][1],
+        "decided_by": final_decision.get("decided_by", "llm"),
+        "resumed_steps": len(resumed),
+        "decision_prompt_tokens": prompt_size.get("tokens_after"),
+        "decision_prompt_tokens_before": prompt_size.get("tokens_before"),
+        "steps": list(step_metrics.values()),
+    })
+
+    # --- Step 5: Check for Human-in-the-Loop condition ---
+    # The DB result was parsed once by the DB step; a missing amount is reported, not defaulted
+    dispute_amount = db_result.dispute_amount
+    amount_error = None
+    if dispute_amount is None:
+        amount_error = db_result.parse_error or "No disputed transaction found in the customer data"
+        logging.warning(f"Dispute amount unavailable: {amount_error}")
     
     # --- DEBUG: Print values before the human-in-the-loop check ---
     print("\n--- HUMAN-IN-THE-LOOP CHECK ---")
-    print(f"Dispute Amount: {dispute_amount}")
+    print(f"Dispute Amount: {dispute_amount if dispute_amount is not None else 'UNKNOWN (' + amount_error + ')'}")
     print(f"Approval Threshold: {approval_threshold}")
     print(f"AI Decision Status: {final_decision.get('dispute_status')}")
     print("---------------------------------\n")
 
     # If AI accepts a refund over the threshold, ask for human approval
-    if final_decision.get("dispute_status") == "Accepted" and dispute_amount > approval_threshold:
+    # (an accepted refund of unknown amount always goes to a human)
+    if final_decision.get("dispute_status") == "Accepted" and (dispute_amount is None or dispute_amount > approval_threshold):
         # --- MODIFIED: Add dispute amount to the data payload for the UI ---
         approval_data = final_decision.copy()
         approval_data['dispute_amount'] = dispute_amount
+        if amount_error:
+            approval_data['amount_error'] = amount_error
+        # Lets the approval handler issue the refund for the same account/transaction
+        disputed_transaction = db_result.disputed_transaction
+        if disputed_transaction is not None:
+            approval_data['account_number'] = disputed_transaction.account_number or db_result.user_info.account_number
+            approval_data['transaction_number'] = disputed_transaction.transaction_number
+            approval_data['currency_code'] = disputed_transaction.currency_code
+            approval_data.update(credit_memo_party(db_result))
+        # Recipient of the resolution notice the approval handler queues
+        approval_data['customer_email'] = customer_email(db_result)
+        # Operator decisions are idempotent per approval request; a rerun while this
+        # request is still pending keeps its ID, a later run of the dispute gets a new one
+        pending = await asyncio.to_thread(checkpoints.approval_data, dispute_id) if checkpoints is not None else None
+        approval_data['approval_id'] = (pending or {}).get('approval_id') or uuid.uuid4().hex
+        # The human action handler takes the decision from here, not from a new run
+        if checkpoints is not None:
+            await asyncio.to_thread(checkpoints.save, dispute_id, user_dispute_prompt, APPROVAL_STEP,
+                                    approval_data, STATUS_AWAITING_APPROVAL)
         
         yield {
             "step_name": "Human Approval Required",
             "data": approval_data, # Pass the AI recommendation and the amount
-            "is_final": False # Not final until a human decides
+            "is_final": False, # Not final until a human decides
+            "timing": timing,
+            "metrics": step_metrics["decision"],
+            "precedents": precedents,
+            "prompt_size": prompt_size
         }
     else:
         # Otherwise, yield the final decision directly
-        yield {
+        final_step = {
             "step_name": "LLM Agent: Final Decision",
             "data": final_decision,
-            "is_final": True
+            "is_final": True,
+            "timing": timing,
+            "metrics": step_metrics["decision"],
+            "precedents": precedents,
+            "prompt_size": prompt_size
         }
+        # A new final decision becomes a precedent for later disputes
+        if (PRECEDENTS_ENABLED and cached is None
+                and final_decision.get("dispute_status") in DECIDED_STATUSES):
+            get_precedent_index().add(
+                user_dispute_prompt, account_number=account_number, transaction_number=transaction_number,
+                request_type=results["classification"], dispute_status=final_decision["dispute_status"],
+                outcome_details=final_decision.get("recommended_action"))
+        # --- Step 6: Refund an auto-accepted dispute (at most once per account/transaction) ---
+        if REFUND_EXECUTION_ENABLED and final_decision.get("dispute_status") == "Accepted":
+            try:
+                final_step["refund"] = await asyncio.to_thread(
+                    execute_refund, refund_request_from(db_result, final_decision))
+            except RefundError as e:
+                logging.warning(f"Refund not executed: {e}")
+                final_step["refund"] = {"status": "not_executed", "error": str(e)}
+        # --- Step 7: Queue the customer notice; delivery happens in the outbox workers ---
+        if RESOLUTION_NOTICE_ENABLED:
+            final_step["notification_id"] = await asyncio.to_thread(
+                notify_resolution, dispute_id, customer_email(db_result), final_decision)
+        if checkpoints is not None:
+            await asyncio.to_thread(checkpoints.complete, dispute_id)
+        yield final_step
 
 
 if __name__ == "__main__":
@@ -168,23 +454,21 @@ if __name__ == "__main__":
     logging.info("="*50)
 
     # --- MODIFIED: Timing logic implementation ---
+    # Per-step numbers come from the instrumentation attached to each step
     workflow_start_time = time.time()
-    step_timings = {}
+    step_metrics = {}
+    dag_timing = {}
     
     # The generator needs to be consumed to execute.
     for step_result in resolve_dispute(sample_dispute, approval_threshold=400.0):
-        step_end_time = time.time()
-        
         # Unpack the result from the generator
         step_name = step_result.get("step_name")
         result_data = step_result.get("data")
         is_final = step_result.get("is_final")
+        dag_timing = step_result.get("timing", dag_timing)
+        step_metrics[step_name] = step_result.get("metrics", {})
 
-        # The time for this step is the total time elapsed since the start, minus time for previous steps
-        step_duration = (step_end_time - workflow_start_time) - sum(step_timings.values())
-        step_timings[step_name] = step_duration
-
-        logging.info(f"\n--- Output from: {step_name} ---\n{json.dumps(result_data, indent=2)}")
+        logging.info(f"\n--- Output from: {step_name} ---\n{json.dumps(result_data, indent=2, default=json_default)}")
         
         if is_final:
             logging.info("\n--- Final Decision Reached ---")
@@ -199,10 +483,17 @@ if __name__ == "__main__":
         "Workflow Timing Summary",
         "="*50
     ]
-    for step, duration in step_timings.items():
-        summary_lines.append(f"- {step:<35}: {duration:.2f} seconds")
+    for step, metrics in step_metrics.items():
+        summary_lines.append(f"- {step:<35}: {metrics.get('wall_seconds', 0.0):.2f} seconds "
+                             f"(queue wait {metrics.get('queue_wait_seconds', 0.0):.2f}s)")
+        for call in metrics.get("agent_calls", []):
+            summary_lines.append(f"    {call['agent']:<12} setup {call['setup_seconds']:.2f}s  run {call['run_seconds']:.2f}s  "
+                                 f"prompt {call['prompt_chars']} chars  response {call['response_chars']} chars  "
+                                 f"retries {call['retries']}")
     summary_lines.append("-"*50)
     summary_lines.append(f"- {'Total Workflow Time':<35}: {total_workflow_time:.2f} seconds")
+    if dag_timing:
+        summary_lines.append(f"- {'Time Saved by Parallel Steps':<35}: {dag_timing['time_saved_seconds']:.2f} seconds")
     summary_lines.append("="*50)
     
     logging.info("\n".join(summary_lines))
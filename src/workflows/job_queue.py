@@ -0,0 +1,467 @@
+"""
+job_queue.py
+
+Persistent dispute job queue and the worker pool that drains it.
+
+The Streamlit app does not run `resolve_dispute` in the browser session's
+script thread. Instead:
+1. "Analyze Dispute" submits a job to a SQLite queue shared by every process
+   on the host. While a job for the same dispute, prompt and threshold is
+   still queued or running, that job is returned instead of a new one.
+2. Workers claim queued jobs one at a time (`BEGIN IMMEDIATE`) and run the
+   workflow with streaming on. Every step update is stored as it is yielded.
+   The latest partial answer per step is stored too, at most every
+   JOB_LIVE_TEXT_INTERVAL_SECONDS.
+3. The UI polls the job and renders the stored updates. A rerun, including
+   the one triggered by an Approve / Reject click, reads the same results
+   and never runs the agents again.
+4. A running job whose worker stopped sending heartbeats for
+   JOB_LEASE_SECONDS goes back to the queue, up to JOB_MAX_ATTEMPTS runs.
+   Every write of a worker checks that the job is still running under its
+   worker id, so a worker whose lease expired stops instead of writing into
+   the retry that another worker claimed.
+
+Workers run in their own processes, or inside the Streamlit server with
+JOB_WORKERS_IN_PROCESS=true (a single-process setup for development). Every
+claim attempt records the worker in the `workers` table, so the UI can tell
+when no worker is running. A worker process serves its own dispute metrics
+on --metrics-port (JOB_WORKER_METRICS_PORT), since the disputes are measured
+where they run:
+    python -m src.workflows.job_queue --workers 4     # run a worker pool
+    python -m src.workflows.job_queue                 # list recent jobs
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import socket
+import sqlite3
+import argparse
+import logging
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from src.agents.db_result import DbQueryResult, json_default
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", str(BASE_DIR / ".cache" / "dispute_jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Start the worker pool inside the Streamlit server instead of in separate worker processes
+JOB_WORKERS_IN_PROCESS = os.getenv("JOB_WORKERS_IN_PROCESS", "false").lower() == "true"
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_LIVE_TEXT_INTERVAL_SECONDS = float(os.getenv("JOB_LIVE_TEXT_INTERVAL_SECONDS", "0.2"))
+# A worker not seen for this long no longer counts as running (it polls every JOB_POLL_SECONDS when idle)
+JOB_WORKER_SEEN_SECONDS = float(os.getenv("JOB_WORKER_SEEN_SECONDS", "30"))
+# /metrics port of a worker process; unset falls back to METRICS_PROMETHEUS_PORT
+JOB_WORKER_METRICS_PORT = os.getenv("JOB_WORKER_METRICS_PORT")
+
+QUEUE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        dispute_id TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        prompt_hash TEXT,
+        approval_threshold REAL NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        error TEXT,
+        live TEXT,
+        submitted_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, submitted_at);
+    CREATE INDEX IF NOT EXISTS jobs_dispute ON jobs (dispute_id, status);
+    CREATE TABLE IF NOT EXISTS job_updates (
+        job_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        step_name TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        PRIMARY KEY (job_id, seq)
+    );
+    CREATE TABLE IF NOT EXISTS workers (
+        worker TEXT PRIMARY KEY,
+        seen_at REAL NOT NULL
+    );
+"""
+
+# Columns added after the first release; ALTERed into existing queue databases
+QUEUE_MIGRATIONS = {"prompt_hash": "TEXT"}
+
+STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED = "queued", "running", "done", "failed"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+DB_STEP_NAME = "DB Agent: Customer Data"
+
+
+class JobLeaseLost(RuntimeError):
+    """The job is no longer running under this worker (its lease expired and it was requeued or failed)."""
+
+
+@dataclass
+class Job:
+    job_id: str
+    dispute_id: str
+    prompt: str
+    approval_threshold: float
+    status: str
+    attempts: int = 0
+    worker: Optional[str] = None
+    error: Optional[str] = None
+    submitted_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    live: Dict[str, str] = field(default_factory=dict)   # step name -> partial answer so far
+
+    @property
+    def done(self) -> bool:
+        return self.status not in ACTIVE_STATUSES
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(job_id=row["job_id"], dispute_id=row["dispute_id"], prompt=row["prompt"],
+                   approval_threshold=row["approval_threshold"], status=row["status"], attempts=row["attempts"],
+                   worker=row["worker"], error=row["error"], submitted_at=row["submitted_at"],
+                   started_at=row["started_at"], finished_at=row["finished_at"],
+                   live=json.loads(row["live"]) if row["live"] else {})
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(" ".join(prompt.split()).encode("utf-8")).hexdigest()
+
+
+def encode_update(update: Dict[str, Any]) -> str:
+    return json.dumps(update, default=json_default)
+
+
+def decode_update(payload: str) -> Dict[str, Any]:
+    """Inverse of `encode_update`: the DB step's data becomes a DbQueryResult again."""
+    update = json.loads(payload)
+    if update.get("step_name") == DB_STEP_NAME and isinstance(update.get("data"), dict):
+        data = update["data"]
+        db_result = DbQueryResult.from_dict(data, source=data.get("source", "template"), raw_text=data.get("raw_text"),
+                                            transaction_number=data.get("transaction_number"))
+        db_result.parse_error = data.get("parse_error")
+        update["data"] = db_result
+    return update
+
+
+class JobQueue:
+    """SQLite job queue; safe to share between threads and processes on one host."""
+
+    def __init__(self, path=JOB_QUEUE_PATH, lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(QUEUE_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in QUEUE_MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation keeps this usable from any thread or process
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ---- producer side ------------------------------------------------------
+    def submit(self, prompt: str, approval_threshold: float, dispute_id: Optional[str] = None) -> Job:
+        """
+        Queues a dispute and returns its job. A queued or running job for the
+        same dispute, prompt (whitespace folded) and threshold is returned
+        instead of a new one.
+        """
+        from src.human_action_handler import dispute_id_for
+        dispute_id = dispute_id or dispute_id_for(prompt)
+        digest = prompt_hash(prompt)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE dispute_id = ? AND prompt_hash = ? AND approval_threshold = ? "
+                "AND status IN (?, ?) ORDER BY submitted_at DESC LIMIT 1",
+                (dispute_id, digest, approval_threshold, *ACTIVE_STATUSES)).fetchone()
+            if row is None:
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (job_id, dispute_id, prompt, prompt_hash, approval_threshold, status, "
+                    "submitted_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, dispute_id, prompt, digest, approval_threshold, STATUS_QUEUED, time.time()))
+                row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            conn.execute("COMMIT")
+            return Job.from_row(row)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def updates(self, job_id: str, after_seq: int = -1) -> List[Dict[str, Any]]:
+        """Stored step updates of a job, in the order the workflow yielded them."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT payload FROM job_updates WHERE job_id = ? AND seq > ? ORDER BY seq",
+                                (job_id, after_seq)).fetchall()
+        return [decode_update(row["payload"]) for row in rows]
+
+    def position(self, job_id: str) -> int:
+        """Number of queued jobs ahead of `job_id` (0 once it is running)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND submitted_at < "
+                "(SELECT submitted_at FROM jobs WHERE job_id = ? AND status = ?)",
+                (STATUS_QUEUED, job_id, STATUS_QUEUED)).fetchone()
+        return row[0]
+
+    def recent(self, limit: int = 20) -> List[Job]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY submitted_at DESC LIMIT ?", (limit,)).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def active_workers(self, within_seconds: float = JOB_WORKER_SEEN_SECONDS) -> int:
+        """Workers that polled for a job, or heartbeated a running one, within `within_seconds`."""
+        since = time.time() - within_seconds
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM (SELECT worker FROM workers WHERE seen_at >= ? "
+                "UNION SELECT worker FROM jobs WHERE status = ? AND heartbeat_at >= ?)",
+                (since, STATUS_RUNNING, since)).fetchone()
+        return row[0]
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    # ---- worker side --------------------------------------------------------
+    def _expire_leases(self, conn: sqlite3.Connection, now: float) -> None:
+        """Requeues running jobs whose worker stopped sending heartbeats (fails them after max attempts)."""
+        stale = conn.execute("SELECT job_id, attempts FROM jobs WHERE status = ? AND heartbeat_at < ?",
+                             (STATUS_RUNNING, now - self.lease_seconds)).fetchall()
+        for row in stale:
+            if row["attempts"] >= self.max_attempts:
+                conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                             (STATUS_FAILED, "Worker stopped responding", now, row["job_id"]))
+            else:
+                conn.execute("UPDATE jobs SET status = ?, worker = NULL WHERE job_id = ?",
+                             (STATUS_QUEUED, row["job_id"]))
+            logging.warning(f"Job {row['job_id']}: lease expired after attempt {row['attempts']}")
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """Atomically takes the oldest queued job, or returns None."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO workers (worker, seen_at) VALUES (?, ?)", (worker, now))
+            conn.execute("DELETE FROM workers WHERE seen_at < ?", (now - 86400,))
+            self._expire_leases(conn, now)
+            row = conn.execute("SELECT job_id FROM jobs WHERE status = ? ORDER BY submitted_at LIMIT 1",
+                               (STATUS_QUEUED,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            # A retried job starts over, so its earlier updates are dropped
+            conn.execute("DELETE FROM job_updates WHERE job_id = ?", (row["job_id"],))
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, error = NULL, live = NULL, "
+                "started_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                (STATUS_RUNNING, worker, now, now, row["job_id"]))
+            claimed = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row["job_id"],)).fetchone()
+            conn.execute("COMMIT")
+            return Job.from_row(claimed)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _owned_write(self, job_id: str, worker: str, statements) -> None:
+        """
+        Runs `statements` in one transaction if the job is still running under
+        `worker`, else raises JobLeaseLost and writes nothing.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            owned = conn.execute("SELECT 1 FROM jobs WHERE job_id = ? AND worker = ? AND status = ?",
+                                 (job_id, worker, STATUS_RUNNING)).fetchone()
+            if owned is None:
+                conn.execute("ROLLBACK")
+                raise JobLeaseLost(f"Job {job_id} is no longer running under {worker}")
+            for sql, params in statements:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def add_update(self, job_id: str, seq: int, update: Dict[str, Any], worker: str) -> None:
+        """Stores a step update; the step's partial answer is no longer needed."""
+        self._owned_write(job_id, worker, [
+            ("INSERT OR REPLACE INTO job_updates (job_id, seq, step_name, payload) VALUES (?, ?, ?, ?)",
+             (job_id, seq, update["step_name"], encode_update(update))),
+            ("UPDATE jobs SET live = NULL, heartbeat_at = ? WHERE job_id = ?", (time.time(), job_id)),
+        ])
+
+    def set_live(self, job_id: str, live: Dict[str, str], worker: str) -> None:
+        self._owned_write(job_id, worker, [
+            ("UPDATE jobs SET live = ?, heartbeat_at = ? WHERE job_id = ?", (json.dumps(live), time.time(), job_id)),
+        ])
+
+    def finish(self, job_id: str, status: str, worker: str, error: Optional[str] = None) -> None:
+        self._owned_write(job_id, worker, [
+            ("UPDATE jobs SET status = ?, error = ?, live = NULL, finished_at = ? WHERE job_id = ?",
+             (status, error, time.time(), job_id)),
+        ])
+
+
+def run_job(job_queue: JobQueue, job: Job) -> None:
+    """
+    Runs one claimed job to completion and stores every update. Stops without
+    finishing the job once it no longer runs under `job.worker`.
+    """
+    from src.workflows.dispute_resolution_workflow import resolve_dispute
+    seq = 0
+    live: Dict[str, str] = {}
+    live_written = 0.0
+    updates = resolve_dispute(job.prompt, job.approval_threshold, stream=True)
+    try:
+        try:
+            for update in updates:
+                if update.get("partial"):
+                    live[update["step_name"]] = update["text"]
+                    if time.monotonic() - live_written >= JOB_LIVE_TEXT_INTERVAL_SECONDS:
+                        job_queue.set_live(job.job_id, live, job.worker)
+                        live_written = time.monotonic()
+                    continue
+                live.pop(update["step_name"], None)
+                job_queue.add_update(job.job_id, seq, update, job.worker)
+                seq += 1
+        except JobLeaseLost:
+            raise
+        except Exception as e:
+            logging.error(f"Job {job.job_id} failed: {e}", exc_info=True)
+            job_queue.finish(job.job_id, STATUS_FAILED, job.worker, f"{type(e).__name__}: {e}")
+        else:
+            job_queue.finish(job.job_id, STATUS_DONE, job.worker)
+    except JobLeaseLost as e:
+        logging.warning(f"{e}; dropping this run")
+    finally:
+        updates.close()   # shuts down the workflow's event loop now, not whenever the generator is collected
+
+
+class WorkerPool:
+    """Threads that claim and run queued jobs until stopped."""
+
+    def __init__(self, job_queue: JobQueue, workers: int = JOB_WORKERS, poll_seconds: float = JOB_POLL_SECONDS):
+        self.job_queue = job_queue
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _loop(self, worker: str) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.job_queue.claim(worker)
+            except sqlite3.Error as e:
+                logging.warning(f"{worker}: could not claim a job: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_seconds)
+                continue
+            logging.info(f"{worker}: running job {job.job_id} (dispute {job.dispute_id}, attempt {job.attempts})")
+            run_job(self.job_queue, job)
+
+    def start(self) -> "WorkerPool":
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, args=(f"{prefix}:worker-{i}",),
+                                      name=f"dispute-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Started {self.workers} dispute workers on {self.job_queue.path}")
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops claiming new jobs and waits for running ones to finish."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+_QUEUE: Optional[JobQueue] = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _QUEUE
+    with _QUEUE_LOCK:
+        if _QUEUE is None:
+            _QUEUE = JobQueue()
+        return _QUEUE
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Dispute job queue and workers")
+    parser.add_argument("--workers", type=int, default=0, help="run this many workers until interrupted")
+    parser.add_argument("--limit", type=int, default=20, help="jobs to list")
+    parser.add_argument("--metrics-port", type=int,
+                        default=int(JOB_WORKER_METRICS_PORT) if JOB_WORKER_METRICS_PORT else None,
+                        help="serve this process's dispute metrics at /metrics (default METRICS_PROMETHEUS_PORT)")
+    args = parser.parse_args()
+
+    job_queue = get_job_queue()
+    if args.workers:
+        from src.instrumentation import start_metrics_server
+        from src.workflows.dispute_resolution_workflow import warm_up_agents
+        try:
+            if start_metrics_server(args.metrics_port) is None:
+                logging.warning("No metrics port set: this worker's dispute metrics are not served "
+                                "(set JOB_WORKER_METRICS_PORT or --metrics-port)")
+        except OSError as e:
+            logging.error(f"Could not serve metrics on port {args.metrics_port}: {e}. "
+                          f"Give each worker process its own --metrics-port.")
+        warm_up_agents()
+        pool = WorkerPool(job_queue, workers=args.workers).start()
+        try:
+            while True:
+                time.sleep(60)
+                logging.info(f"Job queue: {job_queue.stats()}")
+        except KeyboardInterrupt:
+            logging.info("Stopping workers after their current jobs...")
+            pool.stop()
+    else:
+        print(f"Job queue {job_queue.path}: {job_queue.stats()}")
+        for job in job_queue.recent(args.limit):
+            print(f"{job.job_id[:8]}  {job.status:<8} {job.dispute_id:<28} attempts {job.attempts}  "
+                  f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job.submitted_at))}"
+                  + (f"  {job.error}" if job.error else ""))
@@ -0,0 +1,219 @@
+"""
+load_test.py
+
+Offline load generator for the dispute workflow.
+
+Runs `resolve_dispute` for many disputes at a time and reports, per
+concurrency level:
+- throughput (disputes per second);
+- p50 / p95 / p99 of the end-to-end latency (from arrival to the last step);
+- how the latency splits into waiting for a free slot (disputes arrive
+  faster than `concurrency` can serve them) and service time;
+- queueing inside the workflow: agent calls waiting for a worker thread, and
+  agent builds when the pool had no idle agent;
+- errors.
+
+Disputes cycle through the `NLP Prompt` rows of the chargeback CSV. By
+default the fake agent backend (agent_backends.py) is used and the caches
+that would turn repeated prompts into free hits are switched off, so every
+dispute costs its agent calls:
+    python -m src.workflows.load_test --concurrency 1,4,16 --disputes 64 --time-scale 0.05
+    python -m src.workflows.load_test --rate 2 --concurrency 8        # open loop, 2 arrivals/s
+    python -m src.workflows.load_test --backend oci --disputes 8      # live endpoints
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Caches that make a repeated prompt skip its agents; off unless --warm-caches
+CACHE_SWITCHES = ("DECISION_CACHE_ENABLED", "RAG_CACHE_ENABLED", "CHECKPOINTS_ENABLED")
+
+
+def disable_caches() -> None:
+    """Must run before the workflow is imported, which reads these settings once."""
+    for name in CACHE_SWITCHES:
+        os.environ[name] = "false"
+
+
+def load_prompts(csv_path: Path = BASE_DIR / "Chargeback Analysis_ Dispute (1).csv") -> List[str]:
+    from src.workflows.batch_runner import iter_disputes
+    return [d["prompt"] for d in iter_disputes(csv_path)]
+
+
+@dataclass
+class DisputeSample:
+    arrival: float             # seconds since the run started
+    slot_wait: float = 0.0     # arrival -> start (waiting for one of the `concurrency` slots)
+    service: float = 0.0       # start -> last step
+    latency: float = 0.0       # arrival -> last step
+    agent_calls: int = 0
+    agent_queue_wait: float = 0.0
+    decided_by: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class LoadReport:
+    concurrency: int
+    disputes: int
+    rate: float
+    elapsed_seconds: float = 0.0
+    throughput: float = 0.0
+    errors: int = 0
+    latency: Dict[str, float] = field(default_factory=dict)
+    service: Dict[str, float] = field(default_factory=dict)
+    slot_wait: Dict[str, float] = field(default_factory=dict)
+    agent_queue_wait: Dict[str, float] = field(default_factory=dict)
+    agent_calls: int = 0
+    agent_builds: int = 0
+    decided_by: Dict[str, int] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    from src.workflows.batch_runner import percentile
+    return {f"p{p}": round(percentile(values, p), 4) for p in (50, 95, 99)} | {
+        "mean": round(sum(values) / len(values), 4) if values else 0.0}
+
+
+def _run_one(prompt: str, approval_threshold: float, sample: DisputeSample, run_start: float) -> DisputeSample:
+    from src.workflows.dispute_resolution_workflow import resolve_dispute
+    started = time.perf_counter()
+    sample.slot_wait = max(0.0, started - run_start - sample.arrival)
+    try:
+        for step in resolve_dispute(prompt, approval_threshold):
+            for call in step.get("metrics", {}).get("agent_calls", []):
+                sample.agent_calls += 1
+                sample.agent_queue_wait += call["queue_wait_seconds"]
+            if step["is_final"] or step["step_name"] == "Human Approval Required":
+                sample.decided_by = step["data"].get("decided_by", "llm")
+    except Exception as e:
+        sample.error = f"{type(e).__name__}: {e}"
+    finished = time.perf_counter()
+    sample.service = finished - started
+    sample.latency = finished - run_start - sample.arrival
+    return sample
+
+
+def run_load(prompts: List[str], concurrency: int, disputes: int, rate: float = 0.0,
+             approval_threshold: float = 500.0, seed: int = 0) -> LoadReport:
+    """
+    Submits `disputes` disputes to `concurrency` workers. With `rate` > 0 they
+    arrive as a Poisson process at `rate` per second (open loop), otherwise
+    all at once.
+    """
+    from src.agents.agent_pool import AGENT_POOL
+    rng = random.Random(seed)
+    arrivals, t = [], 0.0
+    for _ in range(disputes):
+        arrivals.append(t)
+        if rate > 0:
+            t += rng.expovariate(rate)
+    builds_before = sum(s["builds"] for s in AGENT_POOL.stats().values())
+
+    samples: List[DisputeSample] = []
+    lock = threading.Lock()
+    run_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as executor:
+        futures = []
+        for i, arrival in enumerate(arrivals):
+            delay = run_start + arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sample = DisputeSample(arrival=arrival)
+            futures.append(executor.submit(_run_one, prompts[i % len(prompts)], approval_threshold,
+                                           sample, run_start))
+        for future in futures:
+            with lock:
+                samples.append(future.result())
+    elapsed = time.perf_counter() - run_start
+
+    ok = [s for s in samples if s.error is None]
+    return LoadReport(
+        concurrency=concurrency, disputes=disputes, rate=rate,
+        elapsed_seconds=round(elapsed, 3),
+        throughput=round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        errors=len(samples) - len(ok),
+        latency=_percentiles([s.latency for s in ok]),
+        service=_percentiles([s.service for s in ok]),
+        slot_wait=_percentiles([s.slot_wait for s in ok]),
+        agent_queue_wait=_percentiles([s.agent_queue_wait for s in ok]),
+        agent_calls=sum(s.agent_calls for s in samples),
+        agent_builds=sum(s["builds"] for s in AGENT_POOL.stats().values()) - builds_before,
+        decided_by=dict(Counter(s.decided_by for s in ok)),
+    )
+
+
+def format_reports(reports: List[LoadReport]) -> str:
+    lines = [
+        "=" * 104,
+        f"{'conc':>4} {'n':>5} {'disp/s':>7} {'errors':>6}   {'latency p50/p95/p99 (s)':<26} "
+        f"{'service p50/p95':<17} {'slot wait p95':>13} {'agent q p95':>11} {'builds':>6}",
+        "-" * 104,
+    ]
+    for r in reports:
+        lines.append(
+            f"{r.concurrency:>4} {r.disputes:>5} {r.throughput:>7.2f} {r.errors:>6}   "
+            f"{r.latency['p50']:>7.2f} {r.latency['p95']:>8.2f} {r.latency['p99']:>8.2f}   "
+            f"{r.service['p50']:>7.2f} {r.service['p95']:>8.2f} {r.slot_wait['p95']:>13.2f} "
+            f"{r.agent_queue_wait['p95']:>11.3f} {r.agent_builds:>6}")
+    lines.append("=" * 104)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of resolve_dispute")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--disputes", type=int, default=32, help="disputes per level")
+    parser.add_argument("--rate", type=float, default=0.0, help="arrivals per second (0: all at once)")
+    parser.add_argument("--backend", choices=("fake", "oci"), default="fake")
+    parser.add_argument("--time-scale", type=float, help="scale the fake agents' latencies (e.g. 0.05)")
+    parser.add_argument("--error-rate", type=float, help="failure rate of every fake agent call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--approval-threshold", type=float, default=500.0)
+    parser.add_argument("--warm-caches", action="store_true", help="keep the decision/RAG/checkpoint caches on")
+    parser.add_argument("--output", help="write the reports as JSON to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not args.warm_caches:
+        disable_caches()
+    # Imported only now so that the settings above are seen by the workflow modules
+    import src.workflows.dispute_resolution_workflow  # noqa: F401  (registers the agents)
+    from src.agents.agent_backends import FakeAgentBackend, FakeProfile
+    from src.agents.agent_pool import AGENT_POOL, get_backend
+
+    if args.backend == "fake":
+        profile = FakeProfile(seed=args.seed)
+        if args.time_scale is not None:
+            profile.time_scale = args.time_scale
+        if args.error_rate is not None:
+            profile.error_rates = {"*": args.error_rate}
+        AGENT_POOL.set_backend(FakeAgentBackend(profile))
+    else:
+        AGENT_POOL.set_backend(get_backend("oci"))
+
+    all_prompts = load_prompts()
+    results = []
+    for level in (int(c) for c in args.concurrency.split(",")):
+        results.append(run_load(all_prompts, level, args.disputes, args.rate, args.approval_threshold, args.seed))
+        print(f"concurrency {level}: {results[-1].throughput:.2f} disputes/s, "
+              f"p95 {results[-1].latency['p95']:.2f}s, decided by {results[-1].decided_by}")
+    print(format_reports(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([r.to_dict() for r in results], f, indent=2)
@@ -0,0 +1,444 @@
+"""
+refund_pipeline.py
+
+Idempotent refund execution stage: turns an accepted dispute decision into at
+most one Oracle Receivables credit memo.
+
+Every refund is keyed on "<account_number>:<transaction_number>" in a SQLite
+ledger that is shared by all threads and processes on the host:
+1. Claim: inside a `BEGIN IMMEDIATE` transaction the key is inserted with
+   status "submitting". Only the caller that inserted the row submits; every
+   other caller (retry, re-submitted dispute, another process) gets the
+   recorded outcome back with `duplicate=True`. Threads in one process also
+   serialize on a per-key lock, so an in-process duplicate waits for the final
+   result instead of seeing "submitting".
+2. Submit: the credit memo is created through `Credit_Memo_Tool`, billed to
+   the disputing customer (business unit and customer name come from the
+   customer row or the disputed transaction; a refund without them raises
+   RefundError and is never submitted). The ledger row is written before the
+   POST, so a memo is never requested twice.
+3. Record: "succeeded" (with the memo ID), "rejected" (Fusion answered with a
+   4xx, so nothing was created and the refund may be retried explicitly) or
+   "unknown" (timeout, 5xx or crash: a memo may exist).
+4. Recover: rows left in "submitting" by a dead process are moved to
+   "unknown". Unknown refunds are never resubmitted automatically; an
+   operator settles them with `resolve_unknown()` after checking Fusion.
+
+Usage:
+    python -m src.workflows.refund_pipeline                  # list refunds that need review
+    python -m src.workflows.refund_pipeline --stress --keys 50 --duplicates 40 --processes 4
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from src.agents.db_result import DbQueryResult
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+load_dotenv(BASE_DIR / "config/.env")
+
+REFUND_LEDGER_PATH = os.getenv("REFUND_LEDGER_PATH", str(BASE_DIR / ".cache" / "refund_ledger.db"))
+# Issue credit memos for accepted disputes (auto-accepted or human-approved); off by default
+REFUND_EXECUTION_ENABLED = os.getenv("REFUND_EXECUTION_ENABLED", "false").lower() == "true"
+# A "submitting" row older than this is treated as interrupted even if its owner looks alive
+REFUND_SUBMIT_TIMEOUT_SECONDS = float(os.getenv("REFUND_SUBMIT_TIMEOUT_SECONDS", "300"))
+
+LEDGER_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS refunds (
+        idempotency_key TEXT PRIMARY KEY,
+        account_number TEXT NOT NULL,
+        transaction_number TEXT NOT NULL,
+        amount REAL NOT NULL,
+        currency_code TEXT NOT NULL,
+        status TEXT NOT NULL,
+        credit_memo_id TEXT,
+        payload TEXT NOT NULL,
+        response TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        owner_host TEXT NOT NULL,
+        owner_pid INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+"""
+
+STATUS_SUBMITTING, STATUS_SUCCEEDED, STATUS_REJECTED, STATUS_UNKNOWN = "submitting", "succeeded", "rejected", "unknown"
+
+# Credit memo fields read from the customer row / disputed transaction (column names, case-insensitive)
+PARTY_FIELDS = ("business_unit", "customer_name", "ship_to_customer_number", "ship_to_site")
+
+
+class RefundError(ValueError):
+    """Raised when a refund request cannot be built from the dispute data."""
+
+
+@dataclass
+class RefundRequest:
+    account_number: str
+    transaction_number: str
+    amount: float
+    currency_code: str = "USD"
+    reason: str = ""
+    product: Optional[str] = None
+    business_unit: Optional[str] = None
+    customer_name: Optional[str] = None
+    ship_to_customer_number: Optional[str] = None
+    ship_to_site: Optional[str] = None
+
+    @property
+    def idempotency_key(self) -> str:
+        return f"{self.account_number}:{self.transaction_number}"
+
+
+def credit_memo_party(db_result: DbQueryResult) -> Dict[str, Optional[str]]:
+    """
+    PARTY_FIELDS of the disputed customer: from the disputed transaction's
+    extra columns first, then the customer row's. Missing fields are None.
+    """
+    transaction = db_result.disputed_transaction
+    sources = ([transaction.extra] if transaction is not None else []) + [db_result.user_info.extra]
+    party = {}
+    for name in PARTY_FIELDS:
+        values = [v for extra in sources for k, v in extra.items() if str(k).lower() == name and v not in (None, "")]
+        party[name] = str(values[0]) if values else None
+    return party
+
+
+def refund_request_from(db_result: DbQueryResult, decision: dict) -> RefundRequest:
+    """Builds the refund for the disputed transaction of an accepted decision."""
+    transaction = db_result.disputed_transaction
+    if transaction is None or transaction.amount is None:
+        raise RefundError(db_result.parse_error or "No disputed transaction with an amount in the customer data")
+    account_number = transaction.account_number or db_result.user_info.account_number
+    if not account_number or not transaction.transaction_number:
+        raise RefundError("Account or transaction number missing for the disputed transaction")
+    return RefundRequest(account_number=account_number, transaction_number=transaction.transaction_number,
+                         amount=abs(transaction.amount), currency_code=transaction.currency_code or "USD",
+                         reason=decision.get("reason") or "", product=transaction.product,
+                         **credit_memo_party(db_result))
+
+
+def build_credit_memo_payload(request: RefundRequest) -> dict:
+    """
+    Credit memo payload for a refund, billed to the disputing customer's
+    account. Raises RefundError when the business unit or customer name is
+    unknown, so no memo is ever issued to a placeholder customer.
+    """
+    missing = [name for name in ("business_unit", "customer_name") if not getattr(request, name)]
+    if missing:
+        raise RefundError(f"Refund {request.idempotency_key}: {', '.join(missing)} missing from the customer data")
+    payload = {
+        "BusinessUnit": request.business_unit,
+        "TransactionSource": "Manual",
+        "TransactionType": "Credit Memo",
+        "TransactionDate": date.today().isoformat(),
+        "CreditMemoCurrency": request.currency_code,
+        "BillToCustomerName": request.customer_name,
+        "BillToCustomerNumber": request.account_number,
+        # The idempotency key travels with the memo so it can be found in Fusion during review
+        "CreditMemoComments": f"Dispute refund {request.idempotency_key}: {request.reason}"[:240],
+        "receivablesCreditMemoLines": [{
+            "LineDescription": f"Refund for transaction {request.transaction_number}"
+                               + (f" ({request.product})" if request.product else ""),
+            "LineNumber": 1,
+            "LineQuantityCredit": 1,
+            "UnitSellingPrice": -round(request.amount, 2),
+        }],
+    }
+    if request.ship_to_site:
+        payload.update({
+            "ShipToCustomerName": request.customer_name,
+            "ShipToCustomerNumber": request.ship_to_customer_number or request.account_number,
+            "ShipToCustomerSite": request.ship_to_site,
+        })
+    return payload
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RefundLedger:
+    """SQLite idempotency ledger; safe to share between threads and processes on one host."""
+
+    def __init__(self, path=REFUND_LEDGER_PATH):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(LEDGER_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation keeps this usable from any thread or process
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def claim(self, request: RefundRequest, payload: dict, retry_rejected: bool = False):
+        """
+        Atomically claims `request` for submission. Returns (claimed, row): only
+        a caller with claimed=True may submit the credit memo.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM refunds WHERE idempotency_key = ?",
+                               (request.idempotency_key,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO refunds (idempotency_key, account_number, transaction_number, amount, currency_code, "
+                    "status, payload, owner_host, owner_pid, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (request.idempotency_key, request.account_number, request.transaction_number, request.amount,
+                     request.currency_code, STATUS_SUBMITTING, json.dumps(payload), socket.gethostname(),
+                     os.getpid(), now, now))
+                claimed = True
+            elif row["status"] == STATUS_REJECTED and retry_rejected:
+                conn.execute(
+                    "UPDATE refunds SET status = ?, attempts = attempts + 1, payload = ?, error = NULL, "
+                    "owner_host = ?, owner_pid = ?, updated_at = ? WHERE idempotency_key = ?",
+                    (STATUS_SUBMITTING, json.dumps(payload), socket.gethostname(), os.getpid(), now,
+                     request.idempotency_key))
+                claimed = True
+            else:
+                claimed = False
+            conn.execute("COMMIT")
+            return claimed, self.get(request.idempotency_key) if claimed else dict(row)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def finish(self, key: str, status: str, credit_memo_id: Optional[str] = None,
+               response: Optional[dict] = None, error: Optional[str] = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE refunds SET status = ?, credit_memo_id = ?, response = ?, error = ?, updated_at = ? "
+                "WHERE idempotency_key = ?",
+                (status, credit_memo_id, json.dumps(response) if response is not None else None, error,
+                 time.time(), key))
+
+    def get(self, key: str) -> Optional[dict]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM refunds WHERE idempotency_key = ?", (key,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def list(self, statuses=None) -> List[dict]:
+        conn = self._connect()
+        try:
+            if statuses:
+                marks = ",".join("?" * len(statuses))
+                rows = conn.execute(f"SELECT * FROM refunds WHERE status IN ({marks}) ORDER BY created_at",
+                                    tuple(statuses)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM refunds ORDER BY created_at").fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def recover(self, stale_after_seconds: float = REFUND_SUBMIT_TIMEOUT_SECONDS) -> int:
+        """
+        Moves submissions interrupted by a crash to "unknown". A row is
+        interrupted when its owner process on this host is gone, or when it has
+        been submitting for longer than `stale_after_seconds`.
+        """
+        host, now, recovered = socket.gethostname(), time.time(), 0
+        for row in self.list([STATUS_SUBMITTING]):
+            owner_gone = row["owner_host"] == host and row["owner_pid"] != os.getpid() and not _pid_alive(row["owner_pid"])
+            if owner_gone or now - row["updated_at"] > stale_after_seconds:
+                with self._connect() as conn:
+                    recovered += conn.execute(
+                        "UPDATE refunds SET status = ?, error = ?, updated_at = ? "
+                        "WHERE idempotency_key = ? AND status = ? AND updated_at = ?",
+                        (STATUS_UNKNOWN, "Interrupted during submission; check Fusion before settling",
+                         now, row["idempotency_key"], STATUS_SUBMITTING, row["updated_at"])).rowcount
+        if recovered:
+            logging.warning(f"Refund ledger: {recovered} interrupted submission(s) need review")
+        return recovered
+
+    def resolve_unknown(self, key: str, credit_memo_id: Optional[str] = None) -> bool:
+        """
+        Settles an "unknown" refund after checking Fusion: with the memo ID it
+        becomes "succeeded", without one "rejected" (so it may be retried).
+        """
+        status = STATUS_SUCCEEDED if credit_memo_id else STATUS_REJECTED
+        error = None if credit_memo_id else "Settled by operator: no credit memo found in Fusion"
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE refunds SET status = ?, credit_memo_id = ?, error = ?, updated_at = ? "
+                "WHERE idempotency_key = ? AND status = ?",
+                (status, credit_memo_id, error, time.time(), key, STATUS_UNKNOWN)).rowcount == 1
+
+
+class RefundPipeline:
+    """
+    Executes refunds at most once per (account, transaction).
+    `tool_factory` returns a `Credit_Memo_Tool` (a fresh default tool when omitted).
+    """
+
+    def __init__(self, ledger: Optional[RefundLedger] = None, tool_factory: Optional[Callable[[], object]] = None,
+                 lock_stripes: int = 256):
+        self.ledger = ledger or RefundLedger()
+        self._tool_factory = tool_factory
+        self._tool = None
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    def _get_tool(self):
+        if self._tool is None:
+            if self._tool_factory is None:
+                from src.agent_tool_kits.credit_memo_tool import Credit_Memo_Tool
+                self._tool_factory = Credit_Memo_Tool
+            self._tool = self._tool_factory()
+        return self._tool
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    def execute(self, request: RefundRequest, retry_rejected: bool = False) -> Dict:
+        """
+        Issues the credit memo for `request` unless the ledger already has it.
+        Returns {"idempotency_key", "status", "credit_memo_id", "duplicate", "error"}.
+        Raises RefundError, before anything is claimed, when the memo cannot be built.
+        """
+        key = request.idempotency_key
+        with self._lock_for(key):
+            payload = build_credit_memo_payload(request)
+            claimed, row = self.ledger.claim(request, payload, retry_rejected=retry_rejected)
+            if not claimed:
+                return {"idempotency_key": key, "status": row["status"], "credit_memo_id": row["credit_memo_id"],
+                        "duplicate": True, "error": row["error"]}
+
+            try:
+                result = self._get_tool().create_credit_memo(payload)
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}", "status_code": None}
+
+            if isinstance(result, dict) and result.get("CustomerTransactionId"):
+                status, memo_id, error = STATUS_SUCCEEDED, str(result["CustomerTransactionId"]), None
+            else:
+                error = result.get("error") if isinstance(result, dict) else f"Unexpected response: {result!r}"
+                status_code = result.get("status_code") if isinstance(result, dict) else None
+                # A 4xx means Fusion refused the request; anything else may have created the memo
+                definite = status_code is not None and 400 <= status_code < 500
+                status, memo_id = (STATUS_REJECTED if definite else STATUS_UNKNOWN), None
+                logging.error(f"Refund {key} {status}: {error}")
+            self.ledger.finish(key, status, memo_id, result if isinstance(result, dict) else None, error)
+            return {"idempotency_key": key, "status": status, "credit_memo_id": memo_id,
+                    "duplicate": False, "error": error}
+
+
+_pipeline: Optional[RefundPipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_refund_pipeline() -> RefundPipeline:
+    """Process-wide pipeline; recovers interrupted submissions on first use."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = RefundPipeline()
+            _pipeline.ledger.recover()
+    return _pipeline
+
+
+def execute_refund(request: RefundRequest, retry_rejected: bool = False) -> Dict:
+    return get_refund_pipeline().execute(request, retry_rejected=retry_rejected)
+
+
+# ────────────────────────────────────────────────────────
+# Stress test
+# ────────────────────────────────────────────────────────
+def _stress_worker(ledger_path: str, fusion_url: str, keys: int, duplicates: int, threads: int) -> List[Dict]:
+    from src.agent_tool_kits.credit_memo_tool import Credit_Memo_Tool
+    pipeline = RefundPipeline(RefundLedger(ledger_path),
+                              tool_factory=lambda: Credit_Memo_Tool("stress", "stress", fusion_url, cache=None))
+    requests_ = [RefundRequest(f"{5931479520 + k}", f"P-{1234567890 + k}", 50.0 + k,
+                               business_unit="Stress BU", customer_name=f"Stress customer {k}")
+                 for _ in range(duplicates) for k in range(keys)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(pipeline.execute, requests_))
+
+
+def run_stress_test(keys: int = 50, duplicates: int = 40, processes: int = 4, threads: int = 32,
+                    latency_seconds: float = 0.01) -> Dict:
+    """
+    Fires keys x duplicates x processes concurrent refund requests (every key
+    repeated many times, from several processes at once) against the mock
+    Fusion server and checks that exactly one memo was created per key.
+    """
+    import contextlib
+    import io
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    from src.agent_tool_kits.mock_fusion_server import MockFusionServer
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            MockFusionServer(latency_seconds=latency_seconds) as server, \
+            contextlib.redirect_stdout(io.StringIO()):
+        ledger_path = str(Path(tmp) / "ledger.db")
+        RefundLedger(ledger_path)
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_stress_worker, ledger_path, server.url, keys, duplicates, threads)
+                       for _ in range(processes)]
+            outcomes = [outcome for future in futures for outcome in future.result()]
+        elapsed = time.perf_counter() - start
+        ledger = RefundLedger(ledger_path)
+        return {
+            "requests": len(outcomes),
+            "unique_keys": keys,
+            "memos_created": server.stats["created"],
+            "submitted": sum(1 for o in outcomes if not o["duplicate"]),
+            "succeeded_in_ledger": len(ledger.list([STATUS_SUCCEEDED])),
+            "seconds": elapsed,
+            "passed": server.stats["created"] == keys and len(ledger.list([STATUS_SUCCEEDED])) == keys,
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Refund ledger review and duplicate-refund stress test.")
+    parser.add_argument("--stress", action="store_true")
+    parser.add_argument("--keys", type=int, default=50)
+    parser.add_argument("--duplicates", type=int, default=40, help="requests per key per process")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=32, help="threads per process")
+    args = parser.parse_args()
+
+    if args.stress:
+        report = run_stress_test(args.keys, args.duplicates, args.processes, args.threads)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["passed"] else 1)
+
+    refund_ledger = RefundLedger()
+    refund_ledger.recover()
+    for entry in refund_ledger.list([STATUS_UNKNOWN, STATUS_REJECTED]):
+        print(f"{entry['status'].upper():<9} {entry['idempotency_key']:<28} {entry['amount']:>10.2f} "
+              f"{entry['currency_code']}  {entry['error']}")